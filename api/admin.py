@@ -5,6 +5,11 @@ from .models import (
     User, UserProfile, TherapistProfile, ClientProfile, InviteCode,
     Skill, Language, TherapistPhoto, Publication
 )
+from .admin_pagination import ScalableAdminMixin
+from .models import ModerationAction, ModerationActionType, AvailabilityRule, AvailabilityException, Booking, Conversation, Message
+from .models import NotificationKind, OutboxMessage, DataExport, AccountDeletion
+from .moderation import moderate_therapists
+from . import deletion, outbox
 
 # --- Регистрация новых моделей ---
 @admin.register(Skill)
@@ -33,9 +38,10 @@ class UserProfileInline(admin.StackedInline):
 
 class TherapistProfileInline(admin.StackedInline):
     model = TherapistProfile
+    fk_name = 'user'
     can_delete = False
     verbose_name_plural = 'Therapist Profile'
-    fields = ('about', 'experience_years', 'skills', 'languages', 'total_hours_worked', 'display_hours', 'office_location', 'is_verified', 'is_subscribed')
+    fields = ('about', 'experience_years', 'skills', 'languages', 'total_hours_worked', 'display_hours', 'office_location', 'city', 'works_online', 'is_verified', 'is_subscribed', 'subscribed_until')
     filter_horizontal = ('skills', 'languages',)
 
 class ClientProfileInline(admin.StackedInline):
@@ -45,9 +51,11 @@ class ClientProfileInline(admin.StackedInline):
     fields = ('request_details', 'interested_topics')
     filter_horizontal = ('interested_topics',)
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(ScalableAdminMixin, BaseUserAdmin):
     inlines = (UserProfileInline, TherapistProfileInline, ClientProfileInline)
     list_display = ('email', 'first_name', 'last_name', 'is_staff', 'get_role', 'get_verification_status')
+    # Профили для get_role/get_verification_status приходят одним JOIN
+    list_select_related = ('profile', 'therapist_profile')
     search_fields = ('email', 'first_name', 'last_name')
     ordering = ('email',)
     fieldsets = (
@@ -57,11 +65,20 @@ class UserAdmin(BaseUserAdmin):
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
     )
 
+    # Удаление из админки тоже уходит в фон: аккаунт отключается, данные удаляет воркер
+    def delete_model(self, request, obj):
+        deletion.schedule(obj, requested_by=request.user)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            deletion.schedule(user, requested_by=request.user)
+
     @admin.display(description='Role')
     def get_role(self, obj):
         try:
             return obj.profile.get_role_display()
-        except: return 'N/A'
+        except UserProfile.DoesNotExist:
+            return 'N/A'
 
     @admin.display(description='Verified (Therapist)')
     def get_verification_status(self, obj):
@@ -83,14 +100,26 @@ class TherapistPhotoInline(admin.TabularInline):  # Используем Tabular
     readonly_fields = ('display_image',)
 
     def display_image(self, obj):
-        if obj.image:
-            return format_html('<img src="{}" height="50" />', obj.image.url)
+        if obj.url:
+            return format_html('<img src="{}" height="50" />', obj.url)
         return "Нет фото"
     display_image.short_description = 'Превью'
 
+class AvailabilityRuleInline(admin.TabularInline):
+    model = AvailabilityRule
+    extra = 0
+    fields = ('weekday', 'start_time', 'end_time', 'slot_minutes', 'valid_from', 'valid_until')
+
+
+class AvailabilityExceptionInline(admin.TabularInline):
+    model = AvailabilityException
+    extra = 0
+    fields = ('starts_at', 'ends_at', 'is_available', 'note')
+
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'role', 'gender', 'profile_picture_preview')
+    list_select_related = ('user',)
     list_filter = ('role', 'gender')
     search_fields = ('user__email', 'user__first_name', 'user__last_name')
     raw_id_fields = ('user',)
@@ -102,14 +131,17 @@ class UserProfileAdmin(admin.ModelAdmin):
     profile_picture_preview.short_description = 'Фото профиля'
 
 @admin.register(TherapistProfile)
-class TherapistProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'is_verified', 'is_subscribed', 'experience_years', 'display_hours', 'status')
-    list_filter = ('is_verified', 'is_subscribed', 'display_hours', 'status', 'languages', 'skills')
+class TherapistProfileAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'is_verified', 'is_subscribed', 'subscribed_until', 'experience_years', 'display_hours', 'status')
+    list_select_related = ('user',)
+    # Фильтры по M2M админка применяет через EXISTS, без DISTINCT по всей выборке
+    list_filter = ('is_verified', 'is_subscribed', 'works_online', 'display_hours', 'status', 'languages', 'skills')
     search_fields = ('user__email', 'user__first_name', 'user__last_name', 'about')
-    list_editable = ('is_verified', 'is_subscribed', 'display_hours')
     raw_id_fields = ('user',)
     filter_horizontal = ('skills', 'languages',)
-    inlines = [TherapistPhotoInline]
+    inlines = [TherapistPhotoInline, AvailabilityRuleInline, AvailabilityExceptionInline]
+    actions = ['verify', 'unverify', 'subscribe', 'unsubscribe']
+    readonly_fields = ('view_count', 'moderated_by', 'moderated_at')
 
     fields = (
         'user',
@@ -120,38 +152,125 @@ class TherapistProfileAdmin(admin.ModelAdmin):
         'total_hours_worked',
         'display_hours',
         'office_location',
+        'city',
+        'latitude',
+        'longitude',
+        'works_online',
+        'timezone',
         'status',
         'short_video_url',
-        'photos',
         'is_verified',
-        'is_subscribed'
+        'is_subscribed',
+        'subscribed_until',
+        'view_count',
+        'moderated_by',
+        'moderated_at'
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Форма сохраняется в транзакции админки — письмо уйдёт вместе с ней
+        if change and 'is_verified' in form.changed_data:
+            outbox.enqueue(NotificationKind.VERIFICATION_CHANGED, [obj.user.email], is_verified=obj.is_verified)
+
+    # Массовые действия: один UPDATE на всю выборку вместо save() по строкам
+    def _moderate(self, request, queryset, action):
+        updated = moderate_therapists(queryset, action, request.user)
+        self.message_user(request, f'{ModerationActionType(action).label}: изменено профилей — {len(updated)}')
+
+    @admin.action(description='Верифицировать выбранных терапевтов')
+    def verify(self, request, queryset):
+        self._moderate(request, queryset, ModerationActionType.VERIFY)
+
+    @admin.action(description='Снять верификацию с выбранных терапевтов')
+    def unverify(self, request, queryset):
+        self._moderate(request, queryset, ModerationActionType.UNVERIFY)
+
+    @admin.action(description='Включить подписку выбранным терапевтам')
+    def subscribe(self, request, queryset):
+        self._moderate(request, queryset, ModerationActionType.SUBSCRIBE)
+
+    @admin.action(description='Отключить подписку выбранным терапевтам')
+    def unsubscribe(self, request, queryset):
+        self._moderate(request, queryset, ModerationActionType.UNSUBSCRIBE)
+
 @admin.register(ClientProfile)
 class ClientProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'user__first_name', 'user__last_name', 'request_details')
     raw_id_fields = ('user',)
     filter_horizontal = ('interested_topics',)
 
 @admin.register(InviteCode)
-class InviteCodeAdmin(admin.ModelAdmin):
+class InviteCodeAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('code', 'is_used', 'created_by', 'created_at')
+    list_select_related = ('created_by',)
     list_filter = ('is_used',)
     search_fields = ('code', 'created_by__email')
     readonly_fields = ('created_at',)
 
 # Админка для Публикаций
 @admin.register(Publication)
-class PublicationAdmin(admin.ModelAdmin):
+class PublicationAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'author_email', 'created_at', 'updated_at')
-    list_filter = ('author',)
+    list_select_related = ('author',)
+    # Фильтр по автору выводил бы в сайдбар всех пользователей; автора ищем через поиск
     search_fields = ('title', 'content', 'author__email')
     raw_id_fields = ('author',)
-    readonly_fields = ('created_at', 'updated_at')
-    fields = ('author', 'title', 'content', 'created_at', 'updated_at')
+    readonly_fields = ('read_count', 'created_at', 'updated_at')
+    fields = ('author', 'title', 'content', 'read_count', 'created_at', 'updated_at')
 
     def author_email(self, obj):
         return obj.author.email
     author_email.short_description = 'Автор'
     author_email.admin_order_field = 'author__email'
+
+@admin.register(ModerationAction)
+class ModerationActionAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('action', 'affected', 'actor', 'created_at')
+    list_filter = ('action',)
+    list_select_related = ('actor',)
+    readonly_fields = ('action', 'actor', 'therapist_ids', 'affected', 'created_at')
+
+@admin.register(Booking)
+class BookingAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('starts_at', 'therapist', 'client', 'status', 'created_at')
+    list_filter = ('status',)
+    list_select_related = ('therapist__user', 'client')
+    raw_id_fields = ('therapist', 'client')
+
+@admin.register(Conversation)
+class ConversationAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'client', 'therapist', 'last_message_at', 'created_at')
+    list_select_related = ('client', 'therapist__user')
+    raw_id_fields = ('client', 'therapist')
+
+@admin.register(Message)
+class MessageAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'conversation', 'sender', 'created_at', 'read_at')
+    list_select_related = ('sender',)
+    raw_id_fields = ('conversation', 'sender')
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'kind', 'recipient', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('recipient',)
+    readonly_fields = ('kind', 'recipient', 'subject', 'body', 'attempts', 'last_error', 'created_at', 'sent_at')
+
+@admin.register(DataExport)
+class DataExportAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'size', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('file', 'size', 'error', 'created_at', 'started_at', 'finished_at')
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'user_id', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('user_id',)
+    readonly_fields = (
+        'user_id', 'requested_by', 'progress', 'error', 'created_at', 'started_at', 'finished_at', 'attempts', 'retry_at',
+    )
@@ -0,0 +1,218 @@
+"""
+Списки админки для больших таблиц.
+
+EstimatedCountPaginator берёт число строк из статистики PostgreSQL
+(pg_class.reltuples или оценка планировщика через EXPLAIN), если таблица
+больше ADMIN_ESTIMATED_COUNT_THRESHOLD, вместо точного COUNT(*).
+
+KeysetChangeList листает по ключу сортировки (?after= / ?before=) вместо
+OFFSET: глубокие страницы стоят столько же, сколько первая.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.contrib.admin.views.main import ALL_VAR, ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+def _table_estimate(queryset):
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # -1 — таблица ещё ни разу не анализировалась
+    return row[0] if row and row[0] >= 0 else None
+
+
+def _plan_estimate(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_count(queryset):
+    """Оценка числа строк queryset без COUNT(*); None, если оценки нет."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    table_rows = _table_estimate(queryset)
+    if table_rows is None or table_rows < settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+        return None
+    if not queryset.query.where and not queryset.query.distinct:
+        return table_rows
+    estimate = _plan_estimate(queryset)
+    # На малых выборках оценка планировщика грубая, а точный счёт дешёвый
+    return estimate if estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD else None
+
+
+class EstimatedCountPaginator(Paginator):
+    count_is_estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None:
+            return super().count
+        self.count_is_estimated = True
+        return estimate
+
+
+def _encode_cursor(values):
+    # str() сохраняет микросекунды дат, в отличие от DjangoJSONEncoder
+    data = json.dumps(values, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList с keyset-пагинацией.
+
+    Работает, если итоговая сортировка состоит из имён полей без NULL
+    (админка сама добавляет pk для однозначности); иначе — обычный OFFSET.
+    В шаблоне вместо номеров страниц выводятся ссылки «первая/назад/вперёд».
+    """
+    keyset = False
+    keyset_previous_url = keyset_next_url = keyset_first_url = None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Смена фильтра или сортировки начинает список сначала
+        remove = [*(remove or ()), AFTER_VAR, BEFORE_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def _keyset_ordering(self, ordering):
+        """[(путь поля, по убыванию)] или None, если сортировка не подходит."""
+        terms = []
+        for term in ordering:
+            if not isinstance(term, str) or term == '?':
+                return None
+            descending = term.startswith('-')
+            path = term.lstrip('-')
+            model = self.model
+            parts = path.split('__')
+            for i, name in enumerate(parts):
+                if name == 'pk':
+                    field = model._meta.pk
+                else:
+                    try:
+                        field = model._meta.get_field(name)
+                    except FieldDoesNotExist:
+                        return None
+                if i < len(parts) - 1:
+                    if not field.many_to_one and not field.one_to_one:
+                        return None
+                    model = field.related_model
+                elif field.is_relation or field.null:
+                    return None
+            terms.append((path, descending))
+        return terms
+
+    @staticmethod
+    def _row_values(obj, terms):
+        values = []
+        for path, _ in terms:
+            value = obj
+            for name in path.split('__'):
+                value = getattr(value, name)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _seek(terms, values, forward):
+        """Условие «строго после (или до) строки с values» в порядке terms."""
+        condition = Q()
+        equal = {}
+        for (path, descending), value in zip(terms, values):
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= Q(**equal, **{f'{path}__{lookup}': value})
+            equal[path] = value
+        # Диапазон по первому полю позволяет планировщику пройти по индексу
+        first_path, first_descending = terms[0]
+        bound = 'lte' if first_descending == forward else 'gte'
+        return Q(**{f'{first_path}__{bound}': values[0]}) & condition
+
+    def get_results(self, request):
+        after = request.GET.get(AFTER_VAR)
+        before = request.GET.get(BEFORE_VAR)
+        terms = self._keyset_ordering(self.queryset.query.order_by) if self.queryset.ordered else None
+        if terms is None or ALL_VAR in request.GET:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.result_count > self.list_per_page
+        self.paginator = paginator
+        self.keyset = True
+
+        cursor = _decode_cursor(after or before or '')
+        if cursor is not None and len(cursor) != len(terms):
+            cursor = None
+        per_page = self.list_per_page
+        if cursor is not None and before:
+            # Идём назад в обратном порядке, затем показываем страницу в прямом
+            reverse_ordering = [path if descending else f'-{path}' for path, descending in terms]
+            pks = list(
+                self.queryset.filter(self._seek(terms, cursor, forward=False))
+                .order_by(*reverse_ordering).values_list('pk', flat=True)[:per_page]
+            )
+            page = self.queryset.filter(pk__in=pks)
+        elif cursor is not None:
+            page = self.queryset.filter(self._seek(terms, cursor, forward=True))[:per_page]
+        else:
+            page = self.queryset[:per_page]
+
+        rows = list(page)
+        self.result_list = page
+        if rows:
+            first, last = self._row_values(rows[0], terms), self._row_values(rows[-1], terms)
+            has_previous = cursor is not None and (
+                not before or self.queryset.filter(self._seek(terms, first, forward=False)).exists()
+            )
+            has_next = (cursor is not None and bool(before)) or (
+                len(rows) == per_page and self.queryset.filter(self._seek(terms, last, forward=True)).exists()
+            )
+            if has_previous:
+                self.keyset_previous_url = self.get_query_string({BEFORE_VAR: _encode_cursor(first)})
+            if has_next:
+                self.keyset_next_url = self.get_query_string({AFTER_VAR: _encode_cursor(last)})
+        if cursor is not None:
+            self.keyset_first_url = self.get_query_string()
+
+
+class ScalableAdminMixin:
+    """Оценочный счётчик и keyset-пагинация для админок больших таблиц."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -4,3 +4,33 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import pre_save, post_save, post_delete
+        from . import autocomplete, checks, metrics, signals, topics  # checks: регистрация системных проверок
+        from .middleware import install_query_counter
+
+        pre_save.connect(signals.fill_geocell, sender='api.TherapistProfile', dispatch_uid='api.fill_geocell')
+        pre_save.connect(signals.fill_week_minutes, sender='api.AvailabilityRule', dispatch_uid='api.fill_week_minutes')
+        post_save.connect(
+            signals.refresh_week_minutes, sender='api.TherapistProfile', dispatch_uid='api.refresh_week_minutes'
+        )
+        post_save.connect(
+            signals.announce_publication, sender='api.Publication', dispatch_uid='api.announce_publication'
+        )
+        # Автомат тем собирается из навыков: изменение навыка сбрасывает его
+        post_save.connect(topics.invalidate, sender='api.Skill', dispatch_uid='api.topics_invalidate_save')
+        post_delete.connect(topics.invalidate, sender='api.Skill', dispatch_uid='api.topics_invalidate_delete')
+        # Индекс подсказок при вводе собирается из названий и имён
+        for model in ('api.Skill', 'api.Language', 'api.User', 'api.TherapistProfile'):
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    autocomplete.invalidate, sender=model, dispatch_uid=f'api.autocomplete_{model}_{signal is post_save}'
+                )
+        post_save.connect(signals.sync_role, sender='api.UserProfile', dispatch_uid='api.sync_role')
+        post_delete.connect(
+            signals.unlist_on_profile_delete, sender='api.UserProfile', dispatch_uid='api.unlist_on_profile_delete'
+        )
+        if metrics.is_enabled():
+            connection_created.connect(install_query_counter, dispatch_uid='api.install_query_counter')
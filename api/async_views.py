@@ -0,0 +1,294 @@
+"""
+Нативные async-версии публичных эндпоинтов чтения для работы под ASGI.
+
+Отдают те же данные, что и DRF-представления из views.py, но обращаются
+к базе через async ORM, без переключения на sync_to_async для каждого запроса.
+Подключаются в urls.py, если включён ASYNC_PUBLIC_VIEWS (по умолчанию в config/asgi.py).
+
+Доставка сообщений (поток SSE и long-poll) — всегда async: ожидающее
+соединение держит только asyncio-очередь, а не поток.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max, Q, aprefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.translation import gettext as _
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import availability, counters, geo, messaging, realtime, similarity
+from .models import TherapistProfile, Skill, Language, Message
+from .subscriptions import acatalog_filter
+from .serializers import (
+    TherapistCardSerializer, TherapistProfileReadSerializer, PublicUserProfileSerializer,
+    SkillSerializer, LanguageSerializer, MessageSerializer
+)
+
+User = get_user_model()
+
+# Совпадает с размером страницы TherapistListView
+THERAPIST_PAGE_SIZE = 12
+
+
+def _render(data, status=200, headers=None):
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    content_type = f'{renderer.media_type}; charset={renderer.charset}' if renderer.charset else renderer.media_type
+    return HttpResponse(renderer.render(data), status=status, content_type=content_type, headers=headers)
+
+
+def _error(exc):
+    headers = {'WWW-Authenticate': 'Token'} if exc.status_code == 401 else None
+    # Как rest_framework.views.exception_handler: ошибки валидации отдаются без обёртки
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _render(data, status=exc.status_code, headers=headers)
+
+
+def _not_found(model):
+    # Текст Http404 из get_object_or_404, который DRF отдаёт в detail
+    return exceptions.NotFound(f'No {model._meta.object_name} matches the given query.')
+
+
+async def _authenticate(request):
+    """Async-аналог TokenAuthentication: возвращает пользователя или бросает APIException."""
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        raise exceptions.NotAuthenticated()
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return token.user
+
+
+@require_safe
+async def therapist_list(request):
+    try:
+        near = geo.parse_near(request.GET, settings.NEAR_DEFAULT_RADIUS_KM, settings.NEAR_MAX_RADIUS_KM)
+        window = availability.parse_window(request.GET)
+    except exceptions.APIException as exc:
+        return _error(exc)
+
+    # Свободные в интервале считаются один раз для обеих веток
+    available = None if window is None else await availability.aavailable_therapists(*window)
+    queryset = User.objects.select_related(
+        'profile', 'therapist_profile'
+    ).filter(
+        await acatalog_filter('therapist_profile__')
+    )
+    if near is None:
+        queryset = queryset.filter(
+            geo.location_filter(request.GET, 'therapist_profile__'),
+            Q() if available is None else availability.ids_filter(available, 'therapist_profile__'),
+        ).order_by('-therapist_profile__created_at')
+        count = await queryset.acount()
+    else:
+        # Как в TherapistListView.list: кандидаты по geocell, сортировка по расстоянию в памяти
+        candidates = TherapistProfile.objects.filter(
+            await acatalog_filter(), geo.location_filter(request.GET), geo.cover_filter(*near),
+            Q() if available is None else availability.ids_filter(available),
+        ).values_list('user_id', 'latitude', 'longitude')
+        ranked = geo.rank_by_distance([row async for row in candidates], *near)
+        count = len(ranked)
+
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 0
+    pages = max(1, -(-count // THERAPIST_PAGE_SIZE))
+    if page < 1 or page > pages:
+        return _error(exceptions.NotFound(_('Invalid page.')))
+
+    offset = (page - 1) * THERAPIST_PAGE_SIZE
+    if near is None:
+        users = [user async for user in queryset[offset:offset + THERAPIST_PAGE_SIZE].aiterator()]
+    else:
+        distances = dict(ranked[offset:offset + THERAPIST_PAGE_SIZE])
+        users = [user async for user in queryset.filter(id__in=distances).aiterator()]
+        users.sort(key=lambda user: (distances[user.id], user.id))
+    await aprefetch_related_objects(users, 'therapist_profile__skills', 'therapist_profile__languages')
+    results = TherapistCardSerializer(users, many=True, context={'request': request}).data
+    if near is not None:
+        for item, user in zip(results, users):
+            item['distance_km'] = round(distances[user.id], 2)
+
+    url = request.build_absolute_uri()
+    previous_url = None
+    if page == 2:
+        previous_url = remove_query_param(url, 'page')
+    elif page > 2:
+        previous_url = replace_query_param(url, 'page', page - 1)
+    return _render({
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page < pages else None,
+        'previous': previous_url,
+        'results': results,
+    })
+
+
+@require_safe
+async def therapist_detail(request, id):
+    try:
+        therapist = await TherapistProfile.objects.filter(
+            await acatalog_filter()
+        ).select_related('user', 'user__profile').aget(id=id)
+    except TherapistProfile.DoesNotExist:
+        return _error(_not_found(TherapistProfile))
+    await aprefetch_related_objects(
+        [therapist], 'skills', 'languages', 'gallery_photos', similarity.similar_prefetch()
+    )
+    counters.buffer.profile_view(therapist.id)
+    return _render(TherapistProfileReadSerializer(therapist, context={'request': request}).data)
+
+
+@require_safe
+async def public_user_profile(request, public_user_id):
+    try:
+        await _authenticate(request)
+    except exceptions.APIException as exc:
+        return _error(exc)
+
+    try:
+        user = await User.objects.select_related('profile', 'therapist_profile').aget(public_id=public_user_id)
+    except User.DoesNotExist:
+        return _error(_not_found(User))
+    # Те же проверки, что в PublicUserProfileView.get_object
+    if not hasattr(user, 'therapist_profile'):
+        return _error(exceptions.NotFound('Профиль терапевта не найден.'))
+    if not user.therapist_profile.is_verified:
+        return _error(exceptions.NotFound('Профиль недоступен.'))
+    await aprefetch_related_objects(
+        [user], 'publications', 'therapist_profile__skills', 'therapist_profile__languages',
+        'therapist_profile__gallery_photos',
+    )
+    counters.buffer.profile_view(user.therapist_profile.id)
+    return _render(PublicUserProfileSerializer(user, context={'request': request}).data)
+
+
+@require_safe
+async def skill_list(request):
+    skills = [skill async for skill in Skill.objects.order_by('name').aiterator()]
+    return _render(SkillSerializer(skills, many=True).data)
+
+
+@require_safe
+async def language_list(request):
+    languages = [language async for language in Language.objects.order_by('name').aiterator()]
+    return _render(LanguageSerializer(languages, many=True).data)
+
+
+# --- Доставка сообщений ---
+
+def _cursor(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        raise exceptions.ValidationError({'after': 'Ожидается id сообщения.'})
+
+
+def _sse(message_data):
+    data = json.dumps(message_data, ensure_ascii=False, default=str)
+    return f'id: {message_data["id"]}\nevent: message\ndata: {data}\n\n'
+
+
+async def _settled_messages(user, after_id):
+    """
+    Сообщения пользователя новее курсора, но не дальше первого свежего
+    пропуска id (messaging.settled_until). Второе значение — есть ли
+    такой пропуск: тогда базу стоит перечитать, даже если событий не будет.
+    """
+    limit = await messaging.settled_until(after_id).afirst()
+    queryset = messaging.messages_after(user, after_id)
+    if limit is not None:
+        queryset = queryset.filter(id__lte=limit)
+    return [message async for message in queryset[:messaging.CATCH_UP_LIMIT]], limit is not None
+
+
+async def _message_events(user, last_id):
+    with realtime.broker.subscribe(realtime.user_channel(user.id)) as subscription:
+        yield 'retry: 3000\n\n'
+        if last_id is None:
+            # Курсор «с этого момента», но не дальше незафиксированных сообщений
+            last_id = await messaging.settled_until(0).afirst()
+            if last_id is None:
+                last_id = (await Message.objects.aaggregate(last_id=Max('id')))['last_id'] or 0
+        while True:
+            # Событие — только сигнал: порядок и полноту даёт чтение из базы по курсору
+            subscription.drain()
+            messages, pending = await _settled_messages(user, last_id)
+            for message in messages:
+                last_id = message.id
+                yield _sse(MessageSerializer(message).data)
+            if len(messages) == messaging.CATCH_UP_LIMIT:
+                continue
+            timeout = settings.MESSAGING_HEARTBEAT_SECONDS
+            if pending:
+                timeout = min(timeout, settings.MESSAGING_REORDER_SECONDS)
+            while await subscription.get(timeout) is None and not pending:
+                # Комментарий SSE не даёт прокси закрыть простаивающее соединение
+                yield ': ping\n\n'
+
+
+@require_safe
+async def message_stream(request):
+    """
+    Поток новых сообщений пользователя (text/event-stream). Переподключение
+    с заголовком Last-Event-ID (или ?after=id) досылает пропущенное.
+    """
+    try:
+        user = await _authenticate(request)
+        last_id = _cursor(request.headers.get('Last-Event-ID') or request.GET.get('after'))
+    except exceptions.APIException as exc:
+        return _error(exc)
+    if not isinstance(request, ASGIRequest):
+        # WSGI-сервер не отдаст бесконечный async-поток; остаётся long-poll
+        return _render({'detail': 'Поток событий доступен только под ASGI, используйте messages/poll/.'}, status=501)
+    response = StreamingHttpResponse(_message_events(user, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_safe
+async def message_poll(request):
+    """
+    Long-poll: ?after=id — сообщения новее курсора; если их нет, ждёт
+    до ?timeout= секунд (не больше MESSAGING_POLL_TIMEOUT).
+    """
+    try:
+        user = await _authenticate(request)
+        after = _cursor(request.GET.get('after'))
+        if after is None:
+            raise exceptions.ValidationError({'after': 'Обязательный параметр.'})
+        timeout = min(float(request.GET.get('timeout', settings.MESSAGING_POLL_TIMEOUT)), settings.MESSAGING_POLL_TIMEOUT)
+    except ValueError:
+        return _error(exceptions.ValidationError({'timeout': 'Ожидается число секунд.'}))
+    except exceptions.APIException as exc:
+        return _error(exc)
+
+    # Подписка до чтения базы: сообщение между запросом и ожиданием не потеряется
+    deadline = time.monotonic() + timeout
+    with realtime.broker.subscribe(realtime.user_channel(user.id)) as subscription:
+        while True:
+            messages, pending = await _settled_messages(user, after)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                break
+            if pending:
+                remaining = min(remaining, settings.MESSAGING_REORDER_SECONDS)
+            await subscription.get(remaining)
+            subscription.drain()
+    return _render({
+        'results': MessageSerializer(messages, many=True).data,
+        'last_id': messages[-1].id if messages else after,
+    })
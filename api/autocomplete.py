@@ -0,0 +1,198 @@
+"""
+Подсказки при вводе: навыки, языки и имена терапевтов каталога по префиксу.
+
+Для каждого вида — отсортированный массив ключей в памяти процесса; поиск —
+bisect до первого ключа с префиксом и проход вперёд, пока не наберётся
+limit результатов, поэтому время не зависит от размера справочника.
+Ключи приводятся к единой латинской форме (регистр, ё -> е, транслитерация
+кириллицы), так что «ив», «Ив» и «iv» находят «Иванова», а «тре» — «Тревожность».
+Каждое слово названия — тоже начало ключа: «атаки» находит «Панические атаки».
+
+Индекс устаревает по сигналам изменения навыков, языков, имён терапевтов
+и видимости профилей в каталоге; прочие сохранения профилей его не трогают.
+Сброс увеличивает поколение процесса и, если задан AUTOCOMPLETE_CACHE, —
+общее поколение в кэше, так что устаревание видят все воркеры. Массовые
+UPDATE видимости (модерация, истечение подписок) сигналы обходят — для них
+индекс живёт не дольше AUTOCOMPLETE_TTL секунд.
+
+Устаревший индекс продолжает отвечать, пока фоновый поток собирает новый;
+синхронно, в запросе, собирается только самый первый индекс процесса.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_save
+
+from .models import Language, Skill, TherapistProfile
+from .subscriptions import catalog_filter
+
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+_SEPARATORS_RE = re.compile(r'[^0-9a-z]+')
+
+logger = logging.getLogger(__name__)
+
+# Поля, изменение которых меняет имя терапевта в подсказках
+NAME_FIELDS = {'first_name', 'last_name'}
+# Поля профиля, от которых зависит попадание в каталог (subscriptions.catalog_filter)
+CATALOG_FIELDS = ('is_listed', 'subscribed_until')
+_GENERATION_KEY = 'autocomplete-generation'
+
+
+def fold(text):
+    """Единая форма для сравнения: нижний регистр, латиница, слова через один пробел."""
+    return _SEPARATORS_RE.sub(' ', (text or '').lower().translate(_TRANSLIT)).strip()
+
+
+class PrefixIndex:
+    """Отсортированные ключи и значения; значение находится по префиксу любого своего слова."""
+
+    def __init__(self, entries):
+        pairs = []
+        for text, value in entries:
+            words = fold(text).split()
+            pairs += [(' '.join(words[start:]), value) for start in range(len(words))]
+        pairs.sort(key=lambda pair: pair[0])
+        self.keys = [key for key, _value in pairs]
+        self.values = [value for _key, value in pairs]
+
+    def search(self, prefix, limit):
+        found = {}
+        index = bisect_left(self.keys, prefix)
+        while index < len(self.keys) and len(found) < limit and self.keys[index].startswith(prefix):
+            # Одно значение может найтись по нескольким своим словам
+            found.setdefault(self.values[index], None)
+            index += 1
+        return list(found)
+
+
+def _build():
+    therapists = TherapistProfile.objects.filter(catalog_filter()).values_list(
+        'id', 'user__first_name', 'user__last_name'
+    )
+    return {
+        'skills': PrefixIndex((name, (pk, name)) for pk, name in Skill.objects.values_list('id', 'name')),
+        'languages': PrefixIndex((name, (pk, name)) for pk, name in Language.objects.values_list('id', 'name')),
+        'therapists': PrefixIndex(
+            (f'{first_name} {last_name}', (pk, first_name, last_name)) for pk, first_name, last_name in therapists
+        ),
+    }
+
+
+_indexes = None
+_built_at = 0.0
+# Поколение, на котором начиналась сборка текущего индекса: (локальное, общее)
+_built_generation = None
+_generation = 0
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def _shared_cache():
+    alias = settings.AUTOCOMPLETE_CACHE
+    return caches[alias] if alias else None
+
+
+def _current_generation():
+    cache = _shared_cache()
+    return _generation, cache.get(_GENERATION_KEY, 0) if cache is not None else 0
+
+
+def _rebuild():
+    """Собирает индекс и публикует его; сброс во время сборки оставляет его устаревшим."""
+    global _indexes, _built_at, _built_generation
+    generation = _current_generation()
+    indexes = _build()
+    _indexes, _built_at, _built_generation = indexes, time.monotonic(), generation
+
+
+def _rebuild_in_background():
+    global _rebuilding
+    try:
+        _rebuild()
+    except DatabaseError:
+        logger.exception('Не удалось пересобрать индекс подсказок, повтор при следующем запросе')
+    finally:
+        _rebuilding = False
+        # Соединение потока возвращается в пул
+        connection.close()
+
+
+def _schedule_rebuild():
+    global _rebuilding
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    threading.Thread(target=_rebuild_in_background, name='autocomplete-rebuild', daemon=True).start()
+
+
+def get_indexes():
+    indexes = _indexes
+    if indexes is None:
+        with _lock:
+            if _indexes is None:
+                _rebuild()
+            return _indexes
+    if time.monotonic() - _built_at >= settings.AUTOCOMPLETE_TTL or _current_generation() != _built_generation:
+        _schedule_rebuild()
+    return indexes
+
+
+def _affects_index(sender, instance, created, update_fields):
+    """Меняет ли сохранение навыка, языка, пользователя или профиля содержимое подсказок."""
+    model_name = sender._meta.model_name
+    if model_name == 'user':
+        # Вход пользователя сохраняет только last_login, клиенты в подсказки не попадают
+        return instance.is_therapist and (update_fields is None or bool(NAME_FIELDS & set(update_fields)))
+    if model_name == 'therapistprofile':
+        if created:
+            return instance.is_listed
+        loaded = getattr(instance, '_loaded_catalog', None)
+        if loaded is not None:
+            return loaded != tuple(instance.__dict__.get(field) for field in CATALOG_FIELDS)
+        return update_fields is None or bool(set(CATALOG_FIELDS) & set(update_fields))
+    return True
+
+
+def invalidate(sender=None, instance=None, signal=None, created=False, update_fields=None, **kwargs):
+    """Сигналы изменения: индекс устаревает в этом процессе и, при общем кэше, во всех остальных."""
+    global _generation
+    # Удаление сбрасывает всегда, сохранение — только если меняет подсказки
+    if signal is post_save and not _affects_index(sender, instance, created, update_fields):
+        return
+    _generation += 1
+    cache = _shared_cache()
+    if cache is not None:
+        cache.add(_GENERATION_KEY, 0, None)
+        try:
+            cache.incr(_GENERATION_KEY)
+        except ValueError:
+            # Ключ вытеснен между add и incr — следующий сброс создаст его заново
+            cache.set(_GENERATION_KEY, 1, None)
+
+
+def complete(query, limit):
+    """{'skills': [...], 'languages': [...], 'therapists': [...]} — до limit каждого вида."""
+    prefix = fold(query)
+    indexes = get_indexes()
+    if not prefix:
+        return {kind: [] for kind in indexes}
+    return {
+        'skills': [{'id': pk, 'name': name} for pk, name in indexes['skills'].search(prefix, limit)],
+        'languages': [{'id': pk, 'name': name} for pk, name in indexes['languages'].search(prefix, limit)],
+        'therapists': [
+            {'id': pk, 'first_name': first_name, 'last_name': last_name}
+            for pk, first_name, last_name in indexes['therapists'].search(prefix, limit)
+        ],
+    }
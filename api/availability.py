@@ -0,0 +1,263 @@
+"""
+Свободные слоты терапевтов и поиск «свободен в интервале».
+
+Расписание — еженедельные правила (AvailabilityRule) плюс исключения
+(AvailabilityException); слоты не хранятся, а разворачиваются лениво
+только внутри запрошенного интервала. Для фильтра каталога кандидаты
+выбираются по GiST-индексу на AvailabilityRule.week_minutes — окне правила
+в минутах недели UTC, — и только их календарь разворачивается, причём до
+первого свободного слота. Интервал фильтра короче недели
+(AVAILABILITY_MAX_FILTER_DAYS): неделя покрыла бы окна всех правил.
+Исключения и записи загружаются только для кандидатов (подзапросы EXISTS).
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import AvailabilityException, AvailabilityRule, Booking, BookingStatus, TherapistProfile
+from .subscriptions import catalog_filter
+
+WEEK_MINUTES = 7 * 24 * 60
+# Запас окна правила на переход на летнее/зимнее время
+DST_MARGIN_MINUTES = 60
+# Длительность слотов дополнительных окон (у правил она своя)
+DEFAULT_SLOT_MINUTES = 50
+# Начало недели UTC для отсчёта минут: понедельник
+_EPOCH_MONDAY = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class SlotUnavailable(Exception):
+    """Слот занят, не существует или уже прошёл."""
+
+
+def get_zone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(settings.TIME_ZONE)
+
+
+def _minute_of_week(moment):
+    return int((moment - _EPOCH_MONDAY).total_seconds() // 60) % WEEK_MINUTES
+
+
+def rule_week_minutes(rule, tz_name):
+    """
+    Окно правила в минутах от начала недели UTC: надмножество реальных
+    вхождений, с запасом DST_MARGIN_MINUTES и с текущим смещением пояса.
+    Начало лежит в [0, WEEK_MINUTES), конец может выходить за неделю.
+    """
+    offset = timezone.now().astimezone(get_zone(tz_name)).utcoffset()
+    start_minute = rule.start_time.hour * 60 + rule.start_time.minute
+    length = rule.end_time.hour * 60 + rule.end_time.minute - start_minute
+    start = rule.weekday * 24 * 60 + start_minute - int(offset.total_seconds() // 60) - DST_MARGIN_MINUTES
+    start %= WEEK_MINUTES
+    return NumericRange(start, start + length + 2 * DST_MARGIN_MINUTES)
+
+
+def _week_overlap(start, end):
+    """Q-условие по week_minutes: правило может дать слот в [start, end); интервал короче недели."""
+    if end - start >= timedelta(weeks=1):
+        raise ValueError('Интервал поиска по окнам правил должен быть короче недели')
+    a = _minute_of_week(start)
+    b = a + int((end - start).total_seconds() // 60)
+    # Окна правил лежат в [0, 2 недели): проверяем интервал и его сдвиги на неделю
+    condition = Q()
+    for shift in (-WEEK_MINUTES, 0, WEEK_MINUTES):
+        condition |= Q(week_minutes__overlap=NumericRange(a + shift, b + shift))
+    return condition
+
+
+# --- Развёртывание слотов ---
+
+def _chop(window_start, window_end, minutes, start, end):
+    step = timedelta(minutes=minutes)
+    slot = window_start
+    while slot + step <= window_end:
+        if slot >= start and slot + step <= end:
+            yield slot, slot + step
+        slot += step
+
+
+def iter_slots(rules, extra_windows, start, end, tz):
+    """
+    Слоты правил и дополнительных окон внутри [start, end), в UTC.
+    Генератор: разворачивается ровно столько, сколько прочитано.
+    """
+    day = start.astimezone(tz).date()
+    last_day = end.astimezone(tz).date()
+    while day <= last_day:
+        for rule in rules:
+            if rule.weekday != day.weekday():
+                continue
+            if (rule.valid_from and day < rule.valid_from) or (rule.valid_until and day > rule.valid_until):
+                continue
+            window_start = datetime.combine(day, rule.start_time, tzinfo=tz).astimezone(dt_timezone.utc)
+            window_end = datetime.combine(day, rule.end_time, tzinfo=tz).astimezone(dt_timezone.utc)
+            yield from _chop(window_start, window_end, rule.slot_minutes, start, end)
+        day += timedelta(days=1)
+    for window_start, window_end in extra_windows:
+        yield from _chop(window_start, window_end, DEFAULT_SLOT_MINUTES, start, end)
+
+
+def iter_free_slots(rules, exceptions, bookings, start, end, tz):
+    """Слоты без пересечения с недоступностью и активными записями."""
+    busy = [(e.starts_at, e.ends_at) for e in exceptions if not e.is_available]
+    busy += [(b.starts_at, b.ends_at) for b in bookings]
+    extra = [(e.starts_at, e.ends_at) for e in exceptions if e.is_available]
+    for slot_start, slot_end in iter_slots(rules, extra, start, end, tz):
+        if not any(b_start < slot_end and slot_start < b_end for b_start, b_end in busy):
+            yield slot_start, slot_end
+
+
+def _overlapping(queryset, start, end):
+    return queryset.filter(starts_at__lt=end, ends_at__gt=start)
+
+
+def free_slots(therapist, start, end):
+    """Свободные слоты терапевта в [start, end) по возрастанию времени."""
+    start = max(start, timezone.now())
+    rules = list(therapist.availability_rules.all())
+    exceptions = list(_overlapping(therapist.availability_exceptions.all(), start, end))
+    bookings = list(_overlapping(therapist.bookings.filter(status=BookingStatus.BOOKED), start, end))
+    slots = iter_free_slots(rules, exceptions, bookings, start, end, get_zone(therapist.timezone))
+    return sorted(set(slots))
+
+
+# --- Фильтр каталога ---
+
+def _window_querysets(start, end):
+    rules = AvailabilityRule.objects.filter(
+        _week_overlap(start, end),
+        Q(valid_from__isnull=True) | Q(valid_from__lte=(end + timedelta(days=1)).date()),
+        Q(valid_until__isnull=True) | Q(valid_until__gte=(start - timedelta(days=1)).date()),
+        therapist__is_listed=True,
+    )
+    extra_windows = _overlapping(
+        AvailabilityException.objects.filter(is_available=True, therapist__is_listed=True), start, end
+    )
+    # Кандидат — терапевт с подходящим правилом или дополнительным окном в интервале
+    has_rule = Exists(rules.filter(therapist_id=OuterRef('therapist_id')))
+    is_candidate = has_rule | Exists(extra_windows.filter(therapist_id=OuterRef('therapist_id')))
+    exceptions = _overlapping(
+        AvailabilityException.objects.filter(therapist__is_listed=True), start, end
+    ).filter(Q(is_available=True) | has_rule)
+    # Запись не длиннее суток: нижняя граница держит просмотр индекса в пределах окна
+    bookings = _overlapping(
+        Booking.objects.filter(status=BookingStatus.BOOKED, starts_at__gte=start - timedelta(days=1)), start, end
+    ).filter(is_candidate)
+    return rules.annotate(tz_name=F('therapist__timezone')), exceptions, bookings
+
+
+def _available_ids(rules, exceptions, bookings, start, end):
+    by_therapist = {}
+    for rule in rules:
+        by_therapist.setdefault(rule.therapist_id, ([], [], [], rule.tz_name))[0].append(rule)
+    for exception in exceptions:
+        if exception.is_available:
+            # Дополнительное окно само делает терапевта кандидатом (пояс для него не нужен)
+            by_therapist.setdefault(exception.therapist_id, ([], [], [], settings.TIME_ZONE))
+    for exception in exceptions:
+        if exception.therapist_id in by_therapist:
+            by_therapist[exception.therapist_id][1].append(exception)
+    for booking in bookings:
+        if booking.therapist_id in by_therapist:
+            by_therapist[booking.therapist_id][2].append(booking)
+    return {
+        therapist_id
+        for therapist_id, (t_rules, t_exceptions, t_bookings, tz_name) in by_therapist.items()
+        if next(iter_free_slots(t_rules, t_exceptions, t_bookings, start, end, get_zone(tz_name)), None)
+    }
+
+
+def available_therapists(start, end):
+    """id профилей терапевтов с хотя бы одним свободным слотом в [start, end)."""
+    start = max(start, timezone.now())
+    if start >= end:
+        return set()
+    return _available_ids(*(list(qs) for qs in _window_querysets(start, end)), start, end)
+
+
+async def aavailable_therapists(start, end):
+    start = max(start, timezone.now())
+    if start >= end:
+        return set()
+    loaded = [[obj async for obj in qs] for qs in _window_querysets(start, end)]
+    return _available_ids(*loaded, start, end)
+
+
+def _parse_moment(params, name):
+    value = params.get(name)
+    moment = parse_datetime(value) if value else None
+    if moment is None:
+        raise ValidationError({name: 'Ожидается дата и время в формате ISO 8601'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_window(params, start_name='available_from', end_name='available_to', max_days=None):
+    """
+    Разбирает ?available_from=&available_to=; возвращает (начало, конец) или None.
+    max_days по умолчанию — AVAILABILITY_MAX_FILTER_DAYS (фильтр каталога).
+    """
+    if not params.get(start_name) and not params.get(end_name):
+        return None
+    max_days = settings.AVAILABILITY_MAX_FILTER_DAYS if max_days is None else max_days
+    start = _parse_moment(params, start_name)
+    end = _parse_moment(params, end_name)
+    if end <= start:
+        raise ValidationError({end_name: 'Конец интервала должен быть позже начала'})
+    if end - start > timedelta(days=max_days):
+        raise ValidationError({end_name: f'Интервал не длиннее {max_days} дней'})
+    return start, end
+
+
+def ids_filter(ids, prefix=''):
+    """Q «id из набора» одним параметром-массивом, а не списком из тысяч параметров IN."""
+    return Q(**{f'{prefix}id__in': RawSQL('SELECT unnest(%s::bigint[])', (sorted(ids),))})
+
+
+def availability_filter(params, prefix=''):
+    """Q-условие каталога по ?available_from=&available_to=."""
+    window = parse_window(params)
+    if window is None:
+        return Q()
+    return ids_filter(available_therapists(*window), prefix)
+
+
+# --- Запись ---
+
+def book_slot(therapist_id, client, starts_at):
+    """
+    Атомарно записывает клиента на слот, начинающийся в starts_at.
+
+    Блокировка строки профиля упорядочивает конкурирующие записи к одному
+    терапевту; частичный уникальный индекс booking_unique_slot страхует
+    от двойной записи, если блокировку кто-то обойдёт.
+    """
+    try:
+        with transaction.atomic():
+            try:
+                therapist = TherapistProfile.objects.select_for_update().filter(catalog_filter()).get(id=therapist_id)
+            except TherapistProfile.DoesNotExist:
+                raise SlotUnavailable('Терапевт недоступен для записи')
+            slot = next(
+                (slot for slot in free_slots(therapist, starts_at, starts_at + timedelta(days=1)) if slot[0] == starts_at),
+                None,
+            )
+            if slot is None:
+                raise SlotUnavailable('Слот занят или не существует')
+            return Booking.objects.create(
+                therapist=therapist, client=client, starts_at=slot[0], ends_at=slot[1],
+            )
+    except IntegrityError:
+        raise SlotUnavailable('Слот занят или не существует')
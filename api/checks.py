@@ -0,0 +1,44 @@
+"""Системные проверки настроек, которые ломаются только под несколькими воркерами."""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+def _local_cache_warning(setting, hint, id):
+    alias = getattr(settings, setting, '')
+    if not alias:
+        return []
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend is None or backend in _LOCAL_CACHES:
+        return [Warning(f'{setting}={alias!r} не общий для воркеров кэш', hint=hint, id=id)]
+    return []
+
+
+@register(deploy=True)
+def check_replica_sticky_cache(app_configs, **kwargs):
+    return _local_cache_warning(
+        'REPLICA_STICKY_CACHE',
+        'Укажите алиас Redis- или DatabaseCache из CACHES либо оставьте пустым (только cookie).',
+        'api.W001',
+    )
+
+
+@register(deploy=True)
+def check_messaging_delivery(app_configs, **kwargs):
+    if getattr(settings, 'MESSAGING_PG_NOTIFY', True):
+        return []
+    return [Warning(
+        'MESSAGING_PG_NOTIFY выключен: события SSE и long-poll доставляются только внутри процесса',
+        hint='При нескольких воркерах включите MESSAGING_PG_NOTIFY=True, иначе часть событий не дойдёт.',
+        id='api.W002',
+    )]
+
+
+@register(deploy=True)
+def check_autocomplete_cache(app_configs, **kwargs):
+    return _local_cache_warning(
+        'AUTOCOMPLETE_CACHE',
+        'Укажите алиас Redis- или DatabaseCache из CACHES либо оставьте пустым (сброс по AUTOCOMPLETE_TTL).',
+        'api.W003',
+    )
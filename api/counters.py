@@ -0,0 +1,211 @@
+"""
+Буферизованные счётчики просмотров профилей и прочтений публикаций.
+
+Просмотр не пишет в базу: он только увеличивает счётчик в памяти процесса.
+Поток-сбрасыватель раз в COUNTERS_FLUSH_INTERVAL секунд (или раньше, когда
+накопилось COUNTERS_FLUSH_THRESHOLD событий) переносит накопленное в базу
+одной транзакцией: по одному UPDATE ... FROM (VALUES ...) на таблицу
+итогов и один upsert почасовых строк TherapistStatHour. Горячая строка
+популярного профиля обновляется раз в интервал, а не на каждый просмотр.
+
+Счётчики приблизительные: при аварийном завершении процесса теряется
+несброшенное за последний интервал; при штатном — буфер сбрасывается
+в atexit.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .availability import get_zone
+from .models import Publication, TherapistProfile, TherapistStatHour
+
+logger = logging.getLogger(__name__)
+
+
+def _hour():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+class CounterBuffer:
+    """Накопитель инкрементов процесса; сбрасывается собственным потоком."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        # (id профиля, час) -> просмотры; (id публикации, id автора, час) -> прочтения
+        self._views = Counter()
+        self._reads = Counter()
+        self._pending = 0
+
+    def _add(self, counter, key):
+        with self._lock:
+            counter[key] += 1
+            self._pending += 1
+            pending = self._pending
+        if pending >= settings.COUNTERS_FLUSH_THRESHOLD:
+            self._wake.set()
+        self._ensure_flusher()
+
+    def profile_view(self, therapist_id):
+        self._add(self._views, (therapist_id, _hour()))
+
+    def publication_read(self, publication_id, author_id):
+        self._add(self._reads, (publication_id, author_id, _hour()))
+
+    def _drain(self):
+        with self._lock:
+            views, reads = self._views, self._reads
+            self._reset()
+        return views, reads
+
+    def _restore(self, views, reads):
+        with self._lock:
+            self._views.update(views)
+            self._reads.update(reads)
+            self._pending += len(views) + len(reads)
+
+    def flush(self):
+        """Переносит накопленное в базу; при ошибке БД возвращает его в буфер."""
+        views, reads = self._drain()
+        if not views and not reads:
+            return 0
+        try:
+            write(views, reads)
+        except DatabaseError:
+            logger.exception('Не удалось сбросить счётчики просмотров, повтор при следующем сбросе')
+            self._restore(views, reads)
+            return 0
+        return sum(views.values()) + sum(reads.values())
+
+    # --- Поток-сбрасыватель ---
+
+    def _ensure_flusher(self):
+        """Запускает поток в текущем процессе (повторно — после fork)."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='counters-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.COUNTERS_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                # Соединение потока возвращается в пул до следующего сброса
+                connection.close()
+
+
+buffer = CounterBuffer()
+atexit.register(buffer.flush)
+
+
+def _values_sql(rows, casts):
+    """VALUES-список для rows и параметры к нему; casts — приведения типов столбцов."""
+    row_sql = '(' + ', '.join(f'%s::{cast}' for cast in casts) + ')'
+    return ', '.join([row_sql] * len(rows)), [value for row in rows for value in row]
+
+
+def _add_totals(model, field_name, totals):
+    """UPDATE <model> SET <поле> = <поле> + v.n FROM (VALUES ...) v(id, n) WHERE id = v.id."""
+    if not totals:
+        return
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table, column, pk = qn(opts.db_table), qn(opts.get_field(field_name).column), qn(opts.pk.column)
+    pk_cast = 'uuid' if opts.pk.get_internal_type() == 'UUIDField' else 'bigint'
+    # Строки в порядке первичного ключа: параллельные сбросы из разных процессов
+    # блокируют строки в одном порядке и не встают во взаимоблокировку
+    values_sql, params = _values_sql(sorted(totals.items()), (pk_cast, 'bigint'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} AS t SET {column} = t.{column} + v.n '
+            f'FROM (VALUES {values_sql}) AS v(id, n) WHERE t.{pk} = v.id',
+            params,
+        )
+
+
+def _add_hours(hours):
+    """Upsert почасовых строк; профили, удалённые до сброса, отбрасывает JOIN."""
+    if not hours:
+        return
+    qn = connection.ops.quote_name
+    stat_table = qn(TherapistStatHour._meta.db_table)
+    profile_table = qn(TherapistProfile._meta.db_table)
+    # Порядок уникального ключа (профиль, час) — по той же причине, что в _add_totals
+    rows = [(therapist_id, hour, views, reads) for (therapist_id, hour), (views, reads) in sorted(hours.items())]
+    values_sql, params = _values_sql(rows, ('bigint', 'timestamptz', 'integer', 'integer'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {stat_table} (therapist_id, hour, profile_views, publication_reads) '
+            f'SELECT v.therapist_id, v.hour, v.views, v.reads '
+            f'FROM (VALUES {values_sql}) AS v(therapist_id, hour, views, reads) '
+            f'JOIN {profile_table} AS p ON p.id = v.therapist_id '
+            f'ON CONFLICT (therapist_id, hour) DO UPDATE SET '
+            f'profile_views = {stat_table}.profile_views + EXCLUDED.profile_views, '
+            f'publication_reads = {stat_table}.publication_reads + EXCLUDED.publication_reads',
+            params,
+        )
+
+
+def write(views, reads):
+    """Записывает инкременты: views — {(профиль, час): n}, reads — {(публикация, автор, час): n}."""
+    profile_totals, read_totals = Counter(), Counter()
+    hours = {}
+    for (therapist_id, hour), count in views.items():
+        profile_totals[therapist_id] += count
+        hours.setdefault((therapist_id, hour), [0, 0])[0] += count
+
+    # Почасовая статистика ведётся по профилю терапевта, а публикацию пишет пользователь
+    author_ids = {author_id for _publication_id, author_id, _hour in reads}
+    therapist_by_author = dict(
+        TherapistProfile.objects.filter(user_id__in=author_ids).values_list('user_id', 'id')
+    ) if author_ids else {}
+    for (publication_id, author_id, hour), count in reads.items():
+        read_totals[publication_id] += count
+        therapist_id = therapist_by_author.get(author_id)
+        if therapist_id is not None:
+            hours.setdefault((therapist_id, hour), [0, 0])[1] += count
+
+    with transaction.atomic():
+        _add_totals(TherapistProfile, 'view_count', profile_totals)
+        _add_totals(Publication, 'read_count', read_totals)
+        _add_hours(hours)
+
+
+# --- Статистика для кабинета терапевта ---
+
+def therapist_series(therapist, start, by='hour'):
+    """
+    Ряд [{period, profile_views, publication_reads}] с начала start по почасовым
+    итогам; by='day' — по дням в часовом поясе терапевта. Часы без событий опущены.
+    """
+    stats = TherapistStatHour.objects.filter(therapist=therapist, hour__gte=start)
+    if by == 'day':
+        stats = stats.annotate(period=TruncDay('hour', tzinfo=get_zone(therapist.timezone))).values('period')
+    else:
+        stats = stats.annotate(period=F('hour')).values('period')
+    rows = stats.annotate(
+        views=Sum('profile_views'), reads=Sum('publication_reads'),
+    ).order_by('period').values_list('period', 'views', 'reads')
+    return [
+        {'period': period, 'profile_views': views, 'publication_reads': reads}
+        for period, views, reads in rows
+    ]
@@ -0,0 +1,299 @@
+"""
+Выгрузка персональных данных пользователя: ZIP-архив, собираемый воркером.
+
+Запрос пользователя только ставит DataExport в очередь. Команда
+process_data_exports забирает задания через SELECT ... FOR UPDATE SKIP LOCKED
+и пишет архив потоком во временный файл: записи сериализуются по одной
+(публикации и фото — через серверный курсор), изображения копируются
+кусками по DATA_EXPORT_CHUNK_SIZE байт, так что память воркера не зависит
+от числа фото. Изображения кладутся без сжатия (ZIP_STORED) — JPEG и PNG
+уже сжаты. Готовый архив лежит в закрытом хранилище (PRIVATE_MEDIA_ROOT).
+
+Скачивание — по подписанной ссылке с ограниченным сроком (её можно отдать
+менеджеру загрузок без токена) и с поддержкой Range для докачки.
+"""
+import json
+import logging
+import mimetypes
+import posixpath
+import re
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .models import DataExport, DataExportStatus, Publication, TherapistPhoto
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_SALT = 'api.dataexport.download'
+# Кусок копирования файлов в архив и отдачи архива
+CHUNK_SIZE = 256 * 1024
+# Служебные поля, которые не являются данными пользователя
+EXCLUDED_FIELDS = {'password', 'geocell', 'similarity_signature', 'moderated_by'}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+# --- Очередь ---
+
+def request_export(user):
+    """Незавершённая выгрузка пользователя или новая; (выгрузка, создана ли)."""
+    with transaction.atomic():
+        active = DataExport.objects.select_for_update().filter(
+            user=user, status__in=[DataExportStatus.PENDING, DataExportStatus.RUNNING],
+        ).first()
+        if active is not None:
+            return active, False
+        return DataExport.objects.create(user=user), True
+
+
+def claim():
+    """Берёт одно задание (или зависшее дольше DATA_EXPORT_STALE_SECONDS) и помечает его начатым."""
+    stale = timezone.now() - timedelta(seconds=settings.DATA_EXPORT_STALE_SECONDS)
+    with transaction.atomic():
+        job = DataExport.objects.select_for_update(skip_locked=True).filter(
+            Q(status=DataExportStatus.PENDING) | Q(status=DataExportStatus.RUNNING, started_at__lt=stale)
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = DataExportStatus.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+# --- Сборка архива ---
+
+def _record(instance):
+    """Значения собственных полей модели; связи — id, файлы — путь в хранилище."""
+    record = {}
+    for field in instance._meta.concrete_fields:
+        if field.name in EXCLUDED_FIELDS:
+            continue
+        value = field.value_from_object(instance)
+        if isinstance(value, FieldFile):
+            value = value.name or None
+        record[field.attname] = value
+    return record
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, indent=2, cls=DjangoJSONEncoder).encode()
+
+
+def _write_json(archive, name, value):
+    archive.writestr(name, _dumps(value))
+
+
+def _write_records(archive, name, records):
+    """JSON-массив, записываемый по элементу: весь список в памяти не собирается."""
+    count = 0
+    with archive.open(name, 'w') as entry:
+        entry.write(b'[')
+        for record in records:
+            entry.write(b',\n' if count else b'\n')
+            entry.write(_dumps(record))
+            count += 1
+        entry.write(b'\n]\n')
+    return count
+
+
+def _write_file(archive, name, field_file):
+    """Копирует файл из хранилища в архив кусками; False — файла нет."""
+    storage = field_file.storage
+    try:
+        size = storage.size(field_file.name)
+        source = storage.open(field_file.name, 'rb')
+    except OSError:
+        return False
+    info = zipfile.ZipInfo(name, date_time=timezone.localtime().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with source, archive.open(info, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as entry:
+        for chunk in source.chunks(CHUNK_SIZE):
+            entry.write(chunk)
+    return True
+
+
+def _extension(name):
+    return posixpath.splitext(name)[1].lower()
+
+
+def _photo_name(photo):
+    return f'photos/{photo.order:04d}_{photo.id}{_extension(photo.image.name)}'
+
+
+def write_archive(user, target):
+    """Пишет ZIP с данными user в файловый объект target; возвращает манифест."""
+    manifest = {'generated_at': timezone.now(), 'files': [], 'missing_files': []}
+
+    def add_file(name, field_file):
+        if field_file and _write_file(archive, name, field_file):
+            manifest['files'].append(name)
+        elif field_file:
+            manifest['missing_files'].append(field_file.name)
+
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+        _write_json(archive, 'user.json', _record(user))
+
+        profile = getattr(user, 'profile', None)
+        if profile is not None:
+            _write_json(archive, 'profile.json', _record(profile))
+            add_file(f'avatar{_extension(profile.profile_picture.name)}', profile.profile_picture)
+
+        therapist_profile = getattr(user, 'therapist_profile', None)
+        if therapist_profile is not None:
+            record = _record(therapist_profile)
+            record['skills'] = list(therapist_profile.skills.values_list('name', flat=True))
+            record['languages'] = list(therapist_profile.languages.values_list('name', flat=True))
+            _write_json(archive, 'therapist_profile.json', record)
+
+            # Два прохода: пока открыта запись photos.json, другие файлы в архив писать нельзя
+            photos = TherapistPhoto.objects.filter(therapist_profile=therapist_profile).order_by('order', 'id')
+            for photo in photos.iterator(chunk_size=200):
+                add_file(_photo_name(photo), photo.image)
+            _write_records(archive, 'photos.json', (
+                _record(photo) | {'archive_file': _photo_name(photo) if photo.image else None} for photo in photos.iterator(chunk_size=200)
+            ))
+
+        client_profile = getattr(user, 'client_profile', None)
+        if client_profile is not None:
+            record = _record(client_profile)
+            record['interested_topics'] = list(client_profile.interested_topics.values_list('name', flat=True))
+            _write_json(archive, 'client_profile.json', record)
+
+        publications = Publication.objects.filter(author=user).order_by('created_at', 'id')
+        _write_records(archive, 'publications.json', (_record(item) for item in publications.iterator(chunk_size=500)))
+
+        _write_json(archive, 'manifest.json', manifest)
+    return manifest
+
+
+def build(job):
+    """Собирает архив задания и сохраняет его в закрытое хранилище."""
+    with tempfile.TemporaryFile() as target:
+        write_archive(job.user, target)
+        size = target.tell()
+        target.seek(0)
+        job.file.save(f'{job.user_id}/{job.id}.zip', File(target), save=False)
+    job.size = size
+    job.status = DataExportStatus.READY
+    job.finished_at = timezone.now()
+    job.error = ''
+    job.save(update_fields=['file', 'size', 'status', 'finished_at', 'error'])
+
+
+def expire():
+    """Удаляет архивы старше DATA_EXPORT_KEEP_HOURS; возвращает их число."""
+    cutoff = timezone.now() - timedelta(hours=settings.DATA_EXPORT_KEEP_HOURS)
+    expired = 0
+    for job in DataExport.objects.filter(status=DataExportStatus.READY, finished_at__lt=cutoff).iterator():
+        job.file.delete(save=False)
+        job.status = DataExportStatus.EXPIRED
+        job.save(update_fields=['file', 'status'])
+        expired += 1
+    return expired
+
+
+def run(max_jobs=None):
+    """Собирает задания из очереди, пока они есть; возвращает (собрано, ошибок, удалено по сроку)."""
+    built = failed = 0
+    while max_jobs is None or built + failed < max_jobs:
+        job = claim()
+        if job is None:
+            break
+        try:
+            build(job)
+        except Exception as exc:
+            logger.exception('Не удалось собрать выгрузку данных %s', job.id)
+            job.status = DataExportStatus.FAILED
+            job.error = f'{type(exc).__name__}: {exc}'[:2000]
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'finished_at'])
+            failed += 1
+        else:
+            built += 1
+    return built, failed, expire()
+
+
+# --- Скачивание ---
+
+def download_token(job):
+    return signing.dumps(job.id, salt=DOWNLOAD_SALT)
+
+
+def job_from_token(token):
+    """Готовая выгрузка по подписанному токену или None (подделан, истёк, архив удалён)."""
+    try:
+        job_id = signing.loads(token, salt=DOWNLOAD_SALT, max_age=settings.DATA_EXPORT_LINK_SECONDS)
+    except signing.BadSignature:
+        return None
+    return DataExport.objects.filter(id=job_id, status=DataExportStatus.READY).first()
+
+
+def _byte_range(header, size):
+    """(начало, конец включительно) из Range; None — отдать целиком; ValueError — вне файла."""
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        # Нет заголовка, другие единицы или несколько диапазонов: отдаём весь файл
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError('Диапазон вне файла')
+    return start, end
+
+
+def _read(job, start, length):
+    with job.file.storage.open(job.file.name, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request, job):
+    """Архив целиком (200) или диапазоном (206); If-Range с устаревшим ETag — целиком."""
+    size = job.size
+    etag = f'"{job.id}-{size}"'
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = _byte_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(
+        _read(job, start, end - start + 1),
+        status=206 if byte_range else 200,
+        content_type=mimetypes.types_map['.zip'],
+    )
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(job.finished_at.timestamp())
+    response['Content-Disposition'] = f'attachment; filename="data-export-{job.finished_at:%Y%m%d}.zip"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
@@ -0,0 +1,163 @@
+"""
+Маршрутизация чтений на реплики PostgreSQL с «прилипанием» к основной базе.
+
+ReplicaRoutingMiddleware разрешает чтение с реплик только для безопасных
+запросов (GET/HEAD/OPTIONS). После записи клиент на REPLICA_STICKY_SECONDS
+читает только с основной базы, чтобы сразу видеть свои изменения.
+
+Отметка о записи хранится у самого клиента — в подписанной cookie, поэтому
+её видит любой воркер. Клиентам с токеном, не хранящим cookie, отметку
+можно продублировать в общем кэше (REPLICA_STICKY_CACHE) по ключу токена.
+Реплика с отставанием больше REPLICA_MAX_LAG_SECONDS временно исключается.
+"""
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+# {alias: (время проверки, отставание в секундах или None при ошибке)}
+_lag_cache = {}
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_aliases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def replica_lag(alias):
+    """Отставание реплики в секундах (с кэшированием на REPLICA_LAG_CHECK_INTERVAL)."""
+    now = time.monotonic()
+    checked_at, lag = _lag_cache.get(alias, (None, None))
+    if checked_at is not None and now - checked_at < getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5):
+        return lag
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = float(cursor.fetchone()[0])
+    except DatabaseError:
+        lag = None
+    _lag_cache[alias] = (now, lag)
+    return lag
+
+
+def healthy_replicas():
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 2)
+    return [
+        alias for alias in replica_aliases()
+        if (lag := replica_lag(alias)) is not None and lag <= max_lag
+    ]
+
+
+# --- Состояние текущего запроса ---
+
+def enable_replica_reads():
+    """Разрешает чтение с реплик в текущем контексте; возвращает токены для сброса."""
+    return _use_replica.set(True), _wrote.set(False)
+
+
+def reset_replica_reads(tokens):
+    use_token, wrote_token = tokens
+    _use_replica.reset(use_token)
+    _wrote.reset(wrote_token)
+
+
+def has_written():
+    return _wrote.get()
+
+
+STICKY_COOKIE = 'db_primary'
+
+
+def _sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def _sticky_cache_key(request):
+    """(кэш, ключ) для отметки по токену или (None, None), если общий кэш не задан."""
+    alias = getattr(settings, 'REPLICA_STICKY_CACHE', '')
+    # TokenAuthentication работает на уровне DRF, поэтому ключуем по заголовку авторизации
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not alias or not authorization:
+        return None, None
+    return caches[alias], 'db-primary-sticky:' + hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def _set_sticky_cookie(request, response):
+    response.set_signed_cookie(
+        STICKY_COOKIE, '1', salt=STICKY_COOKIE, max_age=_sticky_seconds(),
+        secure=request.is_secure(), httponly=True, samesite='Lax',
+    )
+
+
+def _has_sticky_cookie(request):
+    # max_age проверяется по времени подписи, а не только браузером
+    return request.get_signed_cookie(STICKY_COOKIE, None, salt=STICKY_COOKIE, max_age=_sticky_seconds()) is not None
+
+
+def pin_to_primary(request, response):
+    _set_sticky_cookie(request, response)
+    cache, key = _sticky_cache_key(request)
+    if cache is not None:
+        cache.set(key, True, _sticky_seconds())
+
+
+def is_pinned_to_primary(request):
+    if _has_sticky_cookie(request):
+        return True
+    cache, key = _sticky_cache_key(request)
+    return cache is not None and bool(cache.get(key))
+
+
+async def apin_to_primary(request, response):
+    _set_sticky_cookie(request, response)
+    cache, key = _sticky_cache_key(request)
+    if cache is not None:
+        await cache.aset(key, True, _sticky_seconds())
+
+
+async def ais_pinned_to_primary(request):
+    if _has_sticky_cookie(request):
+        return True
+    cache, key = _sticky_cache_key(request)
+    return cache is not None and bool(await cache.aget(key))
+
+
+class PrimaryReplicaRouter:
+    """Запись и миграции — только основная база; чтение — реплики, если разрешено."""
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get():
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Дальнейшие чтения этого запроса должны видеть запись
+        if _use_replica.get():
+            _use_replica.set(False)
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит с репликацией
+        return db not in replica_aliases()
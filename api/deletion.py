@@ -0,0 +1,203 @@
+"""
+Фоновое удаление аккаунта.
+
+Запрос только отключает аккаунт — is_active=False, токены удалены, профиль
+убран из каталога — и ставит AccountDeletion в очередь; ответ не ждёт
+каскада. Команда process_account_deletions забирает задания через
+SELECT ... FOR UPDATE SKIP LOCKED и удаляет зависимые строки по шагам,
+пачками по ACCOUNT_DELETION_BATCH_SIZE, каждая — в своей короткой
+транзакции: блокировки не держатся дольше одной пачки. Файлы (фото
+галереи, аватар, архивы выгрузок) удаляются из хранилища до своих строк,
+поэтому прерванное удаление при повторе не оставляет файлов-сирот.
+Последним удаляется сам пользователь — к этому моменту его каскад мал.
+
+Ход удаления пишется в AccountDeletion.progress после каждой пачки.
+Упавшее задание повторяется с удваивающейся задержкой, пока не исчерпаны
+ACCOUNT_DELETION_MAX_ATTEMPTS попыток, и продолжается с места сбоя.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import autocomplete
+from .models import (
+    AccountDeletion, AccountDeletionStatus, AvailabilityException, AvailabilityRule, Booking, Conversation,
+    DataExport, InviteCode, Message, ModerationAction, Publication, SimilarTherapist, TherapistPhoto,
+    TherapistProfile, TherapistStatHour, User, UserProfile,
+)
+
+logger = logging.getLogger(__name__)
+
+# Общие файлы MEDIA_ROOT (аватар по умолчанию и т. п.): не удаляются вместе с аккаунтом
+PROTECTED_PREFIXES = ('defaults/',)
+
+
+def _steps(user_id):
+    """
+    [(шаг, queryset, действие, поле)] в порядке выполнения. Действия: 'delete' —
+    удалить строки (поле — файл, удаляемый вместе со строкой), 'clear' — удалить
+    файл из поля и очистить его, 'nullify' — обнулить ссылку на пользователя.
+    """
+    therapist = Q(therapist__user_id=user_id)
+    return [
+        ('messages', Message.objects.filter(
+            Q(sender_id=user_id) | Q(conversation__client_id=user_id) | Q(conversation__therapist__user_id=user_id)
+        ), 'delete', None),
+        ('conversations', Conversation.objects.filter(Q(client_id=user_id) | therapist), 'delete', None),
+        ('bookings', Booking.objects.filter(Q(client_id=user_id) | therapist), 'delete', None),
+        ('availability_exceptions', AvailabilityException.objects.filter(therapist), 'delete', None),
+        ('availability_rules', AvailabilityRule.objects.filter(therapist), 'delete', None),
+        ('stat_hours', TherapistStatHour.objects.filter(therapist), 'delete', None),
+        ('similar_therapists', SimilarTherapist.objects.filter(therapist | Q(similar__user_id=user_id)), 'delete', None),
+        ('publications', Publication.objects.filter(author_id=user_id), 'delete', None),
+        ('photos', TherapistPhoto.objects.filter(therapist_profile__user_id=user_id), 'delete', 'image'),
+        ('data_exports', DataExport.objects.filter(user_id=user_id), 'delete', 'file'),
+        ('avatar', UserProfile.objects.filter(user_id=user_id), 'clear', 'profile_picture'),
+        # Чужие записи, где пользователь указан автором действия, остаются без ссылки
+        ('invite_codes', InviteCode.objects.filter(created_by_id=user_id), 'nullify', 'created_by'),
+        ('moderation_actions', ModerationAction.objects.filter(actor_id=user_id), 'nullify', 'actor'),
+        ('moderated_profiles', TherapistProfile.objects.filter(moderated_by_id=user_id), 'nullify', 'moderated_by'),
+    ]
+
+
+def _pending(queryset, action, field):
+    """Строки, которые шагу ещё предстоит обработать."""
+    if action == 'clear':
+        return queryset.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+    return queryset
+
+
+# --- Запрос удаления ---
+
+def schedule(user, requested_by=None):
+    """
+    Отключает аккаунт и ставит удаление в очередь; повторный запрос
+    возвращает уже незавершённое задание. Возвращает (задание, создано ли).
+    """
+    with transaction.atomic():
+        User.objects.select_for_update().filter(pk=user.pk).update(is_active=False)
+        active = AccountDeletion.objects.filter(
+            user_id=user.pk, status__in=[AccountDeletionStatus.PENDING, AccountDeletionStatus.RUNNING],
+        ).first()
+        if active is not None:
+            return active, False
+        Token.objects.filter(user_id=user.pk).delete()
+        TherapistProfile.objects.filter(user_id=user.pk, is_listed=True).update(is_listed=False)
+        job = AccountDeletion.objects.create(user_id=user.pk, requested_by=requested_by)
+    # UPDATE выше обходит сигналы: имя пропадает из подсказок этого процесса сразу
+    autocomplete.invalidate()
+    return job, True
+
+
+def claim():
+    """
+    Берёт одно задание — новое, зависшее дольше ACCOUNT_DELETION_STALE_SECONDS
+    или упавшее, чей повтор подошёл, — и помечает его начатым.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.ACCOUNT_DELETION_STALE_SECONDS)
+    with transaction.atomic():
+        job = AccountDeletion.objects.select_for_update(skip_locked=True).filter(
+            Q(status=AccountDeletionStatus.PENDING)
+            | Q(status=AccountDeletionStatus.RUNNING, started_at__lt=stale)
+            | Q(status=AccountDeletionStatus.FAILED, retry_at__lte=now)
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = AccountDeletionStatus.RUNNING
+        job.started_at = now
+        job.attempts += 1
+        job.retry_at = None
+        job.save(update_fields=['status', 'started_at', 'attempts', 'retry_at'])
+    return job
+
+
+def retry_delay(attempts):
+    """Задержка перед попыткой attempts + 1."""
+    return timedelta(seconds=settings.ACCOUNT_DELETION_RETRY_SECONDS * 2 ** (attempts - 1))
+
+
+# --- Удаление ---
+
+def _process_batch(queryset, action, field, batch_size):
+    """Одна пачка шага; возвращает число обработанных строк (0 — шаг завершён)."""
+    model = queryset.model
+    queryset = _pending(queryset, action, field).order_by('pk')
+    if field is not None and action != 'nullify':
+        rows = list(queryset.values_list('pk', field)[:batch_size])
+        ids = [pk for pk, _name in rows]
+        names = {name for _pk, name in rows if name and not name.startswith(PROTECTED_PREFIXES)}
+        # Файл, на который ссылаются и чужие строки (общие картинки по умолчанию), не трогаем
+        shared = set(
+            model.objects.filter(**{f'{field}__in': names}).exclude(pk__in=ids).values_list(field, flat=True)
+        ) if names else set()
+        storage = model._meta.get_field(field).storage
+        # Сначала файлы: если процесс прервётся, строки останутся и файлы удалятся при повторе
+        for name in names - shared:
+            storage.delete(name)
+    else:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    batch = model.objects.filter(pk__in=ids)
+    with transaction.atomic():
+        if action == 'delete':
+            batch.delete()
+        else:
+            batch.update(**{field: '' if action == 'clear' else None})
+    return len(ids)
+
+
+def process(job, batch_size, report=None):
+    """Выполняет все шаги задания; report(job, шаг) вызывается после каждой пачки."""
+    steps = _steps(job.user_id)
+    if not job.progress:
+        job.progress = {
+            name: {'total': _pending(queryset, action, field).count(), 'done': 0}
+            for name, queryset, action, field in steps
+        }
+        job.save(update_fields=['progress'])
+    for name, queryset, action, field in steps:
+        while True:
+            processed = _process_batch(queryset, action, field, batch_size)
+            if not processed:
+                break
+            job.progress[name]['done'] += processed
+            job.save(update_fields=['progress'])
+            if report is not None:
+                report(job, name)
+    # Остаток каскада — профили, токены, связи многие-ко-многим — невелик
+    with transaction.atomic():
+        User.objects.filter(pk=job.user_id).delete()
+    job.status = AccountDeletionStatus.DONE
+    job.finished_at = timezone.now()
+    job.error = ''
+    job.save(update_fields=['status', 'finished_at', 'error'])
+
+
+def run(batch_size=None, report=None, max_jobs=None):
+    """Выполняет задания из очереди, пока они есть; возвращает (удалено аккаунтов, ошибок)."""
+    batch_size = batch_size or settings.ACCOUNT_DELETION_BATCH_SIZE
+    done = failed = 0
+    while max_jobs is None or done + failed < max_jobs:
+        job = claim()
+        if job is None:
+            break
+        try:
+            process(job, batch_size, report)
+        except Exception as exc:
+            logger.exception('Не удалось удалить аккаунт %s', job.user_id)
+            job.status = AccountDeletionStatus.FAILED
+            job.error = f'{type(exc).__name__}: {exc}'[:2000]
+            if job.attempts < settings.ACCOUNT_DELETION_MAX_ATTEMPTS:
+                job.retry_at = timezone.now() + retry_delay(job.attempts)
+            job.save(update_fields=['status', 'error', 'retry_at'])
+            failed += 1
+        else:
+            done += 1
+    return done, failed
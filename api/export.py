@@ -0,0 +1,131 @@
+"""
+Выгрузка каталога терапевтов для партнёров: CSV или NDJSON потоком.
+
+Строки читаются одним запросом через серверный курсор (.iterator(chunk_size)),
+навыки и языки собираются в массивы коррелированными подзапросами
+(ArrayAgg) — ни моделей, ни prefetch-кэша в памяти, только текущая пачка.
+Вывод склеивается в блоки по EXPORT_BLOCK_SIZE байт и при необходимости
+сжимается gzip на лету, так что память не зависит от размера каталога.
+
+С since выгружаются профили, изменённые после этого момента (updated_at),
+включая убранные из каталога: для них остаются только id и listed=false,
+чтобы партнёр удалил их у себя. Изменения видимости без сохранения профиля
+(смена роли) и удалённые профили инкрементальная выгрузка не видит —
+полную выгрузку стоит делать периодически.
+"""
+import csv
+import json
+import zlib
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BooleanField, ExpressionWrapper, F, OuterRef, Subquery
+
+from .models import TherapistProfile
+from .subscriptions import catalog_filter
+
+FIELDS = (
+    'id', 'first_name', 'last_name', 'city', 'works_online', 'status', 'experience_years',
+    'about', 'skills', 'languages', 'updated_at', 'listed',
+)
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+# Размер блока вывода: меньше — больше накладных расходов на запись, больше — памяти
+EXPORT_BLOCK_SIZE = 64 * 1024
+
+
+def _names(relation, field):
+    """Подзапрос: отсортированные названия связанных навыков или языков профиля."""
+    return Subquery(
+        relation.through.objects.filter(therapistprofile_id=OuterRef('pk'))
+        .values('therapistprofile_id')
+        .annotate(names=ArrayAgg(f'{field}__name', ordering=f'{field}__name'))
+        .values('names')
+    )
+
+
+def rows(since=None, chunk_size=2000):
+    """Словари FIELDS по возрастанию id; без since — только профили каталога."""
+    profiles = TherapistProfile.objects.all()
+    if since is None:
+        profiles = profiles.filter(catalog_filter())
+    else:
+        profiles = profiles.filter(updated_at__gte=since)
+    profiles = profiles.annotate(
+        first_name=F('user__first_name'),
+        last_name=F('user__last_name'),
+        skill_names=_names(TherapistProfile.skills, 'skill'),
+        language_names=_names(TherapistProfile.languages, 'language'),
+        listed=ExpressionWrapper(catalog_filter(), output_field=BooleanField()),
+    ).order_by('id').values(
+        'id', 'first_name', 'last_name', 'city', 'works_online', 'status', 'experience_years',
+        'about', 'skill_names', 'language_names', 'updated_at', 'listed',
+    )
+    for row in profiles.iterator(chunk_size=chunk_size):
+        if not row['listed']:
+            yield {field: None for field in FIELDS} | {'id': row['id'], 'listed': False}
+            continue
+        row['skills'] = row.pop('skill_names') or []
+        row['languages'] = row.pop('language_names') or []
+        yield row
+
+
+class _Echo:
+    """«Файл» для csv.writer: writerow возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        values = []
+        for field in FIELDS:
+            value = row[field]
+            if isinstance(value, list):
+                value = '|'.join(value)
+            elif isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif value is None:
+                value = ''
+            elif field == 'updated_at':
+                value = value.isoformat()
+            values.append(value)
+        yield writer.writerow(values)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps({field: row[field] for field in FIELDS}, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+def blocks(lines, compress=False, level=6):
+    """Байтовые блоки по ~EXPORT_BLOCK_SIZE из строк lines; compress — поток gzip."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode()
+        pending.append(data)
+        size += len(data)
+        if size >= EXPORT_BLOCK_SIZE:
+            block = b''.join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                block = compressor.compress(block)
+            if block:
+                yield block
+    block = b''.join(pending)
+    if compressor is not None:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+def export(kind, since=None, compress=False, chunk_size=2000):
+    """Поток байтов выгрузки kind ('csv' | 'ndjson')."""
+    lines = csv_lines if kind == 'csv' else ndjson_lines
+    return blocks(lines(rows(since, chunk_size)), compress)
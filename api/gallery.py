@@ -0,0 +1,97 @@
+"""
+Фотогалерея терапевта: пакетная загрузка и порядок фото.
+
+Единственный источник галереи — строки TherapistPhoto (gallery_photos);
+прежний JSON-список URL в профиле перенесён в них миграцией 0022 (внешние ссылки — в external_url).
+
+Пакетная загрузка проверяет изображения (Pillow) и пишет файлы в хранилище
+параллельно в пуле потоков — декодирование и запись на диск отпускают GIL, —
+а строки создаёт одним INSERT. Если хоть один файл не прошёл проверку,
+не сохраняется ни один, и уже записанные файлы удаляются.
+Новый порядок применяется одним UPDATE ... FROM (VALUES ...).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import TherapistPhoto, TherapistProfile
+
+
+def _store(upload):
+    """Проверяет изображение и сохраняет файл; (имя в хранилище, None) или (None, ошибки)."""
+    try:
+        forms.ImageField().clean(upload)
+    except ValidationError as exc:
+        return None, exc.messages
+    field = TherapistPhoto._meta.get_field('image')
+    name = field.generate_filename(None, upload.name)
+    return field.storage.save(name, upload, max_length=field.max_length), None
+
+
+def add_photos(therapist_profile, uploads, captions=()):
+    """
+    Добавляет фото в конец галереи. Возвращает (созданные фото, None) или
+    (None, {номер файла: ошибки}) — тогда ничего не сохранено.
+    """
+    with ThreadPoolExecutor(max_workers=settings.GALLERY_UPLOAD_WORKERS) as pool:
+        results = list(pool.map(_store, uploads))
+    errors = {index: messages for index, (_name, messages) in enumerate(results) if messages}
+    names = [name for name, _messages in results if name]
+    storage = TherapistPhoto._meta.get_field('image').storage
+    if errors:
+        for name in names:
+            storage.delete(name)
+        return None, errors
+
+    try:
+        with transaction.atomic():
+            # Блокировка профиля: параллельные загрузки не получат одинаковые номера
+            TherapistProfile.objects.select_for_update().only('pk').get(pk=therapist_profile.pk)
+            last = TherapistPhoto.objects.filter(therapist_profile=therapist_profile).aggregate(last=Max('order'))['last']
+            start = 0 if last is None else last + 1
+            photos = TherapistPhoto.objects.bulk_create([
+                TherapistPhoto(
+                    therapist_profile=therapist_profile, image=name, order=start + index,
+                    caption=captions[index] if index < len(captions) else None,
+                )
+                for index, name in enumerate(names)
+            ])
+    except Exception:
+        for name in names:
+            storage.delete(name)
+        raise
+    return photos, None
+
+
+def reorder(therapist_profile, ids):
+    """
+    Ставит фото в порядке ids (полный список id галереи профиля) одним UPDATE.
+    ValueError — если ids не совпадают с фото профиля.
+    """
+    current = set(TherapistPhoto.objects.filter(therapist_profile=therapist_profile).values_list('id', flat=True))
+    if len(ids) != len(set(ids)) or set(ids) != current:
+        raise ValueError('Нужен полный список id фото галереи без повторов')
+    if not ids:
+        return 0
+    qn = connection.ops.quote_name
+    opts = TherapistPhoto._meta
+    table = qn(opts.db_table)
+    order, pk = qn(opts.get_field('order').column), qn(opts.pk.column)
+    updated_at = qn(opts.get_field('updated_at').column)
+    profile = qn(opts.get_field('therapist_profile').column)
+    values_sql = ', '.join(['(%s::bigint, %s::integer)'] * len(ids))
+    params = [value for position, photo_id in enumerate(ids) for value in (photo_id, position)]
+    with connection.cursor() as cursor:
+        # Строки, чей номер не изменился, не переписываются
+        cursor.execute(
+            f'UPDATE {table} AS t SET {order} = v.position, {updated_at} = %s '
+            f'FROM (VALUES {values_sql}) AS v(id, position) '
+            f'WHERE t.{pk} = v.id AND t.{profile} = %s AND t.{order} <> v.position',
+            [timezone.now(), *params, therapist_profile.pk],
+        )
+        return cursor.rowcount
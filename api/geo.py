@@ -0,0 +1,188 @@
+"""
+Поиск терапевтов рядом с точкой без PostGIS.
+
+Координаты кодируются в geocell — Z-order (чередование битов долготы и
+широты, как в geohash, но целым числом). Ячейка уровня L — это непрерывный
+диапазон geocell, поэтому «все точки в ячейке» — диапазонный запрос по
+обычному B-tree индексу. Запрос рядом с точкой покрывает окрестность
+несколькими ячейками, а точное расстояние досчитывается в памяти.
+
+Справочник городов лежит в api/data/cities.csv.
+"""
+import csv
+import math
+from functools import lru_cache
+from pathlib import Path
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+# Бит на ось: 26 бит дают ячейку около 0.6 м на экваторе, код умещается в 52 бита
+GEOCELL_BITS = 26
+EARTH_RADIUS_KM = 6371.0088
+# Сколько ячеек допускается в покрытии окрестности
+MAX_COVER_CELLS = 9
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'cities.csv'
+
+
+# --- Кодирование ---
+
+def _spread(value):
+    """Раздвигает биты value через один: abc -> a0b0c."""
+    result = 0
+    for bit in range(GEOCELL_BITS):
+        result |= ((value >> bit) & 1) << (2 * bit)
+    return result
+
+
+def _axis(value, low, high):
+    scaled = int((value - low) / (high - low) * (1 << GEOCELL_BITS))
+    return min(max(scaled, 0), (1 << GEOCELL_BITS) - 1)
+
+
+def encode(latitude, longitude):
+    """geocell точки: биты долготы на чётных позициях, широты — на нечётных."""
+    x = _axis(longitude, -180.0, 180.0)
+    y = _axis(latitude, -90.0, 90.0)
+    return _spread(x) | (_spread(y) << 1)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# --- Покрытие окрестности ячейками ---
+
+def _bounding_box(latitude, longitude, radius_km):
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # У полюсов долгота вырождается: берём весь диапазон
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    # Переход через 180-й меридиан не поддерживается: рамка обрезается
+    return (
+        max(-90.0, latitude - dlat), min(90.0, latitude + dlat),
+        max(-180.0, longitude - dlon), min(180.0, longitude + dlon),
+    )
+
+
+def cover_ranges(latitude, longitude, radius_km):
+    """
+    Диапазоны geocell [начало, конец), покрывающие круг радиуса radius_km.
+
+    Берётся самый мелкий уровень, на котором рамка круга покрывается не
+    более чем MAX_COVER_CELLS ячейками; соседние диапазоны склеиваются.
+    """
+    lat_min, lat_max, lon_min, lon_max = _bounding_box(latitude, longitude, radius_km)
+    x_min, x_max = _axis(lon_min, -180.0, 180.0), _axis(lon_max, -180.0, 180.0)
+    y_min, y_max = _axis(lat_min, -90.0, 90.0), _axis(lat_max, -90.0, 90.0)
+
+    for level in range(GEOCELL_BITS, -1, -1):
+        shift = GEOCELL_BITS - level
+        xs = range(x_min >> shift, (x_max >> shift) + 1)
+        ys = range(y_min >> shift, (y_max >> shift) + 1)
+        if len(xs) * len(ys) <= MAX_COVER_CELLS:
+            break
+
+    cells = sorted(_spread(x) | (_spread(y) << 1) for x in xs for y in ys)
+    ranges = []
+    for cell in cells:
+        start, end = cell << (2 * shift), (cell + 1) << (2 * shift)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [tuple(r) for r in ranges]
+
+
+def cover_filter(latitude, longitude, radius_km, prefix=''):
+    """Q-условие кандидатов по geocell (надмножество точек внутри круга)."""
+    condition = Q()
+    for start, end in cover_ranges(latitude, longitude, radius_km):
+        condition |= Q(**{f'{prefix}geocell__gte': start, f'{prefix}geocell__lt': end})
+    return condition
+
+
+def location_filter(params, prefix=''):
+    """Q-условие по ?city= (название или синоним из справочника) и ?online=true."""
+    condition = Q()
+    city = params.get('city')
+    if city:
+        found = find_city(city)
+        condition &= Q(**{f'{prefix}city': found['name'] if found else city.strip()})
+    if params.get('online', '').lower() in ('1', 'true', 'yes'):
+        condition &= Q(**{f'{prefix}works_online': True})
+    return condition
+
+
+def rank_by_distance(candidates, latitude, longitude, radius_km):
+    """
+    Точное уточнение в памяти: candidates — (id, широта, долгота).
+    Возвращает [(id, расстояние в км)] внутри радиуса, ближайшие сначала.
+    """
+    ranked = []
+    for pk, lat, lon in candidates:
+        distance = haversine_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            ranked.append((pk, distance))
+    ranked.sort(key=lambda item: (item[1], item[0]))
+    return ranked
+
+
+def parse_near(params, default_radius_km, max_radius_km):
+    """
+    Разбирает ?near=lat,lon&radius=км; возвращает (lat, lon, radius) или None.
+    """
+    near = params.get('near')
+    if not near:
+        return None
+    try:
+        latitude, longitude = (float(part) for part in near.split(','))
+    except ValueError:
+        raise ValidationError({'near': 'Ожидается near=широта,долгота'})
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValidationError({'near': 'Координаты вне допустимого диапазона'})
+    try:
+        radius_km = float(params.get('radius', default_radius_km))
+    except ValueError:
+        raise ValidationError({'radius': 'Радиус должен быть числом (км)'})
+    if not 0 < radius_km <= max_radius_km:
+        raise ValidationError({'radius': f'Радиус должен быть от 0 до {max_radius_km} км'})
+    return latitude, longitude, radius_km
+
+
+# --- Справочник городов ---
+
+@lru_cache(maxsize=1)
+def _gazetteer():
+    cities, index = [], {}
+    with open(GAZETTEER_PATH, encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            city = {
+                'name': row['name'],
+                'country': row['country'],
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+                'timezone': row['timezone'],
+            }
+            cities.append(city)
+            for name in [row['name'], *filter(None, row['aliases'].split('|'))]:
+                index[_normalize(name)] = city
+    return cities, index
+
+
+def _normalize(name):
+    return ' '.join(name.replace('ё', 'е').replace('Ё', 'Е').lower().replace('-', ' ').split())
+
+
+def find_city(name):
+    """Город справочника по названию или синониму (без учёта регистра) или None."""
+    if not name:
+        return None
+    return _gazetteer()[1].get(_normalize(name))
+
+
+def cities():
+    return list(_gazetteer()[0])
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import statistics
+import subprocess
+import threading
+import time
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.core.asgi import get_asgi_application
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import metrics, renderers
+from api.models import User, UserProfile, ClientProfile, TherapistProfile, Role
+
+ENDPOINTS = ('therapist-list', 'therapist-detail', 'public-user-profile', 'login', 'current-user', 'publication-list-create')
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный бенчмарк горячих эндпоинтов API внутри процесса (без сети). '
+        'Выводит пропускную способность, p50/p95/p99 и число SQL-запросов на запрос. '
+        'Для сравнения sync WSGI и async ASGI: запустить с --mode wsgi --output, затем '
+        'ASYNC_PUBLIC_VIEWS=True с --mode asgi --compare. Байты и CPU на страницу каталога '
+        'до и после: --endpoints therapist-list --json-backend stdlib --accept-encoding identity '
+        '--output base.json, затем с --json-backend orjson --accept-encoding gzip --compare base.json.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на эндпоинт')
+        parser.add_argument('--concurrency', type=int, default=8, help='Число одновременных клиентов')
+        parser.add_argument('--warmup', type=int, default=10, help='Прогревочных запросов на эндпоинт')
+        parser.add_argument('--mode', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--email', default='bench@example.com', help='Пользователь для авторизованных запросов')
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--json-backend', choices=('orjson', 'stdlib'), default=settings.JSON_RENDERER_BACKEND,
+                            help='Бэкенд FastJSONRenderer на время прогона')
+        parser.add_argument('--accept-encoding', default='identity',
+                            help='Заголовок Accept-Encoding запросов (identity — без сжатия)')
+        parser.add_argument('--output', help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--compare', help='JSON-файл прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--requests и --concurrency должны быть положительными')
+        if not metrics.is_enabled():
+            self.stdout.write(self.style.WARNING('METRICS_ENABLED выключен: число SQL-запросов не будет посчитано'))
+        if settings.DEBUG:
+            self.stdout.write(self.style.WARNING('DEBUG=True: результаты не отражают продакшен'))
+        pool_options = settings.DATABASES['default'].get('POOL')
+        if options['mode'] == 'wsgi' and isinstance(pool_options, dict) \
+                and options['concurrency'] > pool_options.get('max_size', 20):
+            # Каждый поток WSGI держит своё соединение на всё время запроса
+            self.stdout.write(self.style.WARNING(
+                f"--concurrency {options['concurrency']} больше размера пула "
+                f"({pool_options.get('max_size', 20)}): увеличьте DB_POOL_MAX_SIZE, иначе будут PoolTimeout"
+            ))
+
+        user = self._get_bench_user(options['email'], options['password'])
+        token = Token.objects.get_or_create(user=user)[0].key
+        targets = self._build_targets(options['endpoints'], options['email'], options['password'], token)
+        targets = {
+            name: (method, path, data, {**headers, 'Accept-Encoding': options['accept_encoding']})
+            for name, (method, path, data, headers) in targets.items()
+        }
+
+        results = {}
+        # Лимиты логина иначе превратят замер в замер ответов 429
+        with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'], THROTTLE_ENABLED=False,
+                               JSON_RENDERER_BACKEND=options['json_backend']):
+            if renderers.backend() != options['json_backend']:
+                self.stdout.write(self.style.WARNING('orjson не установлен: рендер через stdlib'))
+            for name, target in targets.items():
+                self._run(target, options['warmup'], options['concurrency'], options['mode'])
+                results[name] = self._measure(name, target, options)
+                self._print_result(name, results[name])
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'git_commit': self._git_commit(),
+                'mode': options['mode'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'debug': settings.DEBUG,
+                'async_public_views': settings.ASYNC_PUBLIC_VIEWS,
+                'json_backend': options['json_backend'],
+                'accept_encoding': options['accept_encoding'],
+            },
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+        if options['compare']:
+            self._compare(options['compare'], results)
+
+    # --- Подготовка данных ---
+
+    def _get_bench_user(self, email, password):
+        user, created = User.objects.get_or_create(
+            email=email, defaults={'username': email, 'is_client': True}
+        )
+        if created or not user.check_password(password):
+            user.set_password(password)
+            user.save(update_fields=['password'])
+        UserProfile.objects.get_or_create(user=user, defaults={'role': Role.CLIENT})
+        if user.is_client:
+            ClientProfile.objects.get_or_create(user=user)
+        return user
+
+    def _build_targets(self, names, email, password, token):
+        """Возвращает {имя URL: (метод, путь, данные, заголовки)}."""
+        auth = {'Authorization': f'Token {token}'}
+        therapist = TherapistProfile.objects.filter(
+            is_verified=True, is_subscribed=True
+        ).select_related('user').order_by('id').first()
+
+        targets = {}
+        for name in names:
+            if name in ('therapist-detail', 'public-user-profile') and therapist is None:
+                self.stdout.write(self.style.WARNING(f'{name}: нет верифицированных терапевтов, пропускаем'))
+                continue
+            if name == 'therapist-list':
+                targets[name] = ('get', '/api/therapists/', {}, {})
+            elif name == 'therapist-detail':
+                targets[name] = ('get', f'/api/therapists/{therapist.id}/', {}, {})
+            elif name == 'public-user-profile':
+                targets[name] = ('get', f'/api/users/{therapist.user.public_id}/profile/', {}, auth)
+            elif name == 'login':
+                targets[name] = ('post', '/api/auth/login/', {'email': email, 'password': password}, {})
+            elif name == 'current-user':
+                targets[name] = ('get', '/api/auth/user/', {}, auth)
+            elif name == 'publication-list-create':
+                targets[name] = ('get', '/api/publications/', {}, {})
+        return targets
+
+    # --- Прогон ---
+
+    def _run(self, target, count, concurrency, mode):
+        """Выполняет count запросов к target и возвращает список (задержка, статус, байты)."""
+        if count <= 0:
+            return []
+        if mode == 'asgi':
+            return asyncio.run(self._run_async(target, count, concurrency))
+        return self._run_sync(target, count, concurrency)
+
+    def _run_sync(self, target, count, concurrency):
+        method, path, data, headers = target
+        local = threading.local()
+
+        def one(_):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            start = time.perf_counter()
+            response = getattr(client, method)(path, data, headers=headers)
+            elapsed = time.perf_counter() - start
+            # Тестовый клиент не закрывает соединения в конце запроса, в отличие от сервера
+            close_old_connections()
+            return elapsed, response.status_code, len(response.content)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(one, range(count)))
+
+    async def _run_async(self, target, count, concurrency):
+        # Вызываем само ASGI-приложение, а не AsyncClient: так, как и под реальным
+        # сервером, срабатывает request_finished и соединения возвращаются в пул
+        application = get_asgi_application()
+        queue = asyncio.Queue()
+        for index in range(count):
+            queue.put_nowait(index)
+        samples = []
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                status, body = await _asgi_request(application, *target)
+                samples.append((time.perf_counter() - start, status, len(body)))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples
+
+    def _measure(self, name, target, options):
+        before = metrics.snapshot()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        samples = self._run(target, options['requests'], options['concurrency'], options['mode'])
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        after = metrics.snapshot()
+
+        latencies = sorted(sample[0] for sample in samples)
+        errors = sum(1 for sample in samples if sample[1] >= 400)
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput_rps': round(len(samples) / wall, 2),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+            'cpu_ms_per_request': round(cpu / len(samples) * 1000, 3),
+            'bytes_per_response': round(statistics.fmean(sample[2] for sample in samples), 1),
+            'queries_per_request': _queries_per_request(before, after, name),
+        }
+
+    # --- Отчёт ---
+
+    def _print_result(self, name, result):
+        queries = result['queries_per_request']
+        self.stdout.write(
+            f"{name:<24} {result['throughput_rps']:>9.1f} req/s  "
+            f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+            f"SQL/req {queries if queries is not None else '-':>5}  CPU {result['cpu_ms_per_request']:>7.2f} ms  "
+            f"{result['bytes_per_response']:>9.0f} B  ошибок {result['errors']}"
+        )
+
+    def _compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['endpoints']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+        self.stdout.write(f'\nСравнение с {path}:')
+        for name, result in results.items():
+            old = baseline.get(name)
+            if not old:
+                continue
+            self.stdout.write(
+                f"{name:<24} req/s {_delta(old['throughput_rps'], result['throughput_rps'])}  "
+                f"p95 {_delta(old['p95_ms'], result['p95_ms'])}  "
+                f"SQL/req {old['queries_per_request']} -> {result['queries_per_request']}  "
+                f"CPU/req {_delta(old['cpu_ms_per_request'], result['cpu_ms_per_request'])}  "
+                f"байт {_delta(old['bytes_per_response'], result['bytes_per_response'])}"
+            )
+
+    def _git_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+async def _asgi_request(application, method, path, data, headers):
+    """Выполняет один запрос к ASGI-приложению в памяти и возвращает (статус, тело)."""
+    path, _, query_string = path.partition('?')
+    body = urlencode(data).encode() if method == 'post' else b''
+    raw_headers = [(b'host', b'testserver')]
+    raw_headers += [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    if body:
+        raw_headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        raw_headers.append((b'content-length', str(len(body)).encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method.upper(),
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': raw_headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    finished = asyncio.Event()
+    request_sent = False
+    status = None
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                finished.set()
+
+    await application(scope, receive, send)
+    finished.set()
+    return status, b''.join(chunks)
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def _queries_per_request(before, after, endpoint):
+    """Среднее число SQL-запросов по разнице снимков api.metrics до и после прогона."""
+    requests_before, queries_before = metrics.endpoint_totals(before, endpoint)
+    requests_after, queries_after = metrics.endpoint_totals(after, endpoint)
+    requests = requests_after - requests_before
+    return round((queries_after - queries_before) / requests, 2) if requests else None
+
+
+def _delta(old, new):
+    if not old:
+        return f'{old} -> {new}'
+    return f'{old} -> {new} ({(new - old) / old * 100:+.1f}%)'
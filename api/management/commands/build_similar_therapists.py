@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.similarity import refresh
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает списки похожих терапевтов. По умолчанию — только для '
+        'профилей, затронутых изменениями навыков, языков, статуса или видимости; '
+        '--full пересчитывает всё (запускать периодически, например ночью).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все профили каталога')
+        parser.add_argument('--block-size', type=int, default=500, help='Профилей в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['block_size'] < 1:
+            raise CommandError('--block-size должен быть положительным')
+        started = time.monotonic()
+        updated, removed = refresh(full=options['full'], block_size=options['block_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано списков: {updated}, удалено: {removed} за {time.monotonic() - started:.1f} с'
+        ))
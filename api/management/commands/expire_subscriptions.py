@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.subscriptions import expire_subscriptions
+
+
+class Command(BaseCommand):
+    help = (
+        'Снимает подписку у терапевтов с истёкшим subscribed_until. '
+        'Запускать по расписанию (cron) или постоянно с --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Профилей в одной транзакции')
+        parser.add_argument('--interval', type=float, help='Повторять каждые N секунд, не завершаясь')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        while True:
+            expired = expire_subscriptions(options['batch_size'])
+            if expired or options['interval'] is None:
+                self.stdout.write(self.style.SUCCESS(f'Снято истёкших подписок: {expired}'))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,60 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает каталог терапевтов в CSV или NDJSON потоком (постоянная память). '
+        'Файл с расширением .gz сжимается gzip.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv', dest='kind')
+        parser.add_argument('--output', default='-', help='Путь к файлу; «-» — стандартный вывод')
+        parser.add_argument('--since', help='Только изменённые после момента (ISO 8601), включая убранные из каталога')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать gzip (по умолчанию — если --output оканчивается на .gz)')
+        parser.add_argument('--chunk-size', type=int, default=settings.CATALOG_EXPORT_CHUNK_SIZE,
+                            help='Строк в пачке серверного курсора')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since: ожидается дата и время в формате ISO 8601')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+        output = options['output']
+        compress = options['gzip'] or output.endswith('.gz')
+
+        counted = [0]
+
+        def rows():
+            for row in export.rows(since, options['chunk_size']):
+                counted[0] += 1
+                yield row
+
+        lines = export.csv_lines if options['kind'] == 'csv' else export.ndjson_lines
+        started_at = timezone.now()
+        stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        try:
+            for block in export.blocks(lines(rows()), compress):
+                stream.write(block)
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+            else:
+                stream.flush()
+        # При выводе в stdout отчёт уходит в stderr, чтобы не смешаться с данными
+        report = self.stderr if output == '-' else self.stdout
+        report.write(self.style.SUCCESS(
+            f'Выгружено профилей: {counted[0]}; since для следующей выгрузки: {started_at.isoformat()}'
+        ))
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import deletion
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет данные отключённых аккаунтов из очереди (AccountDeletion) пачками. '
+        'Запускать по расписанию (cron) или постоянно с --interval; '
+        'несколько экземпляров не мешают друг другу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ACCOUNT_DELETION_BATCH_SIZE,
+                            help='Строк в одной транзакции')
+        parser.add_argument('--interval', type=float, help='Повторять каждые N секунд, не завершаясь')
+
+    def report(self, job, step):
+        progress = job.progress[step]
+        self.stdout.write(f'Пользователь {job.user_id}: {step} {progress["done"]}/{progress["total"]}')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        while True:
+            done, failed = deletion.run(options['batch_size'], self.report)
+            if done or failed or options['interval'] is None:
+                self.stdout.write(self.style.SUCCESS(f'Удалено аккаунтов: {done}, с ошибкой: {failed}'))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
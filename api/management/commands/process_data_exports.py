@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import dataexport
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает архивы персональных данных из очереди (DataExport) и удаляет '
+        'архивы с истёкшим сроком хранения. Запускать по расписанию (cron) или '
+        'постоянно с --interval; несколько экземпляров не мешают друг другу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Повторять каждые N секунд, не завершаясь')
+
+    def handle(self, *args, **options):
+        while True:
+            built, failed, expired = dataexport.run()
+            if built or failed or expired or options['interval'] is None:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Собрано архивов: {built}, с ошибкой: {failed}, удалено по сроку: {expired}'
+                ))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет письма из очереди уведомлений (OutboxMessage). '
+        'Запускать по расписанию (cron) или постоянно с --interval; '
+        'несколько экземпляров не мешают друг другу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Писем в одной транзакции')
+        parser.add_argument('--interval', type=float, help='Повторять каждые N секунд, не завершаясь')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        # Один воркер на всё время работы: SMTP-соединение переиспользуется между проходами
+        worker = OutboxWorker(options['batch_size'])
+        try:
+            while True:
+                sent, retried, failed = worker.run()
+                if sent or retried or failed or options['interval'] is None:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Отправлено: {sent}, отложено: {retried}, не отправлено: {failed}'
+                    ))
+                if options['interval'] is None:
+                    return
+                time.sleep(options['interval'])
+        finally:
+            worker.close()
@@ -0,0 +1,380 @@
+import csv
+import io
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.db.models import Max
+
+from api import availability, geo
+from api.models import (
+    User, UserProfile, TherapistProfile, ClientProfile, Publication, TherapistPhoto, AvailabilityRule,
+    Skill, Language, Role, Gender, TherapistStatus
+)
+
+SKILL_NAMES = (
+    'Тревожность', 'Депрессия', 'Отношения в паре', 'Самооценка', 'Выгорание',
+    'Панические атаки', 'Детско-родительские отношения', 'Травма', 'Горе и утрата',
+    'Стресс', 'Зависимости', 'Расстройства пищевого поведения', 'ОКР', 'Кризисы',
+    'Профориентация', 'Эмиграция и адаптация', 'Сексуальность', 'Психосоматика',
+    'Одиночество', 'Конфликты', 'Гештальт-терапия', 'КПТ', 'Психоанализ',
+    'Семейная терапия', 'Арт-терапия',
+)
+
+# (название, код, вероятность владения)
+LANGUAGES = (
+    ('Русский', 'ru', 0.97), ('Английский', 'en', 0.35), ('Украинский', 'uk', 0.12),
+    ('Немецкий', 'de', 0.05), ('Испанский', 'es', 0.03), ('Французский', 'fr', 0.03),
+    ('Иврит', 'he', 0.02), ('Грузинский', 'ka', 0.02), ('Армянский', 'hy', 0.02),
+    ('Казахский', 'kk', 0.02),
+)
+
+FIRST_NAMES = ('Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Ирина', 'Алексей', 'Дмитрий', 'Иван', 'Сергей', 'Андрей', 'Павел')
+LAST_NAMES = ('Иванова', 'Смирнова', 'Кузнецова', 'Попова', 'Соколова', 'Лебедева', 'Петров', 'Волков', 'Морозов', 'Новиков', 'Фёдоров', 'Орлов')
+WORDS = (
+    'работаю', 'с', 'клиентами', 'в', 'подходе', 'помогаю', 'справиться', 'тревогой', 'отношениями',
+    'опыт', 'терапии', 'поддержка', 'чувства', 'жизнь', 'изменения', 'семья', 'дети', 'работа',
+    'стресс', 'границы', 'эмоции', 'доверие', 'процесс', 'встреча', 'онлайн', 'очно', 'запрос',
+)
+CITIES = ('Москва', 'Санкт-Петербург', 'Тбилиси', 'Ереван', 'Белград', 'Берлин', 'Онлайн')
+
+# Изображение, которое гарантированно лежит в MEDIA_ROOT
+SEED_IMAGE = 'defaults/default-avatar.png'
+
+SEED_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует детерминированный синтетический набор пользователей, профилей, '
+        'публикаций и фотографий для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--therapists', type=int, default=100_000)
+        parser.add_argument('--clients', type=int, default=1_000_000)
+        parser.add_argument('--publications-per-therapist', type=int, default=20, help='В среднем на терапевта')
+        parser.add_argument('--photos-per-therapist', type=int, default=3, help='Максимум на терапевта')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=4, help='Число процессов-загрузчиков')
+        parser.add_argument('--chunk-size', type=int, default=5_000, help='Пользователей в одной порции')
+        parser.add_argument('--password', default='seed-password', help='Общий пароль всех сгенерированных пользователей')
+        parser.add_argument('--method', choices=('auto', 'copy', 'bulk'), default='auto')
+
+    def handle(self, *args, **options):
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY доступен только для PostgreSQL')
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('SQLite не поддерживает параллельную запись, используем 1 процесс'))
+            workers = 1
+
+        skill_ids = self._ensure_skills()
+        language_weights = self._ensure_languages()
+        # Один PBKDF2-хеш на всех: иначе генерация упирается в хеширование паролей
+        password_hash = make_password(options['password'])
+
+        therapists, clients = options['therapists'], options['clients']
+        chunk_size = options['chunk_size']
+        context = {
+            'method': method,
+            'seed': options['seed'],
+            'password_hash': password_hash,
+            'skill_ids': skill_ids,
+            'language_weights': language_weights,
+            'publications': options['publications_per_therapist'],
+            'photos': options['photos_per_therapist'],
+            'bases': self._id_bases(),
+            'therapists': therapists,
+        }
+        tasks = [('therapists', start, min(chunk_size, therapists - start), context) for start in range(0, therapists, chunk_size)]
+        tasks += [('clients', start, min(chunk_size, clients - start), context) for start in range(0, clients, chunk_size)]
+
+        started = time.monotonic()
+        # Соединения родителя нельзя наследовать дочерними процессами
+        connections.close_all()
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                for kind, start, count in pool.map(_load_chunk, tasks):
+                    self.stdout.write(f'{kind}: {start}..{start + count - 1} загружено')
+        else:
+            for task in tasks:
+                kind, start, count = _load_chunk(task)
+                self.stdout.write(f'{kind}: {start}..{start + count - 1} загружено')
+
+        self._reset_sequences()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано {therapists} терапевтов и {clients} клиентов за {time.monotonic() - started:.1f} с'
+        ))
+
+    def _ensure_skills(self):
+        for name in SKILL_NAMES:
+            Skill.objects.get_or_create(name=name)
+        return list(Skill.objects.order_by('id').values_list('id', flat=True))
+
+    def _ensure_languages(self):
+        probabilities = {code: probability for _name, code, probability in LANGUAGES}
+        for name, code, _probability in LANGUAGES:
+            if not Language.objects.filter(code=code).exists():
+                Language.objects.get_or_create(name=name, defaults={'code': code})
+        return [
+            (language_id, probabilities.get(code, 0.01))
+            for language_id, code in Language.objects.order_by('id').values_list('id', 'code')
+        ]
+
+    def _id_bases(self):
+        """Первые свободные id: порции получают непересекающиеся диапазоны без обращений к БД."""
+        models = (User, UserProfile, TherapistProfile, ClientProfile, TherapistPhoto)
+        return {
+            model._meta.label: (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+            for model in models
+        }
+
+    def _reset_sequences(self):
+        models = [
+            User, UserProfile, TherapistProfile, ClientProfile, TherapistPhoto,
+            TherapistProfile.skills.through, TherapistProfile.languages.through,
+            ClientProfile.interested_topics.through,
+        ]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+# --- Работа в дочерних процессах ---
+
+def _init_worker():
+    django.setup()
+
+
+def _load_chunk(task):
+    kind, start, count, context = task
+    # Отдельное зерно на порцию: результат не зависит от числа процессов
+    rng = random.Random(f"{context['seed']}:{kind}:{start}")
+    if kind == 'therapists':
+        tables = _generate_therapists(rng, start, count, context)
+    else:
+        tables = _generate_clients(rng, start, count, context)
+
+    with transaction.atomic():
+        for model, rows in tables:
+            if not rows:
+                continue
+            if context['method'] == 'copy':
+                _copy_rows(model, rows)
+            else:
+                model.objects.bulk_create((model(**row) for row in rows), batch_size=1000)
+    connections.close_all()
+    return kind, start, count
+
+
+def _timestamp(rng):
+    return SEED_EPOCH - timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _user_row(rng, user_id, password_hash, is_therapist):
+    email = f'seed-{user_id}@example.com'
+    return {
+        'id': user_id,
+        'password': password_hash,
+        'last_login': None,
+        'is_superuser': False,
+        'username': email,
+        'first_name': rng.choice(FIRST_NAMES),
+        'last_name': rng.choice(LAST_NAMES),
+        'email': email,
+        'is_staff': False,
+        'is_active': True,
+        'date_joined': _timestamp(rng),
+        'is_therapist': is_therapist,
+        'is_client': not is_therapist,
+        'public_id': uuid.UUID(int=rng.getrandbits(128), version=4),
+    }
+
+
+def _user_profile_row(rng, profile_id, user_id, role, created_at):
+    return {
+        'id': profile_id,
+        'user_id': user_id,
+        'role': role,
+        'gender': rng.choice(Gender.values),
+        'profile_picture': '',
+        'pronouns': None,
+        'created_at': created_at,
+        'updated_at': created_at,
+    }
+
+
+def _zipf_sample(rng, ids, k):
+    """Выбирает k разных id с весами 1/rank: популярные темы встречаются чаще."""
+    weights = [1 / (rank + 1) for rank in range(len(ids))]
+    chosen = set()
+    while len(chosen) < min(k, len(ids)):
+        chosen.add(rng.choices(ids, weights)[0])
+    return chosen
+
+
+def _generate_therapists(rng, start, count, context):
+    bases = context['bases']
+    users, profiles, therapists, skills, languages, photos, publications = [], [], [], [], [], [], []
+    rules = []
+    for index in range(start, start + count):
+        user = _user_row(rng, bases['api.User'] + index, context['password_hash'], True)
+        created_at = user['date_joined']
+        therapist_id = bases['api.TherapistProfile'] + index
+        users.append(user)
+        profiles.append(_user_profile_row(rng, bases['api.UserProfile'] + index, user['id'], Role.THERAPIST, created_at))
+        therapist = {
+            'id': therapist_id,
+            'user_id': user['id'],
+            'about': _text(rng, rng.randint(20, 120)),
+            'experience_years': min(int(rng.expovariate(1 / 6)), 40),
+            'is_verified': rng.random() < 0.7,
+            'is_subscribed': rng.random() < 0.6,
+            'total_hours_worked': rng.randint(0, 5000),
+            'display_hours': rng.random() < 0.5,
+            'office_location': rng.choice(CITIES),
+            'city': '',
+            'latitude': None,
+            'longitude': None,
+            'geocell': None,
+            'status': rng.choice(TherapistStatus.values),
+            'short_video_url': None,
+            'view_count': 0,
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+        # COPY обходит сигналы: местоположение, geocell и флаг каталога считаем сами
+        city = geo.find_city(therapist['office_location'])
+        therapist['works_online'] = city is None or rng.random() < 0.3
+        if city is not None:
+            # Разброс кабинетов по городу: до ~15 км от центра
+            therapist['city'] = city['name']
+            therapist['latitude'] = city['latitude'] + rng.uniform(-0.13, 0.13)
+            therapist['longitude'] = city['longitude'] + rng.uniform(-0.2, 0.2)
+            therapist['geocell'] = geo.encode(therapist['latitude'], therapist['longitude'])
+        therapist['timezone'] = city['timezone'] if city is not None else 'Europe/Moscow'
+        therapist['is_listed'] = therapist['is_verified'] and therapist['is_subscribed']
+        therapists.append(therapist)
+        # Приём в несколько дней недели; окно правила считаем как сигнал fill_week_minutes
+        for weekday in rng.sample(range(7), rng.randint(1, 4)):
+            start_hour = rng.randint(8, 18)
+            rule = {
+                'therapist_id': therapist_id,
+                'weekday': weekday,
+                'start_time': dt_time(start_hour),
+                'end_time': dt_time(min(start_hour + rng.randint(2, 5), 23)),
+                'slot_minutes': rng.choice((50, 60)),
+                'valid_from': None,
+                'valid_until': None,
+            }
+            rule['week_minutes'] = availability.rule_week_minutes(AvailabilityRule(**rule), therapist['timezone'])
+            rules.append(rule)
+        for skill_id in _zipf_sample(rng, context['skill_ids'], rng.randint(2, 8)):
+            skills.append({'therapistprofile_id': therapist_id, 'skill_id': skill_id})
+        for language_id, probability in context['language_weights']:
+            if rng.random() < probability:
+                languages.append({'therapistprofile_id': therapist_id, 'language_id': language_id})
+        for order in range(rng.randint(0, context['photos'])):
+            photos.append({
+                'id': bases['api.TherapistPhoto'] + index * context['photos'] + order,
+                'therapist_profile_id': therapist_id,
+                'image': SEED_IMAGE,
+                'external_url': '',
+                'caption': None,
+                'order': order,
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+        for _ in range(int(rng.expovariate(1 / context['publications'])) if context['publications'] else 0):
+            published_at = _timestamp(rng)
+            publications.append({
+                'id': uuid.UUID(int=rng.getrandbits(128), version=4),
+                'author_id': user['id'],
+                'title': _text(rng, rng.randint(3, 8)),
+                'content': _text(rng, rng.randint(80, 400)),
+                'read_count': 0,
+                'created_at': published_at,
+                'updated_at': published_at,
+            })
+    return [
+        (User, users), (UserProfile, profiles), (TherapistProfile, therapists),
+        (TherapistProfile.skills.through, skills), (TherapistProfile.languages.through, languages),
+        (TherapistPhoto, photos), (Publication, publications), (AvailabilityRule, rules),
+    ]
+
+
+def _generate_clients(rng, start, count, context):
+    bases = context['bases']
+    users, profiles, clients, topics = [], [], [], []
+    for index in range(start, start + count):
+        offset = context['therapists'] + index
+        user = _user_row(rng, bases['api.User'] + offset, context['password_hash'], False)
+        created_at = user['date_joined']
+        client_id = bases['api.ClientProfile'] + index
+        users.append(user)
+        profiles.append(_user_profile_row(rng, bases['api.UserProfile'] + offset, user['id'], Role.CLIENT, created_at))
+        clients.append({
+            'id': client_id,
+            'user_id': user['id'],
+            'request_details': _text(rng, rng.randint(10, 60)) if rng.random() < 0.6 else None,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        for skill_id in _zipf_sample(rng, context['skill_ids'], rng.randint(0, 3)):
+            topics.append({'clientprofile_id': client_id, 'skill_id': skill_id})
+    return [
+        (User, users), (UserProfile, profiles), (ClientProfile, clients),
+        (ClientProfile.interested_topics.through, topics),
+    ]
+
+
+# --- Загрузка через COPY ---
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, NumericRange):
+        return f'[{value.lower},{value.upper})'
+    return str(value)
+
+
+def _copy_rows(model, rows):
+    fields = [field for field in model._meta.concrete_fields if field.attname in rows[0]]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[field.attname]) for field in fields])
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
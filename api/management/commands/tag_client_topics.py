@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import ClientProfile
+from api.topics import tag_clients
+
+
+class Command(BaseCommand):
+    help = (
+        'Проставляет темы (interested_topics) клиентам по описанию запроса. '
+        'По умолчанию — только клиентам без тем; --overwrite заменяет найденными и существующие.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Профилей в одной транзакции')
+        parser.add_argument('--overwrite', action='store_true', help='Заменить темы у клиентов, где что-то найдено')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным')
+        started = time.monotonic()
+        seen, tagged = tag_clients(
+            ClientProfile.objects.all(), chunk_size=options['chunk_size'], overwrite=options['overwrite']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено профилей: {seen}, проставлены темы: {tagged} за {time.monotonic() - started:.1f} с'
+        ))
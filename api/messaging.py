@@ -0,0 +1,65 @@
+"""
+Переписка клиента с терапевтом: отправка сообщений и выборки для доставки.
+
+Новое сообщение публикуется получателям через realtime.py после COMMIT;
+потерянные события (переподключение, переполнение очереди) клиент
+добирает по курсору — id последнего полученного сообщения.
+
+id выдаётся при INSERT, а видимым сообщение становится при COMMIT, поэтому
+сообщение 10 может зафиксироваться позже сообщения 11. Курсор не должен
+перескочить через него: отдаются только сообщения до первого свежего
+пропуска в последовательности id (settled_until).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, Greatest, Lag
+from django.utils import timezone
+
+from . import realtime
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+
+# Сколько сообщений отдаётся за один дозапрос по курсору
+CATCH_UP_LIMIT = 500
+
+
+def participant_filter(user, prefix=''):
+    """Условие «пользователь — участник диалога» для Conversation (prefix='conversation__' — для Message)."""
+    return Q(**{f'{prefix}client': user}) | Q(**{f'{prefix}therapist__user': user})
+
+
+def participants(conversation):
+    return [conversation.client_id, conversation.therapist.user_id]
+
+
+def send_message(conversation, sender, body):
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender=sender, body=body)
+        Conversation.objects.filter(pk=conversation.pk).update(last_message_at=message.created_at)
+        realtime.publish_message(MessageSerializer(message).data, participants(conversation))
+    return message
+
+
+def messages_after(user, after_id):
+    """Сообщения всех диалогов пользователя с id больше after_id, по возрастанию."""
+    return Message.objects.filter(participant_filter(user, 'conversation__'), id__gt=after_id).order_by('id')
+
+
+def settled_until(after_id):
+    """
+    Queryset из одного значения: наибольший id выше after_id, до которого
+    в последовательности нет свежих пропусков. Пропуск моложе
+    MESSAGING_REORDER_SECONDS — скорее всего, ещё открытая транзакция
+    с меньшим id; более старый считается откатом или удалением.
+    Пустой результат — пропусков нет, отдавать можно всё.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.MESSAGING_REORDER_SECONDS)
+    # Ниже последнего «старого» сообщения пропуски уже не свежие: окно — только недавние строки
+    stale_id = Message.objects.filter(created_at__lt=cutoff).order_by('-id').values('id')[:1]
+    start = Greatest(Value(after_id), Coalesce(Subquery(stale_id), Value(0)))
+    return Message.objects.filter(id__gt=start).annotate(
+        previous_id=Window(Lag('id', default=start), order_by='id'),
+    ).filter(id__gt=F('previous_id') + 1).order_by('id').values_list('previous_id', flat=True)[:1]
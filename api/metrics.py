@@ -0,0 +1,254 @@
+"""
+Метрики производительности по эндпоинтам в текстовом формате Prometheus.
+
+Каждый поток пишет в собственный шард, поэтому на горячем пути нет блокировок:
+шарды суммируются только при чтении /metrics. Шард завершившегося потока
+вливается в общий итог процесса и больше не хранится — серверы с потоком
+на запрос не накапливают шарды. Если задан METRICS_MULTIPROC_DIR, фоновый
+поток каждого процесса раз в METRICS_FLUSH_INTERVAL сбрасывает его снимок
+в файл этого каталога, а /metrics объединяет снимки всех воркеров Gunicorn.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from db.backends.postgresql.base import pool_stats
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограммы задержек (в секундах)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Порядок полей в записи эндпоинта
+_REQUESTS, _ERRORS, _LATENCY_SUM, _QUERIES, _SQL_SECONDS, _RESPONSE_BYTES = range(6)
+_BUCKETS_OFFSET = 6
+_RECORD_SIZE = _BUCKETS_OFFSET + len(LATENCY_BUCKETS)
+
+_local = threading.local()
+# (поток, шард) живых потоков; шарды завершившихся сливаются в _retired
+_shards = []
+_retired = {}
+_shards_lock = threading.Lock()
+_flusher_pid = None
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _get_shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        # Блокировка — только при первом запросе потока, не на каждую запись
+        with _shards_lock:
+            _prune_shards()
+            _shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def _prune_shards():
+    """Сливает шарды завершившихся потоков в _retired; вызывается под _shards_lock."""
+    alive = []
+    for thread, shard in _shards:
+        if thread.is_alive():
+            alive.append((thread, shard))
+        else:
+            # Поток завершён и в шард больше не пишет
+            for key, values in shard.items():
+                _merge_values(_retired, key, values)
+    _shards[:] = alive
+
+
+def record(endpoint, method, status_code, latency, queries, sql_seconds, response_bytes):
+    """Учитывает один обработанный запрос в шарде текущего потока."""
+    shard = _get_shard()
+    key = (endpoint, method)
+    values = shard.get(key)
+    if values is None:
+        values = shard[key] = [0] * _RECORD_SIZE
+    values[_REQUESTS] += 1
+    if status_code >= 500:
+        values[_ERRORS] += 1
+    values[_LATENCY_SUM] += latency
+    values[_QUERIES] += queries
+    values[_SQL_SECONDS] += sql_seconds
+    values[_RESPONSE_BYTES] += response_bytes
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if latency <= bound:
+            values[_BUCKETS_OFFSET + index] += 1
+            break
+    _ensure_flusher()
+
+
+def snapshot():
+    """Суммирует шарды всех потоков текущего процесса."""
+    with _shards_lock:
+        _prune_shards()
+        merged = {key: list(values) for key, values in _retired.items()}
+        shards = [shard for _thread, shard in _shards]
+    for shard in shards:
+        for key, values in list(shard.items()):
+            _merge_values(merged, key, values)
+    return merged
+
+
+def endpoint_totals(stats, endpoint):
+    """Возвращает (запросов, SQL-запросов) эндпоинта по всем методам из снимка."""
+    requests = queries = 0
+    for (name, _method), values in stats.items():
+        if name == endpoint:
+            requests += values[_REQUESTS]
+            queries += values[_QUERIES]
+    return requests, queries
+
+
+def _merge_values(merged, key, values):
+    target = merged.get(key)
+    if target is None:
+        merged[key] = list(values)
+    else:
+        for index, value in enumerate(values):
+            target[index] += value
+
+
+# --- Агрегация между процессами ---
+
+def _multiproc_dir():
+    return getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+
+def _ensure_flusher():
+    """Запускает фоновый сброс снимков в процессе (в том числе после fork воркера)."""
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not _multiproc_dir():
+        return
+    with _shards_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop():
+    # Запись файла — вне обработки запросов
+    pid = os.getpid()
+    while _flusher_pid == pid:
+        time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0))
+        try:
+            flush(_multiproc_dir())
+        except OSError:
+            logger.exception('Не удалось сбросить снимок метрик')
+
+
+def flush(directory):
+    """Атомарно записывает снимок процесса в каталог агрегации."""
+    pid = os.getpid()
+    data = [[endpoint, method, values] for (endpoint, method), values in snapshot().items()]
+    tmp_path = os.path.join(directory, f'.metrics_{pid}_{threading.get_ident()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, _snapshot_path(directory, pid))
+
+
+def collect():
+    """
+    Возвращает метрики текущего процесса, а при включённой агрегации —
+    сумму по всем процессам, оставившим снимки в METRICS_MULTIPROC_DIR.
+    """
+    merged = snapshot()
+    directory = _multiproc_dir()
+    if not directory:
+        return merged
+
+    own_path = _snapshot_path(directory, os.getpid())
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not (name.startswith('metrics_') and name.endswith('.json')) or path == own_path:
+            continue
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Файл мог быть удалён или ещё не дописан — пропускаем
+            continue
+        for endpoint, method, values in data:
+            _merge_values(merged, (endpoint, method), values)
+    return merged
+
+
+# --- Текстовый формат экспозиции ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(endpoint, method, **extra):
+    pairs = [('endpoint', endpoint), ('method', method)] + list(extra.items())
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _pool_lines():
+    """Показатели пула соединений БД текущего процесса (см. db.backends.postgresql)."""
+    pools = sorted(pool_stats().items())
+    gauges = (
+        ('db_pool_size', 'gauge', 'size'),
+        ('db_pool_idle', 'gauge', 'idle'),
+        ('db_pool_in_use', 'gauge', 'in_use'),
+        ('db_pool_max_size', 'gauge', 'max_size'),
+        ('db_pool_connections_created_total', 'counter', 'connections_created'),
+        ('db_pool_connections_closed_total', 'counter', 'connections_closed'),
+        ('db_pool_checkouts_total', 'counter', 'checkouts'),
+        ('db_pool_waits_total', 'counter', 'waits'),
+        ('db_pool_wait_seconds_total', 'counter', 'wait_seconds_total'),
+        ('db_pool_timeouts_total', 'counter', 'timeouts'),
+        ('db_pool_health_check_failures_total', 'counter', 'health_check_failures'),
+    )
+    lines = []
+    if not pools:
+        return lines
+    for name, metric_type, field in gauges:
+        lines.append(f'# TYPE {name} {metric_type}')
+        for (alias, _database), stats in pools:
+            lines.append(f'{name}{{alias="{_escape(alias)}",pid="{os.getpid()}"}} {stats[field]}')
+    return lines
+
+
+def render_exposition():
+    stats = sorted(collect().items())
+    lines = [
+        '# HELP http_request_duration_seconds Request latency by endpoint.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (endpoint, method), values in stats:
+        cumulative = 0
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            cumulative += values[_BUCKETS_OFFSET + index]
+            lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint, method, le=bound)} {cumulative}')
+        lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint, method, le="+Inf")} {values[_REQUESTS]}')
+        lines.append(f'http_request_duration_seconds_sum{_labels(endpoint, method)} {values[_LATENCY_SUM]}')
+        lines.append(f'http_request_duration_seconds_count{_labels(endpoint, method)} {values[_REQUESTS]}')
+
+    counters = (
+        ('http_request_errors_total', 'Responses with 5xx status by endpoint.', _ERRORS),
+        ('db_queries_total', 'SQL queries executed by endpoint.', _QUERIES),
+        ('db_query_duration_seconds_total', 'Time spent in SQL by endpoint.', _SQL_SECONDS),
+        ('http_response_bytes_total', 'Response body bytes by endpoint.', _RESPONSE_BYTES),
+    )
+    for name, help_text, index in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (endpoint, method), values in stats:
+            lines.append(f'{name}{_labels(endpoint, method)} {values[index]}')
+    lines.extend(_pool_lines())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,255 @@
+import gzip
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from . import db_router, metrics
+
+try:
+    import brotli
+except ImportError:  # в requirements.txt; без модуля отдаётся только gzip
+    brotli = None
+
+_query_counter = ContextVar('metrics_query_counter', default=None)
+
+
+class _QueryCounter:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    execute_wrapper, постоянно установленный на каждое соединение.
+
+    Счётчик текущего запроса берётся из ContextVar: asgiref копирует контекст
+    в потоки sync_to_async, поэтому запросы async-представлений тоже учитываются.
+    """
+    counter = _query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.seconds += time.perf_counter() - start
+        counter.queries += 1
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """Обработчик connection_created: вешает count_queries на соединение один раз."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+class MetricsMiddleware:
+    """
+    Собирает задержку, число SQL-запросов, время в SQL и размер ответа
+    для каждого запроса и записывает их под именем разрешённого URL.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = _QueryCounter()
+        token = _query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        self._record(request, response, counter, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        counter = _QueryCounter()
+        token = _query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        self._record(request, response, counter, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, counter, latency):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.view_name if match else '<unresolved>'
+        response_bytes = 0 if response.streaming else len(response.content)
+        metrics.record(
+            endpoint, request.method, response.status_code, latency,
+            counter.queries, counter.seconds, response_bytes,
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Разрешает чтение с реплик для безопасных запросов клиента, который
+    недавно ничего не записывал, и закрепляет его за основной базой после записи.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not db_router.replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response = self.get_response(request)
+            if response.status_code < 400:
+                db_router.pin_to_primary(request, response)
+            return response
+        if db_router.is_pinned_to_primary(request):
+            return self.get_response(request)
+
+        tokens = db_router.enable_replica_reads()
+        try:
+            response = self.get_response(request)
+            if db_router.has_written():
+                db_router.pin_to_primary(request, response)
+        finally:
+            db_router.reset_replica_reads(tokens)
+        return response
+
+    async def __acall__(self, request):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response = await self.get_response(request)
+            if response.status_code < 400:
+                await db_router.apin_to_primary(request, response)
+            return response
+        if await db_router.ais_pinned_to_primary(request):
+            return await self.get_response(request)
+
+        tokens = db_router.enable_replica_reads()
+        try:
+            response = await self.get_response(request)
+            if db_router.has_written():
+                await db_router.apin_to_primary(request, response)
+        finally:
+            db_router.reset_replica_reads(tokens)
+        return response
+
+
+def _accepted_encodings(header):
+    """{кодировка: q} из Accept-Encoding; q=0 означает явный запрет."""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate_encoding(header, encodings=None):
+    """
+    Выбирает 'br' или 'gzip' по Accept-Encoding (с учётом q и '*') или None.
+    br — только если установлен модуль brotli; при равном q предпочитается он.
+    encodings — свои варианты по убыванию предпочтения, например ('gzip',).
+    """
+    if encodings is None:
+        encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+    accepted = _accepted_encodings(header)
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    # mtime=0: одинаковое тело даёт одинаковые байты
+    return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы gzip или brotli по Accept-Encoding клиента.
+
+    Сжимаются только типы из COMPRESSION_TYPES (по умолчанию JSON API): HTML
+    с CSRF-токеном не сжимается, чтобы токен нельзя было подобрать по длине
+    ответа (BREACH). Не трогает потоковые ответы (SSE, выгрузки каталога и
+    архивов сами решают, сжимать ли поток), ответы с Content-Encoding или
+    Content-Range и тела короче COMPRESSION_MIN_SIZE — на них сжатие тратит
+    CPU, почти не уменьшая трафик.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.COMPRESSION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._process(request, await self.get_response(request))
+
+    def _process(self, request, response):
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or response.has_header('Content-Range')
+            or 'no-transform' in response.get('Cache-Control', '')
+            or len(response.content) < settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+        content_type = response.get('Content-Type', '').split(';', 1)[0].strip().lower()
+        if content_type not in settings.COMPRESSION_TYPES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        compressed = _compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Сильный ETag относится к несжатому телу (RFC 9110, 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_alter_user_public_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='publication',
+            index=models.Index(fields=['-created_at', '-id'], name='publication_created_id_idx'),
+        ),
+    ]
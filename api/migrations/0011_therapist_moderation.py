@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_publication_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='moderated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последняя модерация'),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='moderated_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Последний модератор'),
+        ),
+        migrations.CreateModel(
+            name='ModerationAction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('verify', 'Верифицировать'), ('unverify', 'Снять верификацию'), ('subscribe', 'Включить подписку'), ('unsubscribe', 'Отключить подписку')], max_length=20)),
+                ('therapist_ids', models.JSONField(default=list, verbose_name='ID изменённых профилей')),
+                ('affected', models.PositiveIntegerField(default=0, verbose_name='Изменено профилей')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='moderation_actions', to=settings.AUTH_USER_MODEL, verbose_name='Модератор')),
+            ],
+            options={
+                'verbose_name': 'Действие модерации',
+                'verbose_name_plural': 'Действия модерации',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_therapist_moderation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='subscribed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Подписка до'),
+        ),
+        migrations.AddIndex(
+            model_name='therapistprofile',
+            index=models.Index(condition=models.Q(('is_subscribed', True), ('subscribed_until__isnull', False)), fields=['subscribed_until'], name='therapist_sub_until_idx'),
+        ),
+    ]
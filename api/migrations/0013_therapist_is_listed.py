@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+def populate_listing(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    UserProfile = apps.get_model('api', 'UserProfile')
+    TherapistProfile = apps.get_model('api', 'TherapistProfile')
+    therapist_roles = UserProfile.objects.filter(user_id=models.OuterRef('pk'), role='THERAPIST')
+    client_roles = UserProfile.objects.filter(user_id=models.OuterRef('pk'), role='CLIENT')
+    User.objects.update(
+        is_therapist=models.Exists(therapist_roles),
+        is_client=models.Exists(client_roles),
+    )
+    TherapistProfile.objects.update(is_listed=models.ExpressionWrapper(
+        models.Q(is_verified=True, is_subscribed=True)
+        & models.Exists(UserProfile.objects.filter(user_id=models.OuterRef('user_id'), role='THERAPIST')),
+        output_field=models.BooleanField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_therapist_subscription_period'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='is_listed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Показывается в каталоге'),
+        ),
+        migrations.RunPython(populate_listing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='therapistprofile',
+            index=models.Index(condition=models.Q(('is_listed', True)), fields=['-created_at'], name='therapist_listed_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:23
+
+import re
+
+from django.db import migrations, models
+
+ONLINE_WORDS = {'онлайн', 'online', 'удалённо', 'удаленно', 'zoom', 'skype'}
+
+
+def populate_location(apps, schema_editor):
+    """Разбирает свободный office_location: город из справочника и признак онлайн."""
+    from api import geo
+
+    TherapistProfile = apps.get_model('api', 'TherapistProfile')
+    # Одинаковых значений office_location мало: обновляем группами, а не построчно
+    locations = (
+        TherapistProfile.objects.exclude(office_location='')
+        .values_list('office_location', flat=True).distinct()
+    )
+    for location in locations.iterator():
+        parts = [part.strip() for part in re.split(r'[,;/()]| и ', location) if part.strip()]
+        updates = {}
+        if any(part.lower() in ONLINE_WORDS for part in parts):
+            updates['works_online'] = True
+        city = next(filter(None, map(geo.find_city, parts)), None)
+        if city is not None:
+            updates.update(
+                city=city['name'], latitude=city['latitude'], longitude=city['longitude'],
+                geocell=geo.encode(city['latitude'], city['longitude']),
+            )
+        if updates:
+            TherapistProfile.objects.filter(office_location=location).update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_therapist_is_listed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='city',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Город'),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='geocell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Широта'),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Долгота'),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='works_online',
+            field=models.BooleanField(default=False, verbose_name='Работает онлайн'),
+        ),
+        migrations.RunPython(populate_location, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='therapistprofile',
+            index=models.Index(condition=models.Q(('geocell__isnull', False), ('is_listed', True)), fields=['geocell'], name='therapist_geocell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='therapistprofile',
+            index=models.Index(condition=models.Q(('is_listed', True)), fields=['city', '-created_at'], name='therapist_city_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='therapistprofile',
+            index=models.Index(condition=models.Q(('is_listed', True), ('works_online', True)), fields=['-created_at'], name='therapist_online_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:32
+
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_timezone(apps, schema_editor):
+    """Часовой пояс терапевта по городу из справочника."""
+    from api import geo
+
+    TherapistProfile = apps.get_model('api', 'TherapistProfile')
+    cities = TherapistProfile.objects.exclude(city='').values_list('city', flat=True).distinct()
+    for name in list(cities):
+        city = geo.find_city(name)
+        if city is not None:
+            TherapistProfile.objects.filter(city=name).update(timezone=city['timezone'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_therapist_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='timezone',
+            field=models.CharField(default='Europe/Moscow', max_length=64, verbose_name='Часовой пояс'),
+        ),
+        migrations.RunPython(populate_timezone, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='AvailabilityException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField(verbose_name='Начало')),
+                ('ends_at', models.DateTimeField(verbose_name='Конец')),
+                ('is_available', models.BooleanField(default=False, verbose_name='Дополнительное окно приёма')),
+                ('note', models.CharField(blank=True, max_length=200, verbose_name='Комментарий')),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_exceptions', to='api.therapistprofile', verbose_name='Терапевт')),
+            ],
+            options={
+                'verbose_name': 'Исключение расписания',
+                'verbose_name_plural': 'Исключения расписания',
+                'ordering': ['starts_at'],
+                'indexes': [models.Index(fields=['starts_at', 'ends_at'], name='availability_exc_range_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AvailabilityRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Понедельник'), (1, 'Вторник'), (2, 'Среда'), (3, 'Четверг'), (4, 'Пятница'), (5, 'Суббота'), (6, 'Воскресенье')], verbose_name='День недели')),
+                ('start_time', models.TimeField(verbose_name='Начало')),
+                ('end_time', models.TimeField(verbose_name='Конец')),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=50, verbose_name='Длительность слота, мин')),
+                ('valid_from', models.DateField(blank=True, null=True, verbose_name='Действует с')),
+                ('valid_until', models.DateField(blank=True, null=True, verbose_name='Действует по')),
+                ('week_minutes', django.contrib.postgres.fields.ranges.IntegerRangeField(editable=False, null=True)),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_rules', to='api.therapistprofile', verbose_name='Терапевт')),
+            ],
+            options={
+                'verbose_name': 'Правило расписания',
+                'verbose_name_plural': 'Правила расписания',
+                'ordering': ['weekday', 'start_time'],
+                'indexes': [django.contrib.postgres.indexes.GistIndex(fields=['week_minutes'], name='availability_rule_week_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Booking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField(verbose_name='Начало')),
+                ('ends_at', models.DateTimeField(verbose_name='Конец')),
+                ('status', models.CharField(choices=[('booked', 'Забронировано'), ('cancelled', 'Отменено')], default='booked', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to=settings.AUTH_USER_MODEL, verbose_name='Клиент')),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='api.therapistprofile', verbose_name='Терапевт')),
+            ],
+            options={
+                'verbose_name': 'Запись',
+                'verbose_name_plural': 'Записи',
+                'ordering': ['starts_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'booked')), fields=['starts_at'], name='booking_starts_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'booked')), fields=('therapist', 'starts_at'), name='booking_unique_slot')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publication',
+            name='read_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Прочтений'),
+        ),
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Просмотров профиля'),
+        ),
+        migrations.CreateModel(
+            name='TherapistStatHour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час (UTC)')),
+                ('profile_views', models.PositiveIntegerField(default=0, verbose_name='Просмотров профиля')),
+                ('publication_reads', models.PositiveIntegerField(default=0, verbose_name='Прочтений публикаций')),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_stats', to='api.therapistprofile', verbose_name='Терапевт')),
+            ],
+            options={
+                'verbose_name': 'Статистика за час',
+                'verbose_name_plural': 'Статистика по часам',
+                'constraints': [models.UniqueConstraint(fields=('therapist', 'hour'), name='therapist_stat_hour_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-19 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_view_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapistprofile',
+            name='similarity_signature',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='SimilarTherapist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.therapistprofile', verbose_name='Похожий терапевт')),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_entries', to='api.therapistprofile', verbose_name='Терапевт')),
+            ],
+            options={
+                'verbose_name': 'Похожий терапевт',
+                'verbose_name_plural': 'Похожие терапевты',
+                'ordering': ['therapist', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('therapist', 'rank'), name='similar_therapist_rank_unique')],
+            },
+        ),
+    ]
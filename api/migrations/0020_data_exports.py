@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:00
+
+import api.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_similar_therapists'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Собирается'), ('ready', 'Готова'), ('failed', 'Ошибка'), ('expired', 'Удалена по сроку')], default='pending', max_length=20)),
+                ('file', models.FileField(blank=True, storage=api.models.private_storage, upload_to='exports/', verbose_name='Архив')),
+                ('size', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Размер, байт')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Готова')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='data_exports', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка данных',
+                'verbose_name_plural': 'Выгрузки данных',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status__in', ['pending', 'running'])), fields=['created_at'], name='data_export_queue_idx')],
+            },
+        ),
+    ]
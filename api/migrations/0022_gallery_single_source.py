@@ -0,0 +1,74 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:09
+
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Должно совпадать с TherapistPhoto.external_url.max_length
+EXTERNAL_URL_MAX_LENGTH = 2000
+
+
+def move_photos_to_gallery(apps, schema_editor):
+    """
+    URL из JSON-списка photos становятся строками TherapistPhoto: указывающие
+    в MEDIA_URL — файлом в image, остальные — в external_url. Значения, которые
+    сохранить нельзя (не строки, слишком длинные), прерывают миграцию полным списком.
+    """
+    TherapistProfile = apps.get_model('api', 'TherapistProfile')
+    TherapistPhoto = apps.get_model('api', 'TherapistPhoto')
+    profiles = TherapistProfile.objects.exclude(photos=[]).only('id', 'photos')
+    invalid = [
+        (profile.id, url)
+        for profile in profiles.iterator()
+        for url in profile.photos or []
+        if not isinstance(url, str) or len(url) > EXTERNAL_URL_MAX_LENGTH
+    ]
+    if invalid:
+        raise ValueError(
+            f'Значения photos, которые нельзя перенести в галерею ({len(invalid)}), '
+            f'исправьте их и повторите миграцию: {invalid}'
+        )
+    for profile in profiles.iterator():
+        photos = TherapistPhoto.objects.filter(therapist_profile_id=profile.id)
+        existing = {(photo.image.name, photo.external_url) for photo in photos.only('image', 'external_url')}
+        start = photos.count()
+        rows = []
+        for url in profile.photos or []:
+            path = urlparse(url).path
+            if path.startswith(settings.MEDIA_URL):
+                key = (path[len(settings.MEDIA_URL):], '')
+            else:
+                key = ('', url)
+            if key not in existing:
+                existing.add(key)
+                rows.append(TherapistPhoto(
+                    therapist_profile_id=profile.id, image=key[0], external_url=key[1], order=start + len(rows),
+                ))
+        TherapistPhoto.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_account_deletions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='therapistphoto',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='therapist_photos/', verbose_name='Изображение'),
+        ),
+        migrations.AddField(
+            model_name='therapistphoto',
+            name='external_url',
+            field=models.URLField(blank=True, editable=False, max_length=2000, verbose_name='Внешний URL'),
+        ),
+        migrations.RunPython(move_photos_to_gallery, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='therapistprofile',
+            name='photos',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_gallery_single_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accountdeletion',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Попыток'),
+        ),
+        migrations.AddField(
+            model_name='accountdeletion',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Повтор'),
+        ),
+        migrations.AddIndex(
+            model_name='accountdeletion',
+            index=models.Index(condition=models.Q(('retry_at__isnull', False), ('status', 'failed')), fields=['retry_at'], name='account_deletion_retry_idx'),
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.fields import IntegerRangeField
+from django.contrib.postgres.indexes import GistIndex
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
 import uuid
 
 # --- Новые модели для выбора ---
@@ -72,11 +76,29 @@ class TherapistProfile(models.Model):
     experience_years = models.PositiveIntegerField("Лет опыта", default=0)
     is_verified = models.BooleanField(default=False)
     is_subscribed = models.BooleanField(default=False)
+    # None — бессрочная подписка; по истечении срока флаг снимает команда expire_subscriptions
+    subscribed_until = models.DateTimeField("Подписка до", null=True, blank=True)
+    # Денормализация: роль THERAPIST + is_verified + is_subscribed; считается в save(),
+    # смену роли переносит сигнал sync_role (api/signals.py)
+    is_listed = models.BooleanField("Показывается в каталоге", default=False, editable=False)
     skills = models.ManyToManyField(Skill, blank=True, related_name='therapists', verbose_name="Навыки/Специализации")
     languages = models.ManyToManyField(Language, blank=True, related_name='therapists', verbose_name="Языки")
     total_hours_worked = models.PositiveIntegerField("Всего часов практики", blank=True, null=True)
     display_hours = models.BooleanField("Показывать часы практики в профиле", default=False)
     office_location = models.CharField("Место/Формат работы", max_length=200, blank=True)
+    # Структурированное местоположение для поиска (справочник городов — api/data/cities.csv)
+    city = models.CharField("Город", max_length=100, blank=True)
+    latitude = models.FloatField("Широта", null=True, blank=True)
+    longitude = models.FloatField("Долгота", null=True, blank=True)
+    works_online = models.BooleanField("Работает онлайн", default=False)
+    # В этом поясе заданы правила расписания (AvailabilityRule)
+    timezone = models.CharField("Часовой пояс", max_length=64, default='Europe/Moscow')
+    # Z-order код координат (api/geo.py); заполняется сигналом при сохранении
+    geocell = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Накопленные просмотры профиля; пополняется пачками из буфера api/counters.py
+    view_count = models.PositiveBigIntegerField("Просмотров профиля", default=0, editable=False)
+    # Отпечаток признаков, по которым последний раз считались похожие терапевты (api/similarity.py)
+    similarity_signature = models.BigIntegerField(null=True, blank=True, editable=False)
     status = models.CharField(
         "Статус обучения/практики",
         max_length=20,
@@ -85,13 +107,72 @@ class TherapistProfile(models.Model):
         null=True
     )
     short_video_url = models.URLField("URL видеовизитки", max_length=500, blank=True, null=True)
-    photos = models.JSONField("Фотогалерея (массив URL)", default=list, blank=True)
+    moderated_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', verbose_name="Последний модератор"
+    )
+    moderated_at = models.DateTimeField("Последняя модерация", null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Публичный каталог без JOIN для фильтрации: новые сначала
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(is_listed=True),
+                name='therapist_listed_idx',
+            ),
+            # Поиск истёкших подписок диапазоном по сроку
+            models.Index(
+                fields=['subscribed_until'],
+                condition=models.Q(is_subscribed=True, subscribed_until__isnull=False),
+                name='therapist_sub_until_idx',
+            ),
+            # Поиск рядом с точкой: диапазоны geocell
+            models.Index(
+                fields=['geocell'],
+                condition=models.Q(is_listed=True, geocell__isnull=False),
+                name='therapist_geocell_idx',
+            ),
+            models.Index(
+                fields=['city', '-created_at'],
+                condition=models.Q(is_listed=True),
+                name='therapist_city_idx',
+            ),
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(is_listed=True, works_online=True),
+                name='therapist_online_idx',
+            ),
+        ]
+
+    # Поля, от которых зависит is_listed
+    LISTING_FIELDS = frozenset({'is_verified', 'is_subscribed', 'user'})
+
     def __str__(self):
         return f"Therapist: {self.user.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Пояс при загрузке: окна правил пересчитываются, только если он сменился (signals.refresh_week_minutes)
+        instance._loaded_timezone = instance.__dict__.get('timezone')
+        # Видимость в каталоге при загрузке: подсказки сбрасываются, только если она сменилась (autocomplete.invalidate)
+        instance._loaded_catalog = (instance.__dict__.get('is_listed'), instance.__dict__.get('subscribed_until'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # is_listed пишется тем же INSERT/UPDATE, без отдельного запроса после сохранения
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.LISTING_FIELDS & set(update_fields):
+            self.is_listed = self.is_verified and self.is_subscribed and UserProfile.objects.filter(
+                user_id=self.user_id, role=Role.THERAPIST
+            ).exists()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'is_listed'}
+        super().save(*args, **kwargs)
+
 class ClientProfile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='client_profile')
     request_details = models.TextField("Описание запроса", blank=True, null=True)
@@ -107,11 +188,16 @@ class Publication(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='publications')
     title = models.CharField(max_length=255, blank=True, null=True)
     content = models.TextField()
+    read_count = models.PositiveBigIntegerField("Прочтений", default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Ключ keyset-пагинации списков: (-created_at, -pk)
+            models.Index(fields=['-created_at', '-id'], name='publication_created_id_idx'),
+        ]
 
     def __str__(self):
         return self.title or f"Publication by {self.author.email}"
@@ -141,8 +227,11 @@ class TherapistPhoto(models.Model):
     )
     image = models.ImageField(
         upload_to='therapist_photos/', 
+        blank=True,
         verbose_name="Изображение"
     )
+    # Внешняя ссылка из прежнего JSON-списка фото (миграция 0022); у загруженных фото пустая
+    external_url = models.URLField("Внешний URL", max_length=2000, blank=True, editable=False)
     caption = models.CharField(
         max_length=200, 
         blank=True, 
@@ -163,3 +252,399 @@ class TherapistPhoto(models.Model):
 
     def __str__(self):
         return f"Фото {self.id} профиля {self.therapist_profile.user.email}"
+
+    @property
+    def url(self):
+        """URL файла в хранилище или внешний URL перенесённого фото; '' — нет ни того, ни другого."""
+        return self.image.url if self.image else self.external_url
+
+
+# --- Модерация ---
+
+class ModerationActionType(models.TextChoices):
+    VERIFY = 'verify', 'Верифицировать'
+    UNVERIFY = 'unverify', 'Снять верификацию'
+    SUBSCRIBE = 'subscribe', 'Включить подписку'
+    UNSUBSCRIBE = 'unsubscribe', 'Отключить подписку'
+
+
+class ModerationAction(models.Model):
+    """
+    Журнал массовой модерации: одна запись на действие, а не на профиль.
+    """
+    action = models.CharField(max_length=20, choices=ModerationActionType.choices)
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
+        related_name='moderation_actions', verbose_name="Модератор"
+    )
+    therapist_ids = models.JSONField("ID изменённых профилей", default=list)
+    affected = models.PositiveIntegerField("Изменено профилей", default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Действие модерации"
+        verbose_name_plural = "Действия модерации"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_action_display()}: {self.affected}"
+
+
+# --- Расписание и записи ---
+
+class Weekday(models.IntegerChoices):
+    MONDAY = 0, 'Понедельник'
+    TUESDAY = 1, 'Вторник'
+    WEDNESDAY = 2, 'Среда'
+    THURSDAY = 3, 'Четверг'
+    FRIDAY = 4, 'Пятница'
+    SATURDAY = 5, 'Суббота'
+    SUNDAY = 6, 'Воскресенье'
+
+
+class AvailabilityRule(models.Model):
+    """
+    Еженедельное окно приёма в часовом поясе терапевта, нарезаемое на слоты
+    по slot_minutes. Слоты не хранятся: их разворачивает api/availability.py.
+    """
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='availability_rules', verbose_name="Терапевт"
+    )
+    weekday = models.PositiveSmallIntegerField("День недели", choices=Weekday.choices)
+    start_time = models.TimeField("Начало")
+    end_time = models.TimeField("Конец")
+    slot_minutes = models.PositiveSmallIntegerField("Длительность слота, мин", default=50)
+    valid_from = models.DateField("Действует с", null=True, blank=True)
+    valid_until = models.DateField("Действует по", null=True, blank=True)
+    # Окно в минутах от начала недели UTC с запасом на переход на летнее время;
+    # заполняется сигналом, по нему GiST-индекс ищет пересечение с запрошенным интервалом
+    week_minutes = IntegerRangeField(editable=False, null=True)
+
+    class Meta:
+        verbose_name = "Правило расписания"
+        verbose_name_plural = "Правила расписания"
+        ordering = ['weekday', 'start_time']
+        indexes = [
+            GistIndex(fields=['week_minutes'], name='availability_rule_week_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_weekday_display()} {self.start_time:%H:%M}–{self.end_time:%H:%M}"
+
+
+class AvailabilityException(models.Model):
+    """
+    Исключение из расписания: недоступность (отпуск, болезнь) или
+    дополнительное окно приёма (is_available=True) в конкретные даты.
+    """
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='availability_exceptions', verbose_name="Терапевт"
+    )
+    starts_at = models.DateTimeField("Начало")
+    ends_at = models.DateTimeField("Конец")
+    is_available = models.BooleanField("Дополнительное окно приёма", default=False)
+    note = models.CharField("Комментарий", max_length=200, blank=True)
+
+    class Meta:
+        verbose_name = "Исключение расписания"
+        verbose_name_plural = "Исключения расписания"
+        ordering = ['starts_at']
+        indexes = [
+            models.Index(fields=['starts_at', 'ends_at'], name='availability_exc_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.starts_at:%Y-%m-%d %H:%M}–{self.ends_at:%Y-%m-%d %H:%M}"
+
+
+class BookingStatus(models.TextChoices):
+    BOOKED = 'booked', 'Забронировано'
+    CANCELLED = 'cancelled', 'Отменено'
+
+
+class Booking(models.Model):
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='bookings', verbose_name="Терапевт"
+    )
+    client = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='bookings', verbose_name="Клиент"
+    )
+    starts_at = models.DateTimeField("Начало")
+    ends_at = models.DateTimeField("Конец")
+    status = models.CharField(max_length=20, choices=BookingStatus.choices, default=BookingStatus.BOOKED)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Запись"
+        verbose_name_plural = "Записи"
+        ordering = ['starts_at']
+        constraints = [
+            # Последний рубеж против двойной записи на один слот
+            models.UniqueConstraint(
+                fields=['therapist', 'starts_at'],
+                condition=models.Q(status='booked'),
+                name='booking_unique_slot',
+            ),
+        ]
+        indexes = [
+            # Занятые интервалы в окне поиска по всем терапевтам
+            models.Index(fields=['starts_at'], condition=models.Q(status='booked'), name='booking_starts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.client} → {self.therapist} {self.starts_at:%Y-%m-%d %H:%M}"
+
+
+# --- Переписка ---
+
+class Conversation(models.Model):
+    """Диалог клиента с терапевтом: один на пару."""
+    client = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversations', verbose_name="Клиент"
+    )
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='conversations', verbose_name="Терапевт"
+    )
+    # Денормализация для сортировки списка диалогов без агрегата по сообщениям
+    last_message_at = models.DateTimeField("Последнее сообщение", null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Диалог"
+        verbose_name_plural = "Диалоги"
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'therapist'], name='conversation_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['therapist', '-last_message_at'], name='conversation_therapist_idx'),
+            models.Index(fields=['client', '-last_message_at'], name='conversation_client_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.client} ↔ {self.therapist}"
+
+
+class Message(models.Model):
+    # Возрастающий id — курсор истории и Last-Event-ID потока событий
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='messages', verbose_name="Диалог"
+    )
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages', verbose_name="Отправитель"
+    )
+    body = models.TextField("Текст")
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField("Прочитано", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Сообщение"
+        verbose_name_plural = "Сообщения"
+        indexes = [
+            # История диалога страницами от новых к старым: (conversation, -id)
+            models.Index(fields=['conversation', '-id'], name='message_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender}: {self.body[:50]}"
+
+
+# --- Исходящие уведомления ---
+
+class NotificationKind(models.TextChoices):
+    CLIENT_WELCOME = 'client_welcome', 'Регистрация клиента'
+    THERAPIST_WELCOME = 'therapist_welcome', 'Регистрация терапевта'
+    INVITE_USED = 'invite_used', 'Использован код приглашения'
+    VERIFICATION_CHANGED = 'verification_changed', 'Изменена верификация'
+    NEW_PUBLICATION = 'new_publication', 'Новая публикация'
+
+
+class OutboxStatus(models.TextChoices):
+    PENDING = 'pending', 'Ожидает отправки'
+    SENT = 'sent', 'Отправлено'
+    FAILED = 'failed', 'Не отправлено'
+
+
+class OutboxMessage(models.Model):
+    """
+    Письмо, записанное в транзакции вызвавшего его события и отправляемое
+    командой process_outbox (api/outbox.py).
+    """
+    kind = models.CharField(max_length=30, choices=NotificationKind.choices)
+    recipient = models.EmailField("Получатель")
+    subject = models.CharField("Тема", max_length=255)
+    body = models.TextField("Текст")
+    status = models.CharField(max_length=20, choices=OutboxStatus.choices, default=OutboxStatus.PENDING)
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    next_attempt_at = models.DateTimeField("Следующая попытка", default=timezone.now)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField("Отправлено", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Исходящее письмо"
+        verbose_name_plural = "Исходящие письма"
+        indexes = [
+            # Очередь воркера: только ожидающие, по времени следующей попытки
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='pending'),
+                name='outbox_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} → {self.recipient}"
+
+
+# --- Статистика просмотров ---
+
+class TherapistStatHour(models.Model):
+    """
+    Почасовой итог просмотров профиля терапевта и прочтений его публикаций.
+    Строки пополняет сброс буфера счётчиков (api/counters.py).
+    """
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='hourly_stats', verbose_name="Терапевт"
+    )
+    hour = models.DateTimeField("Час (UTC)")
+    profile_views = models.PositiveIntegerField("Просмотров профиля", default=0)
+    publication_reads = models.PositiveIntegerField("Прочтений публикаций", default=0)
+
+    class Meta:
+        verbose_name = "Статистика за час"
+        verbose_name_plural = "Статистика по часам"
+        constraints = [
+            # Ключ upsert при сбросе и индекс выборки периода терапевта
+            models.UniqueConstraint(fields=['therapist', 'hour'], name='therapist_stat_hour_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.therapist_id} @ {self.hour:%Y-%m-%d %H:00}"
+
+
+# --- Похожие терапевты ---
+
+class SimilarTherapist(models.Model):
+    """
+    Предрассчитанный список похожих терапевтов (команда build_similar_therapists).
+    Хранится с запасом: при показе отбрасываются исчезнувшие из каталога.
+    """
+    therapist = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='similar_entries', verbose_name="Терапевт"
+    )
+    similar = models.ForeignKey(
+        TherapistProfile, on_delete=models.CASCADE, related_name='+', verbose_name="Похожий терапевт"
+    )
+    rank = models.PositiveSmallIntegerField("Место")
+    score = models.FloatField("Сходство")
+
+    class Meta:
+        verbose_name = "Похожий терапевт"
+        verbose_name_plural = "Похожие терапевты"
+        ordering = ['therapist', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['therapist', 'rank'], name='similar_therapist_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.therapist_id} ~ {self.similar_id} ({self.score:.3f})"
+
+
+# --- Выгрузка персональных данных ---
+
+def private_storage():
+    """Хранилище вне MEDIA_ROOT: файлы отдаются только через проверяющие доступ вьюхи."""
+    return FileSystemStorage(location=settings.PRIVATE_MEDIA_ROOT)
+
+
+class DataExportStatus(models.TextChoices):
+    PENDING = 'pending', 'В очереди'
+    RUNNING = 'running', 'Собирается'
+    READY = 'ready', 'Готова'
+    FAILED = 'failed', 'Ошибка'
+    EXPIRED = 'expired', 'Удалена по сроку'
+
+
+class DataExport(models.Model):
+    """
+    Архив с данными пользователя; собирается командой process_data_exports
+    (api/dataexport.py), хранится DATA_EXPORT_KEEP_HOURS часов.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='data_exports', verbose_name="Пользователь"
+    )
+    status = models.CharField(max_length=20, choices=DataExportStatus.choices, default=DataExportStatus.PENDING)
+    file = models.FileField("Архив", upload_to='exports/', storage=private_storage, blank=True)
+    size = models.PositiveBigIntegerField("Размер, байт", null=True, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField("Начата", null=True, blank=True)
+    finished_at = models.DateTimeField("Готова", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Выгрузка данных"
+        verbose_name_plural = "Выгрузки данных"
+        ordering = ['-created_at']
+        indexes = [
+            # Очередь воркера: ещё не собранные
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='data_export_queue_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Выгрузка {self.id} для {self.user_id} ({self.status})"
+
+
+# --- Удаление аккаунтов ---
+
+class AccountDeletionStatus(models.TextChoices):
+    PENDING = 'pending', 'В очереди'
+    RUNNING = 'running', 'Удаляется'
+    DONE = 'done', 'Удалён'
+    FAILED = 'failed', 'Ошибка'
+
+
+class AccountDeletion(models.Model):
+    """
+    Фоновое удаление аккаунта (api/deletion.py): аккаунт отключается сразу,
+    данные удаляет команда process_account_deletions пачками. Запись
+    переживает пользователя, поэтому ссылается на него по id, а не внешним ключом.
+    """
+    user_id = models.BigIntegerField("ID пользователя", db_index=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', verbose_name="Кто запросил"
+    )
+    status = models.CharField(max_length=20, choices=AccountDeletionStatus.choices, default=AccountDeletionStatus.PENDING)
+    # {шаг: {"total": сколько было, "done": сколько обработано}}
+    progress = models.JSONField("Ход удаления", default=dict, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField("Начато", null=True, blank=True)
+    finished_at = models.DateTimeField("Завершено", null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    # Когда повторить упавшее задание; пусто — попытки исчерпаны
+    retry_at = models.DateTimeField("Повтор", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Удаление аккаунта"
+        verbose_name_plural = "Удаления аккаунтов"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='account_deletion_queue_idx',
+            ),
+            models.Index(
+                fields=['retry_at'],
+                condition=models.Q(status='failed', retry_at__isnull=False),
+                name='account_deletion_retry_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Удаление пользователя {self.user_id} ({self.status})"
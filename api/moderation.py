@@ -0,0 +1,81 @@
+"""
+Массовая модерация профилей терапевтов.
+
+Действие над любым числом профилей — блокировка затронутых строк
+(SELECT ... FOR UPDATE по порядку id) и один UPDATE, который заодно
+записывает модератора и время. Затем одна запись в журнал ModerationAction.
+Смена верификации ставит письма терапевтам в outbox в той же транзакции.
+"""
+from django.db import router, transaction
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
+from django.utils import timezone
+
+from . import outbox
+from .models import TherapistProfile, UserProfile, ModerationAction, ModerationActionType, NotificationKind, Role
+
+# Действие -> (поле, новое значение)
+ACTION_UPDATES = {
+    ModerationActionType.VERIFY: ('is_verified', True),
+    ModerationActionType.UNVERIFY: ('is_verified', False),
+    ModerationActionType.SUBSCRIBE: ('is_subscribed', True),
+    ModerationActionType.UNSUBSCRIBE: ('is_subscribed', False),
+}
+# Дополнительные поля, которые меняются вместе с основным
+EXTRA_UPDATES = {
+    # Ручная подписка бессрочна: старый истёкший срок снял бы её при следующей очистке
+    ModerationActionType.SUBSCRIBE: {'subscribed_until': None},
+}
+
+
+def _listed_value(field_name, value):
+    """
+    Новое значение is_listed (см. signals.listed_expression) для UPDATE.
+
+    В SET видны старые значения строки, поэтому изменяемое поле
+    подставляется уже новым значением.
+    """
+    if not value:
+        return False
+    other = 'is_subscribed' if field_name == 'is_verified' else 'is_verified'
+    return ExpressionWrapper(
+        Q(**{other: True}) & Exists(UserProfile.objects.filter(user_id=OuterRef('user_id'), role=Role.THERAPIST)),
+        output_field=BooleanField(),
+    )
+
+
+def moderate_therapists(queryset, action, actor):
+    """
+    Применяет action к профилям из queryset одним UPDATE.
+
+    Профили, у которых значение уже нужное, не трогаются и в журнал не
+    попадают. Возвращает список ID изменённых профилей.
+    """
+    field_name, value = ACTION_UPDATES[action]
+    alias = router.db_for_write(TherapistProfile)
+    now = timezone.now()
+    actor_id = actor.pk if actor is not None else None
+
+    with transaction.atomic(using=alias):
+        # Строки блокируются по порядку id: параллельные действия не ждут друг друга по кругу
+        therapist_ids = list(
+            TherapistProfile.objects.using(alias).select_for_update()
+            .filter(pk__in=queryset.order_by().values('pk')).exclude(**{field_name: value})
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        if not therapist_ids:
+            return therapist_ids
+        TherapistProfile.objects.using(alias).filter(pk__in=therapist_ids).update(
+            **{field_name: value}, **EXTRA_UPDATES.get(action, {}),
+            is_listed=_listed_value(field_name, value),
+            moderated_by_id=actor_id, moderated_at=now, updated_at=now,
+        )
+        ModerationAction.objects.using(alias).create(
+            action=action, actor_id=actor_id,
+            therapist_ids=therapist_ids, affected=len(therapist_ids),
+        )
+        if field_name == 'is_verified':
+            emails = TherapistProfile.objects.using(alias).filter(
+                id__in=therapist_ids
+            ).values_list('user__email', flat=True)
+            outbox.enqueue(NotificationKind.VERIFICATION_CHANGED, emails, is_verified=value)
+    return therapist_ids
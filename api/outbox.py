@@ -0,0 +1,171 @@
+"""
+Транзакционный outbox уведомлений.
+
+Событие (регистрация, модерация, публикация) записывает письмо в
+OutboxMessage в своей же транзакции: откат события отменяет и письмо,
+а запрос не ждёт SMTP. Команда process_outbox забирает ожидающие письма
+пачками через SELECT ... FOR UPDATE SKIP LOCKED — параллельные воркеры
+не берут одни и те же строки, — сдвигает их next_attempt_at на
+OUTBOX_CLAIM_SECONDS и сразу фиксирует транзакцию: медленный SMTP-сервер
+не держит блокировки строк. Затем пачка отправляется по одному открытому
+SMTP-соединению, и результаты записываются отдельным UPDATE. Временные
+ошибки откладывают письмо с экспоненциальной задержкой, постоянные (5xx)
+и исчерпание попыток — помечают FAILED.
+
+Доставка «как минимум один раз»: если воркер упадёт после отправки, но
+до записи результата, письмо уйдёт повторно, когда истечёт срок захвата.
+"""
+import logging
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutboxMessage, OutboxStatus
+
+logger = logging.getLogger(__name__)
+
+
+def render(kind, context):
+    """(тема, текст) письма: первая строка шаблона notifications/<kind>.txt — тема."""
+    subject, _, body = render_to_string(f'notifications/{kind}.txt', context).strip().partition('\n')
+    return subject.strip(), body.strip()
+
+
+def enqueue(kind, recipients, **context):
+    """
+    Ставит письмо kind в очередь каждому адресу из recipients.
+    Вызывать внутри транзакции события; текст рендерится один раз.
+    """
+    recipients = [email for email in dict.fromkeys(recipients) if email]
+    if not recipients:
+        return []
+    subject, body = render(kind, context)
+    return OutboxMessage.objects.bulk_create(
+        OutboxMessage(kind=kind, recipient=email, subject=subject, body=body) for email in recipients
+    )
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед попыткой attempts + 1, с разбросом ±20%."""
+    delay = min(settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _is_permanent(exc):
+    # 5xx SMTP — адрес или письмо отвергнуты окончательно
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _message in exc.recipients.values())
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+class OutboxWorker:
+    """
+    Отправитель очереди. SMTP-соединение открывается при первой пачке
+    и переиспользуется, пока работает воркер или пока сервер его не оборвёт.
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+
+    def _connection(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        return self.connection
+
+    def _check_connection(self):
+        """Между пачками сервер мог закрыть простаивающее соединение: проверяем NOOP."""
+        smtp = getattr(self.connection, 'connection', None)
+        if smtp is None:
+            return
+        try:
+            alive = smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            alive = False
+        if not alive:
+            self.close()
+
+    def claim(self):
+        """Забирает пачку: строки скрываются от других воркеров на OUTBOX_CLAIM_SECONDS, транзакция коротка."""
+        with transaction.atomic():
+            now = timezone.now()
+            batch = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboxStatus.PENDING, next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:self.batch_size]
+            )
+            if batch:
+                OutboxMessage.objects.filter(id__in=[message.id for message in batch]).update(
+                    next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS)
+                )
+        return batch
+
+    def process_batch(self):
+        """Отправляет одну пачку; возвращает (отправлено, отложено, отвергнуто)."""
+        sent, retried, failed = [], [], []
+        batch = self.claim()
+        if not batch:
+            return 0, 0, 0
+        self._check_connection()
+        # SMTP — вне транзакции: блокировки строк уже сняты
+        for index, message in enumerate(batch):
+            message.attempts += 1
+            try:
+                email = EmailMessage(
+                    message.subject, message.body, settings.DEFAULT_FROM_EMAIL, [message.recipient],
+                    connection=self._connection(),
+                )
+                email.send()
+            except Exception as exc:
+                message.last_error = f'{type(exc).__name__}: {exc}'[:2000]
+                if _is_permanent(exc) or message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    message.status = OutboxStatus.FAILED
+                    failed.append(message)
+                else:
+                    message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
+                    retried.append(message)
+                if not isinstance(exc, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    # Соединение потеряно: остаток пачки — в следующий раз, без расхода попыток
+                    logger.warning('SMTP недоступен: %s', message.last_error)
+                    self.close()
+                    self._postpone(batch[index + 1:], timezone.now() + retry_delay(1))
+                    break
+            else:
+                message.status = OutboxStatus.SENT
+                message.sent_at = timezone.now()
+                message.last_error = ''
+                sent.append(message)
+        OutboxMessage.objects.bulk_update(
+            sent + retried + failed,
+            ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'],
+        )
+        return len(sent), len(retried), len(failed)
+
+    def _postpone(self, messages, until):
+        OutboxMessage.objects.filter(id__in=[message.id for message in messages]).update(next_attempt_at=until)
+
+    def run(self, max_batches=None):
+        """Отправляет пачки, пока очередь не опустеет; возвращает суммы (отправлено, отложено, отвергнуто)."""
+        totals = [0, 0, 0]
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            result = self.process_batch()
+            totals = [total + count for total, count in zip(totals, result)]
+            batches += 1
+            if sum(result) < self.batch_size:
+                break
+        return tuple(totals)
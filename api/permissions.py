@@ -1,3 +1,6 @@
+import secrets
+
+from django.conf import settings
 from rest_framework import permissions
 from .models import Role
 
@@ -61,5 +64,22 @@ class IsTherapistOwner(permissions.BasePermission):
         # Для TherapistPhoto с полем therapist_profile
         if hasattr(obj, 'therapist_profile'):
             return obj.therapist_profile == request.user.therapist_profile
+
+        # Для правил и исключений расписания с полем therapist
+        if hasattr(obj, 'therapist'):
+            return obj.therapist_id == request.user.therapist_profile.id
             
-        return False 
\ No newline at end of file
+        return False 
+
+
+class HasExportToken(permissions.BasePermission):
+    """
+    Доступ партнёров к выгрузке каталога: заголовок X-Export-Token
+    с одним из ключей CATALOG_EXPORT_TOKENS.
+    """
+
+    def has_permission(self, request, view):
+        token = request.headers.get('X-Export-Token', '')
+        return bool(token) and any(
+            secrets.compare_digest(token.encode(), allowed.encode()) for allowed in settings.CATALOG_EXPORT_TOKENS
+        )
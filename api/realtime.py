@@ -0,0 +1,192 @@
+"""
+Доставка новых сообщений в открытые соединения (SSE и long-poll).
+
+Подписчики — asyncio-очереди в event loop ASGI-сервера: тысяча
+простаивающих соединений — тысяча очередей, а не тысяча потоков.
+Публикация потокобезопасна (sync-представления работают в потоках)
+и происходит только после фиксации транзакции.
+
+Между процессами события передаёт PostgreSQL LISTEN/NOTIFY
+(MESSAGING_PG_NOTIFY): pg_notify выполняется в транзакции сообщения и
+доставляется при COMMIT, а в каждом процессе один поток-слушатель
+раздаёт уведомления локальным подписчикам.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'psy_messages'
+# Предел полезной нагрузки NOTIFY — 8000 байт; длинные сообщения отправляются без текста
+NOTIFY_MAX_PAYLOAD = 7500
+# Событий в очереди одного подписчика; при переполнении он перечитывает базу
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """Очередь событий одного соединения; overflowed — события терялись."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def drain(self):
+        """Отбрасывает накопившиеся события: их заменяет одно чтение из базы."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.overflowed = False
+
+    async def get(self, timeout):
+        """Следующее событие или None по таймауту."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Внутрипроцессный pub/sub по именованным каналам."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        if settings.MESSAGING_PG_NOTIFY:
+            ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт: соединение умерло вместе с ним
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+broker = Broker()
+
+
+def _dispatch(payload):
+    for user_id in payload.pop('users'):
+        broker.publish(user_channel(user_id), payload)
+
+
+def publish_message(message_data, user_ids, using='default'):
+    """
+    Публикует сериализованное сообщение для получателей после COMMIT
+    текущей транзакции (вне транзакции — сразу).
+    """
+    payload = {'users': list(user_ids), 'message': message_data}
+    if not settings.MESSAGING_PG_NOTIFY:
+        transaction.on_commit(lambda: _dispatch(payload), using=using)
+        return
+    data = json.dumps(payload, ensure_ascii=False, default=str)
+    if len(data.encode()) > NOTIFY_MAX_PAYLOAD:
+        # Получатели дочитают текст из базы по id
+        data = json.dumps({'users': payload['users'], 'message': {'id': message_data['id']}})
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, data])
+
+
+# --- Мост LISTEN/NOTIFY ---
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class _Listener(threading.Thread):
+    """Поток процесса, слушающий NOTIFY_CHANNEL на отдельном соединении вне пула."""
+
+    def __init__(self):
+        super().__init__(name='messaging-listener', daemon=True)
+        self.pid = os.getpid()
+        self.delay = 1
+
+    def run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Соединение LISTEN потеряно, переподключение через %s с', self.delay)
+                time.sleep(self.delay)
+                self.delay = min(self.delay * 2, 30)
+
+    def _listen(self):
+        params = connection.get_connection_params()
+        conn = psycopg2.connect(**params)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+            self.delay = 1
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        _dispatch(json.loads(notify.payload))
+                    except (ValueError, KeyError):
+                        logger.warning('Некорректное уведомление: %r', notify.payload[:200])
+        finally:
+            conn.close()
+
+
+def ensure_listener():
+    """Запускает поток-слушатель в текущем процессе (повторно — после fork)."""
+    global _listener
+    if _listener is not None and _listener.pid == os.getpid() and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is None or _listener.pid != os.getpid() or not _listener.is_alive():
+            _listener = _Listener()
+            _listener.start()
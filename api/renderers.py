@@ -0,0 +1,47 @@
+"""
+Быстрый JSON-рендерер DRF.
+
+JSONRenderer из DRF сериализует через json.dumps с DjangoJSONEncoder-подобным
+encoder'ом: на каждый объект — вызов Python-метода default и сборка строки
+в чистом Python. orjson (если установлен) пишет UUID, datetime/date/time,
+dict/list и их подклассы (ReturnDict, ReturnList) на C сразу в bytes; через
+default проходят только редкие типы — Decimal, ленивые строки, QuerySet.
+
+Бэкенд выбирается настройкой JSON_RENDERER_BACKEND ('orjson' или 'stdlib')
+при каждом рендере, поэтому его можно переключить через override_settings
+(так делает бенчмарк). Без установленного orjson используется stdlib.
+"""
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # необязательная зависимость
+    orjson = None
+
+# Ключи-числа (ошибки элементов списков) превращаются в строки, как в json.dumps
+_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+_default = JSONEncoder().default
+
+
+def backend():
+    """Бэкенд, который реально будет использован: 'orjson' или 'stdlib'."""
+    if orjson is not None and settings.JSON_RENDERER_BACKEND == 'orjson':
+        return 'orjson'
+    return 'stdlib'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer с сериализацией через orjson; вывод совпадает по смыслу с DRF."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if backend() != 'orjson':
+            return super().render(data, accepted_media_type, renderer_context)
+        options = _OPTIONS
+        # orjson умеет только отступ в 2 пробела; любой запрошенный отступ даёт его
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
@@ -3,12 +3,18 @@ from django.contrib.auth import get_user_model
 from django.db import transaction
 from .models import (
     UserProfile, TherapistProfile, ClientProfile, InviteCode, Role, Gender,
-    Skill, Language, TherapistPhoto, Publication
+    Skill, Language, TherapistPhoto, Publication, ModerationActionType,
+    AvailabilityRule, AvailabilityException, Booking, Conversation, Message, NotificationKind, SimilarTherapist,
+    DataExport, DataExportStatus
 )
+from . import availability, dataexport, geo, outbox, topics
+from django.urls import reverse
+from datetime import timedelta
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 import uuid
 from django.conf import settings
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -60,6 +66,8 @@ class TherapistPhotoSerializer(serializers.ModelSerializer):
         model = TherapistPhoto
         fields = ('id', 'image', 'image_url', 'caption', 'order', 'therapist_profile')
         read_only_fields = ('therapist_profile',)
+        # Без файла бывают только фото с внешним URL, перенесённые миграцией 0022
+        extra_kwargs = {'image': {'required': True, 'allow_empty_file': False}}
         
     def get_image_url(self, obj):
         if obj.image:
@@ -67,7 +75,28 @@ class TherapistPhotoSerializer(serializers.ModelSerializer):
             if request is not None:
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
-        return None
+        return obj.external_url or None
+
+
+def gallery_urls(therapist_profile, request=None):
+    """URL фото галереи по порядку — поле photos профиля (прежде — JSON-список в профиле)."""
+    photos = [photo for photo in therapist_profile.gallery_photos.all() if photo.url]
+    # Внешние URL уже абсолютные; build_absolute_uri оставляет их как есть
+    return [request.build_absolute_uri(photo.url) for photo in photos] if request else [photo.url for photo in photos]
+
+class SimilarTherapistSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='similar_id')
+    first_name = serializers.CharField(source='similar.user.first_name')
+    last_name = serializers.CharField(source='similar.user.last_name')
+    city = serializers.CharField(source='similar.city')
+    status = serializers.CharField(source='similar.status')
+    experience_years = serializers.IntegerField(source='similar.experience_years')
+
+    class Meta:
+        model = SimilarTherapist
+        fields = ('id', 'first_name', 'last_name', 'city', 'status', 'experience_years', 'score')
+        read_only_fields = fields
+
 
 class TherapistProfileReadSerializer(serializers.ModelSerializer):
     user = BaseUserSerializer(read_only=True)
@@ -75,7 +104,8 @@ class TherapistProfileReadSerializer(serializers.ModelSerializer):
     skills = serializers.StringRelatedField(many=True, read_only=True)
     languages = serializers.StringRelatedField(many=True, read_only=True)
     total_hours_worked = serializers.SerializerMethodField()
-    photos = TherapistPhotoSerializer(many=True, read_only=True)
+    photos = TherapistPhotoSerializer(source='gallery_photos', many=True, read_only=True)
+    similar = serializers.SerializerMethodField()
 
     class Meta:
         model = TherapistProfile
@@ -84,9 +114,9 @@ class TherapistProfileReadSerializer(serializers.ModelSerializer):
             'is_verified', 'is_subscribed',
             'skills', 'languages',
             'total_hours_worked',
-            'office_location',
-            'video_intro_url', 'website_url', 'linkedin_url',
-            'photos',
+            'office_location', 'city', 'works_online',
+            'short_video_url', 'status',
+            'photos', 'similar',
         )
 
     def get_total_hours_worked(self, obj):
@@ -94,6 +124,11 @@ class TherapistProfileReadSerializer(serializers.ModelSerializer):
             return obj.total_hours_worked
         return None
 
+    def get_similar(self, obj):
+        # Списки предрассчитаны (api/similarity.py); ожидается Prefetch из similar_prefetch()
+        entries = obj.similar_entries.all()[:settings.SIMILAR_THERAPISTS_SHOWN]
+        return SimilarTherapistSerializer(entries, many=True).data
+
 class ClientProfileReadSerializer(serializers.ModelSerializer):
     user = BaseUserSerializer(read_only=True)
     profile = UserProfileSerializer(source='user.profile', read_only=True)
@@ -116,7 +151,7 @@ class CurrentUserSerializer(serializers.ModelSerializer):
 
     def get_therapist_profile(self, obj):
         if hasattr(obj, 'therapist_profile'):
-            return TherapistProfileDetailedSerializer(obj.therapist_profile).data
+            return TherapistProfileDetailedSerializer(obj.therapist_profile, context=self.context).data
         return None
 
     def get_client_profile(self, obj):
@@ -127,6 +162,7 @@ class CurrentUserSerializer(serializers.ModelSerializer):
 class TherapistProfileDetailedSerializer(serializers.ModelSerializer):
     skills = serializers.PrimaryKeyRelatedField(queryset=Skill.objects.all(), many=True, required=False)
     languages = serializers.PrimaryKeyRelatedField(queryset=Language.objects.all(), many=True, required=False)
+    photos = serializers.SerializerMethodField()
 
     class Meta:
         model = TherapistProfile
@@ -135,6 +171,9 @@ class TherapistProfileDetailedSerializer(serializers.ModelSerializer):
                   'is_verified', 'is_subscribed',
                   'short_video_url', 'status', 'photos')
 
+    def get_photos(self, obj):
+        return gallery_urls(obj, self.context.get('request'))
+
 class ClientProfileDetailedSerializer(serializers.ModelSerializer):
     interested_topics = serializers.PrimaryKeyRelatedField(queryset=Skill.objects.all(), many=True, required=False)
 
@@ -159,12 +198,36 @@ class TherapistProfileUpdateSerializer(serializers.ModelSerializer):
     skills = serializers.PrimaryKeyRelatedField(queryset=Skill.objects.all(), many=True, required=False)
     languages = serializers.PrimaryKeyRelatedField(queryset=Language.objects.all(), many=True, required=False)
     total_hours_worked = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    latitude = serializers.FloatField(required=False, allow_null=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, allow_null=True, min_value=-180, max_value=180)
 
     class Meta:
         model = TherapistProfile
         fields = ('about', 'experience_years', 'skills', 'languages',
                   'total_hours_worked', 'display_hours', 'office_location',
-                  'short_video_url', 'website_url', 'linkedin_url')
+                  'city', 'latitude', 'longitude', 'works_online', 'timezone',
+                  'short_video_url')
+
+    def validate_timezone(self, value):
+        if availability.get_zone(value).key != value:
+            raise serializers.ValidationError("Неизвестный часовой пояс.")
+        return value
+
+    def validate_city(self, value):
+        # Название из справочника, чтобы ?city= находил профиль по любому синониму
+        city = geo.find_city(value)
+        return city['name'] if city else value.strip()
+
+    def validate(self, data):
+        if ('latitude' in data) != ('longitude' in data):
+            raise serializers.ValidationError("Широта и долгота указываются вместе.")
+        if 'city' in data and 'latitude' not in data:
+            # Координаты прежнего города больше не верны: возьмём центр нового из справочника
+            data['latitude'] = data['longitude'] = None
+            city = geo.find_city(data['city'])
+            if city and 'timezone' not in data:
+                data['timezone'] = city['timezone']
+        return data
 
 class ClientProfileUpdateSerializer(serializers.ModelSerializer):
     interested_topics = serializers.PrimaryKeyRelatedField(queryset=Skill.objects.all(), many=True, required=False)
@@ -173,6 +236,16 @@ class ClientProfileUpdateSerializer(serializers.ModelSerializer):
         model = ClientProfile
         fields = ('request_details', 'interested_topics')
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # Темы не выбраны — проставляем упомянутые в описании запроса (api/topics.py)
+        if (
+            settings.TOPIC_AUTO_ASSIGN and instance.request_details
+            and 'interested_topics' not in validated_data and not instance.interested_topics.exists()
+        ):
+            instance.interested_topics.set(topics.suggest(instance.request_details)[:settings.TOPIC_AUTO_ASSIGN_LIMIT])
+        return instance
+
 # --- Сериализаторы для Регистрации ---
 class ClientRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -208,6 +281,8 @@ class ClientRegistrationSerializer(serializers.ModelSerializer):
         
         UserProfile.objects.create(user=user, role=Role.CLIENT)
         ClientProfile.objects.create(user=user)
+        # Письмо уйдёт из outbox только если регистрация зафиксирована
+        outbox.enqueue(NotificationKind.CLIENT_WELCOME, [user.email], user=user)
         print(f"Client registered: {user.email}, UserProfile and ClientProfile created.")
         return user
 
@@ -257,7 +332,13 @@ class TherapistRegistrationSerializer(serializers.ModelSerializer):
         TherapistProfile.objects.create(user=user)
         
         invite_code_obj.is_used = True
-        invite_code_obj.save()
+        invite_code_obj.used_at = timezone.now()
+        invite_code_obj.save(update_fields=['is_used', 'used_at'])
+        outbox.enqueue(NotificationKind.THERAPIST_WELCOME, [user.email], user=user)
+        if invite_code_obj.created_by is not None:
+            outbox.enqueue(
+                NotificationKind.INVITE_USED, [invite_code_obj.created_by.email], user=user, invite=invite_code_obj
+            )
         print(f"Therapist registered: {user.email}, UserProfile and TherapistProfile created.")
         return user
 
@@ -325,9 +406,9 @@ class PublicationSerializer(serializers.ModelSerializer):
         model = Publication
         fields = (
             'id', 'author', 'author_name', 'author_photo',
-            'title', 'content', 'created_at', 'updated_at'
+            'title', 'content', 'read_count', 'created_at', 'updated_at'
         )
-        read_only_fields = ('author', 'created_at', 'updated_at')
+        read_only_fields = ('author', 'read_count', 'created_at', 'updated_at')
     
     def get_author_name(self, obj):
         return f"{obj.author.first_name} {obj.author.last_name}"
@@ -376,7 +457,7 @@ class PublicUserProfileSerializer(serializers.ModelSerializer):
     short_video_url = serializers.URLField(source='therapist_profile.short_video_url', read_only=True, allow_null=True)
     status = serializers.CharField(source='therapist_profile.status', read_only=True, allow_null=True)
     status_display = serializers.CharField(source='therapist_profile.get_status_display', read_only=True)
-    photos = serializers.JSONField(source='therapist_profile.photos', read_only=True)
+    photos = serializers.SerializerMethodField()
 
     # --- Поля из Publication ---
     publications = SimplePublicationSerializer(many=True, read_only=True)
@@ -390,6 +471,9 @@ class PublicUserProfileSerializer(serializers.ModelSerializer):
         )
         read_only_fields = fields
 
+    def get_photos(self, obj):
+        return gallery_urls(obj.therapist_profile, self.context.get('request'))
+
     def get_profile_picture_url(self, obj):
         request = self.context.get('request')
         # Проверяем наличие profile и картинки в нем
@@ -434,7 +518,131 @@ class TherapistCardSerializer(serializers.ModelSerializer):
                 'is_verified': tp.is_verified,
                 'status': tp.status,
                 'status_display': tp.get_status_display(),
+                'city': tp.city,
+                'works_online': tp.works_online,
                 'skills': skills_data,
                 'skills_count': tp.skills.count()
             }
-        return None 
\ No newline at end of file
+        return None 
+
+class TherapistModerationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=ModerationActionType.choices)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000
+    )
+
+
+# --- Расписание и записи ---
+
+class AvailabilityRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AvailabilityRule
+        fields = ('id', 'weekday', 'start_time', 'end_time', 'slot_minutes', 'valid_from', 'valid_until')
+
+    def validate(self, data):
+        start_time = data.get('start_time', getattr(self.instance, 'start_time', None))
+        end_time = data.get('end_time', getattr(self.instance, 'end_time', None))
+        slot_minutes = data.get('slot_minutes', getattr(self.instance, 'slot_minutes', 50))
+        if start_time >= end_time:
+            raise serializers.ValidationError("Окно должно заканчиваться позже, чем начинается (в пределах суток).")
+        length = (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute)
+        if not 10 <= slot_minutes <= length:
+            raise serializers.ValidationError({'slot_minutes': "Слот от 10 минут и не длиннее окна."})
+        valid_from = data.get('valid_from', getattr(self.instance, 'valid_from', None))
+        valid_until = data.get('valid_until', getattr(self.instance, 'valid_until', None))
+        if valid_from and valid_until and valid_from > valid_until:
+            raise serializers.ValidationError({'valid_until': "Дата окончания раньше даты начала."})
+        return data
+
+
+class AvailabilityExceptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AvailabilityException
+        fields = ('id', 'starts_at', 'ends_at', 'is_available', 'note')
+
+    def validate(self, data):
+        starts_at = data.get('starts_at', getattr(self.instance, 'starts_at', None))
+        ends_at = data.get('ends_at', getattr(self.instance, 'ends_at', None))
+        if starts_at >= ends_at:
+            raise serializers.ValidationError({'ends_at': "Конец должен быть позже начала."})
+        return data
+
+
+class SlotSerializer(serializers.Serializer):
+    starts_at = serializers.DateTimeField()
+    ends_at = serializers.DateTimeField()
+
+
+class BookingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Booking
+        fields = ('id', 'therapist', 'client', 'starts_at', 'ends_at', 'status', 'created_at')
+        read_only_fields = fields
+
+
+class BookingCreateSerializer(serializers.Serializer):
+    starts_at = serializers.DateTimeField()
+
+
+# --- Переписка ---
+
+class MessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ('id', 'conversation', 'sender', 'body', 'created_at', 'read_at')
+        read_only_fields = ('id', 'conversation', 'sender', 'created_at', 'read_at')
+        extra_kwargs = {'body': {'max_length': 10000}}
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    client = BaseUserSerializer(read_only=True)
+    therapist_user = BaseUserSerializer(source='therapist.user', read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ('id', 'client', 'therapist', 'therapist_user', 'last_message_at', 'created_at')
+        read_only_fields = fields
+
+
+class ConversationCreateSerializer(serializers.Serializer):
+    therapist = serializers.IntegerField(min_value=1)
+    body = serializers.CharField(required=False, allow_blank=False, max_length=10000)
+
+
+# --- Статистика просмотров ---
+
+class StatPointSerializer(serializers.Serializer):
+    period = serializers.DateTimeField()
+    profile_views = serializers.IntegerField()
+    publication_reads = serializers.IntegerField()
+
+
+class PublicationStatSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Publication
+        fields = ('id', 'title', 'read_count', 'created_at')
+        read_only_fields = fields
+
+
+# --- Выгрузка персональных данных ---
+
+class DataExportSerializer(serializers.ModelSerializer):
+    expires_at = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DataExport
+        fields = ('id', 'status', 'size', 'created_at', 'finished_at', 'expires_at', 'download_url')
+        read_only_fields = fields
+
+    def get_expires_at(self, obj):
+        if obj.status != DataExportStatus.READY:
+            return None
+        return obj.finished_at + timedelta(hours=settings.DATA_EXPORT_KEEP_HOURS)
+
+    def get_download_url(self, obj):
+        if obj.status != DataExportStatus.READY:
+            return None
+        url = reverse('data-export-download', args=[dataexport.download_token(obj)])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
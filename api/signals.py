@@ -0,0 +1,93 @@
+"""
+Поддержание денормализованных флагов роли и видимости в каталоге.
+
+Источник правды о роли — UserProfile.role. Из него выводятся
+User.is_therapist/is_client и TherapistProfile.is_listed, по которому
+каталог фильтруется по одной таблице и частичному индексу. При сохранении
+профиля терапевта is_listed считает TherapistProfile.save(); здесь —
+только смена роли. Массовые UPDATE (moderation.py, subscriptions.py)
+сигналы обходят и выставляют is_listed сами.
+
+Здесь же поддерживаются geocell — код координат для поиска рядом (geo.py) —
+и окна правил расписания в минутах недели UTC (availability.py).
+Новая публикация ставит уведомления клиентам автора в outbox (outbox.py).
+"""
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
+
+from . import availability, geo, outbox
+from .models import User, UserProfile, TherapistProfile, AvailabilityRule, Conversation, NotificationKind, Role
+
+def listed_expression():
+    """Выражение для UPDATE: is_listed по текущему состоянию строки в базе."""
+    return ExpressionWrapper(
+        Q(is_verified=True, is_subscribed=True)
+        & Exists(UserProfile.objects.filter(user_id=OuterRef('user_id'), role=Role.THERAPIST)),
+        output_field=BooleanField(),
+    )
+
+
+def sync_role(sender, instance, raw=False, **kwargs):
+    """post_save UserProfile: переносит роль в User и в видимость профиля терапевта."""
+    if raw:
+        return
+    is_therapist = instance.role == Role.THERAPIST
+    is_client = instance.role == Role.CLIENT
+    User.objects.filter(pk=instance.user_id).exclude(
+        is_therapist=is_therapist, is_client=is_client
+    ).update(is_therapist=is_therapist, is_client=is_client)
+    TherapistProfile.objects.filter(user_id=instance.user_id).update(is_listed=listed_expression())
+
+
+def unlist_on_profile_delete(sender, instance, **kwargs):
+    """post_delete UserProfile: без профиля роль неизвестна — убираем из каталога."""
+    TherapistProfile.objects.filter(user_id=instance.user_id, is_listed=True).update(is_listed=False)
+
+
+def fill_geocell(sender, instance, raw=False, **kwargs):
+    """pre_save TherapistProfile: geocell по координатам, координаты — по городу из справочника."""
+    if raw:
+        return
+    if instance.city and (instance.latitude is None or instance.longitude is None):
+        city = geo.find_city(instance.city)
+        if city is not None:
+            instance.latitude, instance.longitude = city['latitude'], city['longitude']
+    if instance.latitude is None or instance.longitude is None:
+        instance.geocell = None
+    else:
+        instance.geocell = geo.encode(instance.latitude, instance.longitude)
+
+
+def fill_week_minutes(sender, instance, raw=False, **kwargs):
+    """pre_save AvailabilityRule: окно правила для GiST-индекса поиска по интервалу."""
+    if raw:
+        return
+    tz_name = TherapistProfile.objects.values_list('timezone', flat=True).get(pk=instance.therapist_id)
+    instance.week_minutes = availability.rule_week_minutes(instance, tz_name)
+
+
+def refresh_week_minutes(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    """post_save TherapistProfile: окна правил зависят от часового пояса терапевта."""
+    # У нового профиля правил ещё нет; пояс, не менявшийся с загрузки, окон не меняет
+    if raw or created or (update_fields is not None and 'timezone' not in update_fields):
+        return
+    if getattr(instance, '_loaded_timezone', None) == instance.timezone:
+        return
+    instance._loaded_timezone = instance.timezone
+    rules = list(AvailabilityRule.objects.filter(therapist_id=instance.pk))
+    changed = []
+    for rule in rules:
+        week_minutes = availability.rule_week_minutes(rule, instance.timezone)
+        if rule.week_minutes != week_minutes:
+            rule.week_minutes = week_minutes
+            changed.append(rule)
+    AvailabilityRule.objects.bulk_update(changed, ['week_minutes'])
+
+
+def announce_publication(sender, instance, created=False, raw=False, **kwargs):
+    """post_save Publication: письмо клиентам, которые переписываются с автором."""
+    if raw or not created:
+        return
+    emails = Conversation.objects.filter(therapist__user_id=instance.author_id).values_list(
+        'client__email', flat=True
+    )
+    outbox.enqueue(NotificationKind.NEW_PUBLICATION, emails, publication=instance, author=instance.author)
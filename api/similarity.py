@@ -0,0 +1,204 @@
+"""
+Похожие терапевты: предрассчитанные top-k списки.
+
+Терапевт каталога — разреженный вектор признаков (навыки, языки, статус)
+с весами IDF: редкая специализация говорит о сходстве больше, чем
+русский язык, общий почти для всех. Сходство — косинус этих векторов.
+Нормированные векторы навыков лежат в CSR-матрице scipy.sparse, и
+сходство считается блоками строк: разреженное произведение A·Aᵀ по
+навыкам даёт кандидатов (хотя бы один общий навык) и их оценку, а вклад
+языков и статуса — плотное произведение узкой матрицы этих признаков.
+Top-k выбирается по каждой строке блока через argpartition; размер блока
+ограничен SCORE_BLOCK_CELLS ячеек плотной матрицы.
+
+Инкрементальный пересчёт находит изменившихся по отпечатку признаков
+(similarity_signature) — так ловятся и массовые UPDATE в обход сигналов —
+и пересчитывает их строки и строки тех, чьи списки они могут изменить.
+Веса IDF при этом не пересчитываются у нетронутых строк: полный
+пересчёт (--full) стоит запускать периодически.
+"""
+import hashlib
+import math
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Prefetch
+from scipy import sparse
+
+from .models import SimilarTherapist, TherapistProfile
+from .subscriptions import catalog_filter
+
+# Вклад типов признаков в сходство (множитель к IDF)
+FEATURE_WEIGHTS = {'skill': 1.0, 'language': 0.4, 'status': 0.3}
+
+# Ячеек плотной матрицы блока (строки блока × все терапевты): 4M float64 — 32 МБ
+SCORE_BLOCK_CELLS = 4_000_000
+
+
+def similar_prefetch():
+    """Prefetch готового списка для карточки терапевта: только те, кто сейчас в каталоге."""
+    return Prefetch(
+        'similar_entries',
+        queryset=SimilarTherapist.objects.filter(catalog_filter('similar__')).select_related('similar__user').order_by('rank'),
+    )
+
+
+def load_features():
+    """{id профиля каталога: frozenset признаков (тип, значение)} — три запроса."""
+    features = defaultdict(set)
+    for therapist_id, status in TherapistProfile.objects.filter(is_listed=True).values_list('id', 'status'):
+        items = features[therapist_id]
+        if status:
+            items.add(('status', status))
+    for relation, kind in ((TherapistProfile.skills, 'skill'), (TherapistProfile.languages, 'language')):
+        rows = relation.through.objects.filter(therapistprofile__is_listed=True)
+        for therapist_id, value in rows.values_list('therapistprofile_id', f'{kind}_id'):
+            features[therapist_id].add((kind, value))
+    return {therapist_id: frozenset(items) for therapist_id, items in features.items()}
+
+
+def signature(items):
+    """Устойчивый между процессами 64-битный отпечаток набора признаков."""
+    digest = hashlib.blake2b(repr(sorted(items)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class SimilarityIndex:
+    """Нормированные матрицы признаков каталога для блочного расчёта строк сходства."""
+
+    def __init__(self, features):
+        self.features = features
+        # Строки матриц — id по возрастанию: при равном сходстве меньший id идёт первым
+        self.ids = np.array(sorted(features), dtype=np.int64)
+        self.positions = {therapist_id: row for row, therapist_id in enumerate(self.ids.tolist())}
+        document_frequency = defaultdict(int)
+        for items in features.values():
+            for feature in items:
+                document_frequency[feature] += 1
+        total = len(features)
+        weights = {
+            feature: FEATURE_WEIGHTS[feature[0]] * math.log(1 + total / df)
+            for feature, df in document_frequency.items()
+        }
+        columns = {'skill': {}, 'extra': {}}
+        entries = {'skill': ([], [], []), 'extra': ([], [], [])}
+        for row, therapist_id in enumerate(self.ids.tolist()):
+            items = features[therapist_id]
+            norm = math.sqrt(sum(weights[feature] ** 2 for feature in items)) or 1.0
+            for feature in items:
+                group = 'skill' if feature[0] == 'skill' else 'extra'
+                column = columns[group].setdefault(feature, len(columns[group]))
+                rows, cols, data = entries[group]
+                rows.append(row)
+                cols.append(column)
+                data.append(weights[feature] / norm)
+        shape = len(self.ids)
+        rows, cols, data = entries['skill']
+        self.skills = sparse.csr_matrix((data, (rows, cols)), shape=(shape, len(columns['skill'])))
+        self.skills_t = self.skills.T.tocsr()
+        # Языков и статусов немного: их часть векторов хранится плотной
+        rows, cols, data = entries['extra']
+        self.extra = np.zeros((shape, len(columns['extra'])))
+        self.extra[rows, cols] = data
+
+    def rows(self, therapist_ids):
+        """
+        Для каждого id из therapist_ids (в их порядке, только из каталога) —
+        (id, позиции кандидатов в self.ids, косинусное сходство с ними).
+        Кандидаты — терапевты хотя бы с одним общим навыком, кроме самого терапевта.
+        """
+        positions = np.array([self.positions[t] for t in therapist_ids if t in self.positions], dtype=np.int64)
+        block_rows = max(1, SCORE_BLOCK_CELLS // max(len(self.ids), 1))
+        for start in range(0, len(positions), block_rows):
+            block = positions[start:start + block_rows]
+            skill_scores = (self.skills[block] @ self.skills_t).tocsr()
+            skill_scores.sort_indices()
+            extra_scores = self.extra[block] @ self.extra.T
+            for local, row in enumerate(block.tolist()):
+                span = slice(skill_scores.indptr[local], skill_scores.indptr[local + 1])
+                candidates = skill_scores.indices[span]
+                keep = candidates != row
+                candidates = candidates[keep]
+                scores = skill_scores.data[span][keep] + extra_scores[local, candidates]
+                yield int(self.ids[row]), candidates, scores
+
+    def top(self, therapist_ids, k):
+        """Для каждого id — (id, [(похожий id, сходство)]): k лучших по убыванию, при равенстве — меньший id."""
+        for therapist_id, candidates, scores in self.rows(therapist_ids):
+            if len(candidates) > k:
+                # Порог — k-е по величине сходство; равные ему остаются, чтобы порядок по id был точным
+                threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+                keep = scores >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+            order = np.lexsort((candidates, -scores))[:k]
+            yield therapist_id, list(zip(self.ids[candidates[order]].tolist(), scores[order].tolist()))
+
+
+def _affected(index, changed, removed, stored_k):
+    """
+    Профили, чьи списки надо пересчитать из-за изменившихся changed и выбывших removed:
+    сами изменившиеся, те, в чьих списках они уже есть, и те, к кому
+    изменившийся теперь попадает в top-k (сходство симметрично).
+    """
+    targets = set(changed)
+    targets.update(
+        SimilarTherapist.objects.filter(similar_id__in=changed | removed).values_list('therapist_id', flat=True)
+    )
+    # Заполненность и нижняя граница сохранённого списка — по позициям index.ids
+    entries = np.zeros(len(index.ids), dtype=np.int64)
+    lowest = np.zeros(len(index.ids))
+    stored = SimilarTherapist.objects.values('therapist_id').annotate(entries=Count('id'), lowest=Min('score'))
+    for row in stored.values_list('therapist_id', 'entries', 'lowest'):
+        position = index.positions.get(row[0])
+        if position is not None:
+            entries[position], lowest[position] = row[1], row[2]
+    for _therapist_id, candidates, scores in index.rows(sorted(changed)):
+        hit = (entries[candidates] < stored_k) | (scores > lowest[candidates])
+        targets.update(index.ids[candidates[hit]].tolist())
+    return targets & index.features.keys()
+
+
+def refresh(full=False, block_size=500):
+    """
+    Пересчитывает списки похожих; full — все профили каталога, иначе только
+    затронутые изменениями. Пишет блоками по block_size профилей, каждый —
+    в своей транзакции. Возвращает (пересчитано, удалено) профилей.
+    """
+    stored_k = settings.SIMILAR_THERAPISTS_STORED
+    features = load_features()
+    index = SimilarityIndex(features)
+    signatures = {therapist_id: signature(items) for therapist_id, items in features.items()}
+
+    stored = dict(
+        TherapistProfile.objects.filter(similarity_signature__isnull=False).values_list('id', 'similarity_signature')
+    )
+    # Выбывшие из каталога: их собственные списки больше не нужны
+    removed = stored.keys() - features.keys()
+    if full:
+        targets = set(features)
+    else:
+        changed = {therapist_id for therapist_id, value in signatures.items() if stored.get(therapist_id) != value}
+        targets = _affected(index, changed, removed, stored_k) if changed or removed else set()
+
+    ordered = sorted(targets)
+    for start in range(0, len(ordered), block_size):
+        block = ordered[start:start + block_size]
+        rows = [
+            SimilarTherapist(therapist_id=therapist_id, similar_id=other, rank=rank, score=score)
+            for therapist_id, similar in index.top(block, stored_k)
+            for rank, (other, score) in enumerate(similar, start=1)
+        ]
+        with transaction.atomic():
+            SimilarTherapist.objects.filter(therapist_id__in=block).delete()
+            SimilarTherapist.objects.bulk_create(rows)
+            TherapistProfile.objects.bulk_update(
+                [TherapistProfile(id=therapist_id, similarity_signature=signatures[therapist_id]) for therapist_id in block],
+                ['similarity_signature'],
+            )
+    if removed:
+        with transaction.atomic():
+            SimilarTherapist.objects.filter(therapist_id__in=removed).delete()
+            TherapistProfile.objects.filter(id__in=removed).update(similarity_signature=None)
+    return len(ordered), len(removed)
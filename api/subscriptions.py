@@ -0,0 +1,60 @@
+"""
+Подписки терапевтов с ограниченным сроком (TherapistProfile.subscribed_until).
+
+Каталог фильтруется по флагу is_listed (см. signals.py), который вместе
+с is_subscribed снимает команда expire_subscriptions. Чтобы истёкшая, но ещё
+не обработанная подписка не попала в каталог ни в одном воркере,
+catalog_filter() всегда добавляет условие subscribed_until > now: строки
+и так берутся по частичному индексу is_listed, проверка даты почти бесплатна.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import TherapistProfile, ModerationAction, ModerationActionType
+
+
+def catalog_filter(prefix=''):
+    """
+    Условие «виден в публичном каталоге» для TherapistProfile
+    (prefix='therapist_profile__' — для запросов от User).
+    """
+    return Q(**{f'{prefix}is_listed': True}) & (
+        Q(**{f'{prefix}subscribed_until__isnull': True}) | Q(**{f'{prefix}subscribed_until__gt': timezone.now()})
+    )
+
+
+async def acatalog_filter(prefix=''):
+    return catalog_filter(prefix)
+
+
+def expire_subscriptions(batch_size=1000):
+    """
+    Снимает is_subscribed с истёкших подписок пачками по batch_size.
+
+    Пачка выбирается диапазоном по частичному индексу subscribed_until,
+    с SKIP LOCKED, чтобы параллельные запуски не мешали друг другу.
+    Возвращает число снятых подписок.
+    """
+    total = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(
+                TherapistProfile.objects.select_for_update(skip_locked=True)
+                .filter(is_subscribed=True, subscribed_until__lte=now)
+                .order_by('subscribed_until')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            TherapistProfile.objects.filter(id__in=ids).update(is_subscribed=False, is_listed=False, updated_at=now)
+            # Системное действие: модератор не указан
+            ModerationAction.objects.create(
+                action=ModerationActionType.UNSUBSCRIBE, actor=None,
+                therapist_ids=ids, affected=len(ids),
+            )
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
@@ -0,0 +1,274 @@
+"""
+Подбор терапевтов по тексту запроса клиента (BM25 по полю «О себе»).
+
+Тексты терапевтов токенизируются с учётом русского языка (ё -> е, стоп-слова,
+стемминг Snowball). В памяти процесса хранится неизменяемый снимок:
+CSC-матрица терапевт × термин scipy.sparse с готовыми весами BM25 по
+документу и IDF терминов. Запрос оценивается одним произведением столбцов
+своих терминов на вектор их IDF — без блокировок: поиск берёт текущий
+снимок, а обновление подменяет его целиком.
+
+Обновляет снимок фоновый поток процесса: раз в TEXT_INDEX_REFRESH_SECONDS
+подтягивает изменённые профили по updated_at, а раз в
+TEXT_INDEX_REBUILD_SECONDS перестраивает индекс целиком, чтобы выбросить
+удалённые профили и устаревшие термины. Запрос пользователя ждёт только
+самую первую сборку в процессе.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connection
+from scipy import sparse
+
+from .models import TherapistProfile
+
+# Параметры BM25
+K1 = 1.2
+B = 0.75
+logger = logging.getLogger(__name__)
+
+# Перекрытие окна инкрементального обновления: строки, зафиксированные позже своего updated_at
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+_TOKEN_RE = re.compile(r'[а-яёa-z0-9]+')
+
+STOP_WORDS = frozenset('''
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее ей
+ему если есть еще же за здесь и из или им их к как ко когда кто ли либо мне может мы на над надо наш не него
+нее нет ни них но ну о об однако он она они оно от очень по под при с со так также такой там те тем то того
+тоже той только том ты у уже хотя чего чей чем что чтобы чье эта эти это я мой моя мои свой себя себе меня
+the and or of to in a an is are for with on at by from
+'''.split())
+
+
+# --- Стемминг (Snowball, русский) ---
+
+_VOWELS = 'аеиоуыэюя'
+
+
+def _endings(*groups):
+    """[(окончание, нужна ли перед ним «а»/«я»)], длинные первыми."""
+    items = [(ending, needs_a) for endings, needs_a in groups for ending in endings.split()]
+    return sorted(items, key=lambda item: -len(item[0]))
+
+
+_PERFECTIVE_GERUND = _endings(('в вши вшись', True), ('ив ивши ившись ыв ывши ывшись', False))
+_ADJECTIVE = _endings((
+    'ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому их ых ую юю ая яя ою ею', False,
+))
+_PARTICIPLE = _endings(('ем нн вш ющ щ', True), ('ивш ывш ующ', False))
+_REFLEXIVE = _endings(('ся сь', False))
+_VERB = _endings(
+    ('ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно', True),
+    ('ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь ую ю',
+     False),
+)
+_NOUN = _endings((
+    'а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у ах иях ях ы ь ию ью ю ия ья я',
+    False,
+))
+_SUPERLATIVE = _endings(('ейш ейше', False))
+_DERIVATIONAL = _endings(('ост ость', False))
+
+
+def _strip(word, endings):
+    """Снимает самое длинное из окончаний; (слово, снято ли)."""
+    for ending, needs_a in endings:
+        if word.endswith(ending):
+            if needs_a and not word[:-len(ending)].endswith(('а', 'я')):
+                return word, False
+            return word[:-len(ending)], True
+    return word, False
+
+
+def _region(word, start=0):
+    """Начало области после первой пары «гласная, согласная» начиная со start."""
+    for index in range(start + 1, len(word)):
+        if word[index] not in _VOWELS and word[index - 1] in _VOWELS:
+            return index + 1
+    return len(word)
+
+
+# Словарь текстов невелик и слова повторяются: основа считается один раз
+@lru_cache(maxsize=100_000)
+def stem(word):
+    rv = next((index + 1 for index, char in enumerate(word) if char in _VOWELS), len(word))
+    r2 = _region(word, _region(word))
+    prefix, rest = word[:rv], word[rv:]
+
+    rest, removed = _strip(rest, _PERFECTIVE_GERUND)
+    if not removed:
+        rest, _ = _strip(rest, _REFLEXIVE)
+        rest, removed = _strip(rest, _ADJECTIVE)
+        if removed:
+            rest, _ = _strip(rest, _PARTICIPLE)
+        else:
+            rest, removed = _strip(rest, _VERB)
+            if not removed:
+                rest, _ = _strip(rest, _NOUN)
+    if rest.endswith('и'):
+        rest = rest[:-1]
+    for ending, _needs_a in _DERIVATIONAL:
+        if rest.endswith(ending) and rv + len(rest) - len(ending) >= r2:
+            rest = rest[:-len(ending)]
+            break
+    if rest.endswith('нн'):
+        rest = rest[:-1]
+    else:
+        rest, removed = _strip(rest, _SUPERLATIVE)
+        if removed and rest.endswith('нн'):
+            rest = rest[:-1]
+        elif not removed and rest.endswith('ь'):
+            rest = rest[:-1]
+    return prefix + rest
+
+
+def tokenize(text):
+    """Основы значимых слов текста в порядке появления."""
+    words = _TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+    return [stem(word) if word[0] >= 'а' else word for word in words if word not in STOP_WORDS and len(word) > 1]
+
+
+# --- Индекс ---
+
+class Snapshot:
+    """Неизменяемое состояние индекса для поиска; строки матрицы — id пользователей по возрастанию."""
+
+    def __init__(self, documents, vocabulary):
+        self.user_ids = np.array(sorted(documents), dtype=np.int64)
+        self.vocabulary = dict(vocabulary)
+        rows = [documents[user_id] for user_id in self.user_ids.tolist()]
+        sizes = np.array([len(columns) for columns, _counts, _length in rows], dtype=np.int64)
+        lengths = np.array([length for _columns, _counts, length in rows], dtype=np.float64)
+        indices = np.concatenate([columns for columns, _counts, _length in rows]) if rows else np.zeros(0, np.int64)
+        counts = np.concatenate([counts for _columns, counts, _length in rows]) if rows else np.zeros(0)
+        total = len(rows)
+        average_length = lengths.mean() if total else 1.0
+        norms = np.repeat(K1 * (1 - B + B * lengths / average_length), sizes)
+        weights = counts * (K1 + 1) / (counts + norms)
+        indptr = np.concatenate(([0], np.cumsum(sizes)))
+        self.matrix = sparse.csr_matrix((weights, indices, indptr), shape=(total, len(self.vocabulary))).tocsc()
+        frequency = np.bincount(indices, minlength=len(self.vocabulary))
+        self.idf = np.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, terms, eligible):
+        columns = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+        if not columns or not len(self.user_ids) or not eligible:
+            return []
+        query = np.array([terms[term] for term in terms if term in self.vocabulary], dtype=np.float64)
+        scores = self.matrix[:, columns] @ (query * self.idf[columns])
+        wanted = np.fromiter(eligible, dtype=np.int64, count=len(eligible))
+        hits = np.flatnonzero((scores > 0) & np.isin(self.user_ids, wanted))
+        hits = hits[np.lexsort((self.user_ids[hits], -scores[hits]))]
+        return list(zip(self.user_ids[hits].tolist(), scores[hits].tolist()))
+
+
+class TextIndex:
+    """
+    BM25 по текстам «О себе»; документы — профили, ключ — id пользователя.
+    background=False — без фонового потока: снимок обновляет только refresh().
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        # Сериализует обновления; поиск его не берёт
+        self._lock = threading.Lock()
+        # Запуск потока — под своей блокировкой, чтобы запрос не ждал идущую сборку
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._reset()
+        self.snapshot = None
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.built_at = 0.0
+
+    def _reset(self):
+        # id пользователя -> (номера терминов, их частоты, длина документа)
+        self.documents = {}
+        self.vocabulary = {}
+
+    def _set(self, user_id, text):
+        terms = Counter(tokenize(text))
+        if not terms:
+            self.documents.pop(user_id, None)
+            return
+        columns = np.array([self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms], dtype=np.int64)
+        counts = np.array(list(terms.values()), dtype=np.float64)
+        self.documents[user_id] = (columns, counts, counts.sum())
+
+    def refresh(self, force=False):
+        """Подтягивает изменённые профили не чаще раза в TEXT_INDEX_REFRESH_SECONDS и публикует новый снимок."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self.snapshot is not None and now - self.refreshed_at < settings.TEXT_INDEX_REFRESH_SECONDS:
+                return
+            rebuild = self.watermark is None or now - self.built_at >= settings.TEXT_INDEX_REBUILD_SECONDS
+            rows = TherapistProfile.objects.all()
+            if rebuild:
+                self._reset()
+            else:
+                rows = rows.filter(updated_at__gte=self.watermark - REFRESH_OVERLAP)
+            watermark = self.watermark
+            changed = False
+            for user_id, about, updated_at in rows.values_list('user_id', 'about', 'updated_at').iterator():
+                self._set(user_id, about)
+                changed = True
+                watermark = updated_at if watermark is None else max(watermark, updated_at)
+            if changed or rebuild or self.snapshot is None:
+                self.snapshot = Snapshot(self.documents, self.vocabulary)
+            self.watermark = watermark
+            self.refreshed_at = now
+            if rebuild:
+                self.built_at = now
+        self._ready.set()
+
+    def search(self, text, eligible):
+        """
+        [(id пользователя, оценка BM25)] по убыванию среди eligible (множество id);
+        профили без общих с запросом терминов не возвращаются.
+        """
+        terms = Counter(tokenize(text))
+        if self.background:
+            self._ensure_refresher()
+            if self.snapshot is None:
+                self._ready.wait(settings.TEXT_INDEX_REFRESH_SECONDS)
+        snapshot = self.snapshot
+        if snapshot is None or not terms:
+            return []
+        return snapshot.search(terms, eligible)
+
+    # --- Фоновое обновление ---
+
+    def _ensure_refresher(self):
+        """Запускает поток в текущем процессе (повторно — после fork)."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='textsearch-refresher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except DatabaseError:
+                logger.exception('Не удалось обновить индекс подбора по тексту, повтор при следующем обновлении')
+            finally:
+                # Соединение потока возвращается в пул до следующего обновления
+                connection.close()
+            time.sleep(settings.TEXT_INDEX_REFRESH_SECONDS)
+
+
+index = TextIndex()
@@ -0,0 +1,277 @@
+"""
+Ограничение частоты запросов к логину и регистрации (token bucket).
+
+Ведро на каждый ключ (IP, email, инвайт-код) хранится в общей памяти:
+файл в /dev/shm, отображённый через mmap, поэтому все воркеры Gunicorn
+на одной машине видят одни и те же ведра. Если THROTTLE_SHM_PATH не задан,
+используется хранилище в памяти процесса (для разработки и тестов).
+
+Лимиты задаются в REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] по имени
+'<throttle_scope представления>_<вид ключа>', например 'login_email'.
+Retry-After в ответе 429 выставляет DRF по значению wait().
+
+Представления с несколькими ведрами наследуют BucketThrottleMixin: все ведра
+запроса проверяются разом, и жетон списывается, только если пропускают все.
+Отклонённый запрос не расходует остальные лимиты — перебор паролей с одного
+IP не съедает лимит email жертвы.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Слот: хэш ключа (0 — пустой слот), число жетонов, время последнего обновления
+_SLOT = struct.Struct('<Qdd')
+# Сколько соседних слотов просматриваем при поиске и вытеснении
+_PROBE = 8
+
+
+def _key_hash(key):
+    # 0 зарезервирован под пустой слот
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _take(tokens, rate):
+    """Списывает жетон; возвращает (новое число жетонов, ожидание в секундах или None)."""
+    if tokens >= 1:
+        return tokens - 1, None
+    return tokens, (1 - tokens) / rate
+
+
+def _commit(current, now, store):
+    """
+    current — [(ключ ведра, жетоны после пополнения, скорость)]. Если жетон есть
+    во всех ведрах, списывает по одному; иначе только сохраняет пополнение.
+    Возвращает наибольшее ожидание или None.
+    """
+    waits = [wait for _key, tokens, rate in current if (wait := _take(tokens, rate)[1]) is not None]
+    for key, tokens, rate in current:
+        store(key, (tokens if waits else tokens - 1, now))
+    return max(waits) if waits else None
+
+
+class LocalBucketStore:
+    """Ведра в памяти процесса: у каждого воркера свои лимиты."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, buckets):
+        """
+        Списывает по жетону из каждого ведра [(ключ, ёмкость, скорость)], если во всех
+        есть жетон; иначе ничего не списывает. Возвращает ожидание в секундах или None.
+        """
+        now = time.time()
+        with self._lock:
+            current = []
+            for key, capacity, rate in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                current.append((key, _refill(tokens, updated, now, capacity, rate), rate))
+            return _commit(current, now, self._buckets.__setitem__)
+
+
+class SharedMemoryBucketStore:
+    """
+    Хэш-таблица ведер фиксированного размера в разделяемом файле.
+
+    Между процессами запись защищена блокировкой fcntl.lockf на весь файл,
+    между потоками одного процесса — обычной блокировкой (lockf процессная).
+    При переполнении вытесняется самое давно обновлённое ведро из окна
+    поиска — это лишь сбрасывает лимит для давно неактивного ключа.
+    """
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        size = slots * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+    def consume(self, buckets):
+        """Как LocalBucketStore.consume, но атомарно для всех процессов."""
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                current = []
+                for key, capacity, rate in buckets:
+                    key_hash = _key_hash(key)
+                    offset, tokens, updated = self._find(key_hash)
+                    # Новый ключ начинает с полного ведра
+                    tokens = capacity if tokens is None else _refill(tokens, updated, now, capacity, rate)
+                    current.append(((offset, key_hash), tokens, rate))
+                return _commit(current, now, self._store)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, key_hash):
+        """(смещение, жетоны, время) слота ключа; для нового ключа — (свободный или вытесняемый слот, None, None)."""
+        start = key_hash % self.slots
+        empty = victim = None
+        for i in range(_PROBE):
+            offset = ((start + i) % self.slots) * _SLOT.size
+            slot_hash, tokens, updated = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                if empty is None:
+                    empty = offset
+            elif victim is None or updated < victim[1]:
+                victim = (offset, updated)
+        return (empty if empty is not None else victim[0]), None, None
+
+    def _store(self, slot, state):
+        offset, key_hash = slot
+        tokens, now = state
+        _SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Хранилище ведер текущего процесса (после fork открывается заново)."""
+    global _store
+    store = _store
+    if store is None or getattr(store, 'pid', os.getpid()) != os.getpid():
+        with _store_lock:
+            store = _store
+            if store is None or getattr(store, 'pid', os.getpid()) != os.getpid():
+                path = getattr(settings, 'THROTTLE_SHM_PATH', None)
+                if path and fcntl is not None:
+                    store = SharedMemoryBucketStore(path, getattr(settings, 'THROTTLE_SHM_SLOTS', 65536))
+                else:
+                    store = LocalBucketStore()
+                _store = store
+    return store
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Базовый throttle: ведро ёмкостью N жетонов, пополняемое со скоростью
+    N за период из лимита 'N/период'. Ограничиваются только POST-запросы.
+    """
+    key_kind = None
+
+    def __init__(self):
+        # Лимит зависит от представления и определяется в allow_request
+        pass
+
+    def get_ident_value(self, request):
+        raise NotImplementedError('.get_ident_value() must be overridden')
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        self.wait_seconds = get_store().consume([bucket])
+        return self.wait_seconds is None
+
+    def get_bucket(self, request, view):
+        """(ключ, ёмкость, скорость) ведра запроса или None, если запрос не ограничивается."""
+        if not getattr(settings, 'THROTTLE_ENABLED', True) or request.method != 'POST':
+            return None
+        self.scope = f'{getattr(view, "throttle_scope", None)}_{self.key_kind}'
+        if self.scope not in self.THROTTLE_RATES:
+            return None
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return None
+        return key, self.num_requests, self.num_requests / self.duration
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_value(request)
+        if not ident:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class BucketThrottleMixin:
+    """
+    Для APIView: ведра всех TokenBucketThrottle запроса проверяются и списываются
+    вместе, прочие throttle — как обычно в DRF.
+    """
+
+    def check_throttles(self, request):
+        buckets = []
+        denied = False
+        waits = []
+        for throttle in self.get_throttles():
+            if isinstance(throttle, TokenBucketThrottle):
+                bucket = throttle.get_bucket(request, self)
+                if bucket is not None:
+                    buckets.append(bucket)
+            elif not throttle.allow_request(request, self):
+                denied = True
+                waits.append(throttle.wait())
+        # Отклонённый другим throttle запрос ведра не трогает
+        if buckets and not denied:
+            wait = get_store().consume(buckets)
+            if wait is not None:
+                denied = True
+                waits.append(wait)
+        if denied:
+            self.throttled(request, max((wait for wait in waits if wait is not None), default=None))
+
+
+class IPThrottle(TokenBucketThrottle):
+    key_kind = 'ip'
+
+    def get_ident_value(self, request):
+        # Адрес клиента из X-Forwarded-For берётся, только если задан
+        # REST_FRAMEWORK['NUM_PROXIES']; иначе — REMOTE_ADDR (см. settings)
+        return self.get_ident(request)
+
+
+class EmailThrottle(TokenBucketThrottle):
+    key_kind = 'email'
+
+    def get_ident_value(self, request):
+        email = request.data.get('email')
+        if not isinstance(email, str):
+            return None
+        return email.strip().lower() or None
+
+
+class InviteCodeThrottle(TokenBucketThrottle):
+    key_kind = 'invite'
+
+    def get_ident_value(self, request):
+        code = request.data.get('invite_code')
+        if not isinstance(code, str):
+            return None
+        return code.strip() or None
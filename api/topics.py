@@ -0,0 +1,161 @@
+"""
+Темы запроса клиента по свободному тексту: автомат Ахо — Корасик.
+
+Образцы — название навыка (Skill.name), ключевые фразы из его описания
+(через запятую или точку с запятой) и синонимы из api/data/topic_synonyms.csv.
+Образцы и текст проходят ту же токенизацию, что и подбор по тексту
+(textsearch.tokenize: ё -> е, стоп-слова, стемминг), и автомат строится
+над основами слов: «тревожный» и «тревожности» совпадают с «Тревожность»,
+а текст любой длины проверяется за один проход сразу по всем образцам.
+
+Автомат собирается один раз на процесс и пересобирается после изменения
+навыков: в своём процессе — по сигналу, в остальных — не позже чем через
+TOPIC_AUTOMATON_TTL секунд.
+"""
+import csv
+import re
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ClientProfile, Skill
+from .textsearch import tokenize
+
+SYNONYMS_PATH = Path(__file__).resolve().parent / 'data' / 'topic_synonyms.csv'
+# Ключевые фразы длиннее этого в описании навыка не считаются образцами
+MAX_PHRASE_TOKENS = 4
+
+
+class Automaton:
+    """Автомат Ахо — Корасик над последовательностями основ слов."""
+
+    def __init__(self, patterns):
+        # Узел: переходы по основе, ссылка неудачи, id навыков, оканчивающихся здесь
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        for tokens, skill_id in patterns:
+            node = 0
+            for token in tokens:
+                next_node = self.goto[node].get(token)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][token] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                node = next_node
+            self.output[node].add(skill_id)
+        self._link()
+
+    def _link(self):
+        # Обход в ширину: ссылка неудачи узла глубины d ведёт в узел меньшей глубины
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                if node:
+                    self.fail[child] = self.goto[state].get(token, 0)
+                # Совпадения суффиксов наследуются: «панические атаки» содержит и «атаки»
+                self.output[child] |= self.output[self.fail[child]]
+
+    def match(self, tokens):
+        """{id навыка: число вхождений} за один проход по tokens."""
+        found = {}
+        node = 0
+        for token in tokens:
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            for skill_id in self.output[node]:
+                found[skill_id] = found.get(skill_id, 0) + 1
+        return found
+
+
+def _synonyms():
+    with open(SYNONYMS_PATH, encoding='utf-8') as f:
+        return {row['skill']: list(filter(None, row['synonyms'].split('|'))) for row in csv.DictReader(f)}
+
+
+def _patterns():
+    synonyms = _synonyms()
+    for skill_id, name, description in Skill.objects.values_list('id', 'name', 'description'):
+        phrases = [name, *synonyms.get(name, ())]
+        phrases += [phrase for phrase in re.split(r'[,;\n]', description or '') if phrase.strip()]
+        for phrase in phrases:
+            tokens = tokenize(phrase)
+            if tokens and len(tokens) <= MAX_PHRASE_TOKENS:
+                yield tokens, skill_id
+
+
+_automaton = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_automaton():
+    global _automaton, _built_at
+    automaton = _automaton
+    if automaton is not None and time.monotonic() - _built_at < settings.TOPIC_AUTOMATON_TTL:
+        return automaton
+    with _lock:
+        if _automaton is None or time.monotonic() - _built_at >= settings.TOPIC_AUTOMATON_TTL:
+            _automaton = Automaton(list(_patterns()))
+            _built_at = time.monotonic()
+        return _automaton
+
+
+def invalidate(**kwargs):
+    """post_save/post_delete Skill: следующий вызов соберёт автомат заново."""
+    global _automaton
+    _automaton = None
+
+
+def suggest(text):
+    """id навыков, упомянутых в тексте, — чаще упомянутые первыми."""
+    found = get_automaton().match(tokenize(text))
+    return sorted(found, key=lambda skill_id: (-found[skill_id], skill_id))
+
+
+def tag_clients(queryset, chunk_size=1000, overwrite=False):
+    """
+    Проставляет темы клиентам queryset по request_details, обходя их
+    по id пачками. Без overwrite — только тем, у кого тем нет.
+    Возвращает (просмотрено, отмечено клиентов).
+    """
+    through = ClientProfile.interested_topics.through
+    queryset = queryset.exclude(request_details__isnull=True).exclude(request_details='')
+    if not overwrite:
+        queryset = queryset.filter(interested_topics__isnull=True)
+    automaton = get_automaton()
+    seen = tagged = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list('id', 'request_details')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        rows = []
+        matched = []
+        for client_id, text in chunk:
+            skill_ids = automaton.match(tokenize(text))
+            if skill_ids:
+                matched.append(client_id)
+                rows += [through(clientprofile_id=client_id, skill_id=skill_id) for skill_id in skill_ids]
+        with transaction.atomic():
+            if overwrite and matched:
+                through.objects.filter(clientprofile_id__in=matched).delete()
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+        seen += len(chunk)
+        tagged += len(matched)
+    return seen, tagged
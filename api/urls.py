@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 # Создаем роутер для ViewSet'ов
 router = DefaultRouter()
@@ -8,6 +9,28 @@ router = DefaultRouter()
 router.register(r'profile/photos', views.MyTherapistPhotoViewSet, basename='my-photos')
 # Регистрируем ViewSet для управления своими публикациями
 router.register(r'profile/publications', views.MyPublicationViewSet, basename='my-publications')
+# Расписание терапевта и записи
+router.register(r'profile/availability/rules', views.MyAvailabilityRuleViewSet, basename='my-availability-rules')
+router.register(
+    r'profile/availability/exceptions', views.MyAvailabilityExceptionViewSet, basename='my-availability-exceptions'
+)
+router.register(r'profile/bookings', views.MyBookingViewSet, basename='my-bookings')
+# Переписка клиента с терапевтом
+router.register(r'conversations', views.ConversationViewSet, basename='conversations')
+
+# Под ASGI публичные эндпоинты чтения обслуживаются нативными async-представлениями
+if settings.ASYNC_PUBLIC_VIEWS:
+    therapist_list_view = async_views.therapist_list
+    therapist_detail_view = async_views.therapist_detail
+    skill_list_view = async_views.skill_list
+    language_list_view = async_views.language_list
+    public_user_profile_view = async_views.public_user_profile
+else:
+    therapist_list_view = views.TherapistListView.as_view()
+    therapist_detail_view = views.TherapistDetailView.as_view()
+    skill_list_view = views.SkillListView.as_view()
+    language_list_view = views.LanguageListView.as_view()
+    public_user_profile_view = views.PublicUserProfileView.as_view()
 
 urlpatterns = [
     # --- Аутентификация и пользователи ---
@@ -18,31 +41,46 @@ urlpatterns = [
     path('auth/user/', views.CurrentUserView.as_view(), name='current-user'),
 
     # --- Терапевты ---
-    path('therapists/', views.TherapistListView.as_view(), name='therapist-list'),
-    path('therapists/<int:id>/', views.TherapistDetailView.as_view(), name='therapist-detail'),
+    path('therapists/', therapist_list_view, name='therapist-list'),
+    path('therapists/<int:id>/', therapist_detail_view, name='therapist-detail'),
+    path('moderation/therapists/', views.TherapistModerationView.as_view(), name='therapist-moderation'),
+    path('export/therapists.<str:kind>', views.CatalogExportView.as_view(), name='catalog-export'),
+    path('matches/text/', views.TextMatchView.as_view(), name='text-matches'),
 
     # --- Справочники ---
-    path('skills/', views.SkillListView.as_view(), name='skill-list'),
-    path('languages/', views.LanguageListView.as_view(), name='language-list'),
+    path('skills/', skill_list_view, name='skill-list'),
+    path('languages/', language_list_view, name='language-list'),
+    path('topics/suggest/', views.TopicSuggestView.as_view(), name='topic-suggest'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='autocomplete'),
 
     # --- Управление профилем ---
     path('profile/update/base/', views.MyProfileBaseUpdateView.as_view(), name='profile-update-base'),
     path('profile/update/picture/', views.MyProfilePictureUpdateView.as_view(), name='profile-update-picture'),
     path('profile/update/therapist/', views.MyTherapistProfileUpdateView.as_view(), name='profile-update-therapist'),
     path('profile/update/client/', views.MyClientProfileUpdateView.as_view(), name='profile-update-client'),
+    path('profile/stats/', views.MyStatsView.as_view(), name='profile-stats'),
+    path('profile/export/', views.MyDataExportView.as_view(), name='data-export'),
+    path('profile/export/download/<str:token>/', views.DataExportDownloadView.as_view(), name='data-export-download'),
 
     # --- Публичные ресурсы терапевтов ---
     # Список публикаций конкретного терапевта (по ID профиля терапевта)
     path('therapists/<int:therapist_id>/publications/', views.TherapistPublicationsListView.as_view(), name='therapist-publications-list'),
     # Список фотографий конкретного терапевта
     path('therapists/<int:therapist_id>/photos/', views.TherapistPhotosListView.as_view(), name='therapist-photos-list'),
+    # Свободные слоты и запись на приём
+    path('therapists/<int:therapist_id>/slots/', views.TherapistSlotsView.as_view(), name='therapist-slots'),
+    path('therapists/<int:therapist_id>/bookings/', views.TherapistBookingView.as_view(), name='therapist-booking'),
 
     # --- Публикации ---
     path('publications/', views.PublicationListCreateView.as_view(), name='publication-list-create'),
     path('publications/<uuid:pk>/', views.PublicationDetailView.as_view(), name='publication-detail'),
 
+    # --- Доставка сообщений (async: SSE и long-poll) ---
+    path('messages/stream/', async_views.message_stream, name='message-stream'),
+    path('messages/poll/', async_views.message_poll, name='message-poll'),
+
     # --- Публичные профили пользователей ---
-    path('users/<uuid:public_user_id>/profile/', views.PublicUserProfileView.as_view(), name='public-user-profile'),
+    path('users/<uuid:public_user_id>/profile/', public_user_profile_view, name='public-user-profile'),
 
     # Включаем URL из роутера (для управления своими фото и публикациями)
     path('', include(router.urls)),
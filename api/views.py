@@ -1,14 +1,20 @@
+import secrets
+
 from django.shortcuts import render
 from rest_framework import viewsets, status, permissions, generics, parsers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth import get_user_model, authenticate
 from django.shortcuts import get_object_or_404
 from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import UserProfile, TherapistProfile, ClientProfile, InviteCode, Skill, Language, Role, TherapistPhoto, Publication
+from .models import (
+    UserProfile, TherapistProfile, ClientProfile, InviteCode, Skill, Language, Role, TherapistPhoto, Publication,
+    AvailabilityRule, AvailabilityException, Booking, BookingStatus, Conversation, DataExport
+)
 from .serializers import (
     UserSerializer, UserProfileSerializer, TherapistProfileSerializer,
     ClientProfileSerializer, InviteCodeSerializer, ClientRegistrationSerializer,
@@ -17,15 +23,26 @@ from .serializers import (
     UserUpdateSerializer, UserProfileUpdateSerializer,
     TherapistProfileUpdateSerializer, ClientProfileUpdateSerializer,
     TherapistPhotoSerializer, PublicationSerializer, PublicationWriteSerializer,
-    PublicUserProfileSerializer, TherapistCardSerializer
+    PublicUserProfileSerializer, TherapistCardSerializer, TherapistModerationSerializer,
+    AvailabilityRuleSerializer, AvailabilityExceptionSerializer, SlotSerializer,
+    BookingSerializer, BookingCreateSerializer,
+    ConversationSerializer, ConversationCreateSerializer, MessageSerializer,
+    StatPointSerializer, PublicationStatSerializer, DataExportSerializer
 )
 from rest_framework.views import APIView
-from .permissions import IsOwnerOrReadOnly, IsTherapistOwner
-from django.db.models import Prefetch, Count, Avg, Q
+from .permissions import HasExportToken, IsOwnerOrReadOnly, IsTherapistOwner
+from .throttling import BucketThrottleMixin, IPThrottle, EmailThrottle, InviteCodeThrottle
+from . import autocomplete, availability, counters, dataexport, deletion, export, gallery, geo, messaging, metrics, similarity, textsearch, topics
+from .middleware import negotiate_encoding
+from .moderation import moderate_therapists
+from .subscriptions import catalog_filter
+from django.db.models import Prefetch, Count, Avg, F, Q, Sum
 from django.utils import timezone
+from datetime import timedelta
 from django.conf import settings
-from django.http import Http404
-from rest_framework.pagination import PageNumberPagination
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 User = get_user_model()
 
@@ -58,9 +75,11 @@ class UserViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ClientRegistrationView(generics.CreateAPIView):
+class ClientRegistrationView(BucketThrottleMixin, generics.CreateAPIView):
     serializer_class = ClientRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPThrottle, EmailThrottle]
+    throttle_scope = 'register'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -72,9 +91,11 @@ class ClientRegistrationView(generics.CreateAPIView):
             'user': CurrentUserSerializer(user, context={'request': request}).data
         }, status=status.HTTP_201_CREATED)
 
-class TherapistRegistrationView(generics.CreateAPIView):
+class TherapistRegistrationView(BucketThrottleMixin, generics.CreateAPIView):
     serializer_class = TherapistRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [IPThrottle, EmailThrottle, InviteCodeThrottle]
+    throttle_scope = 'register'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -116,6 +137,14 @@ class CurrentUserView(generics.RetrieveAPIView):
     def get_object(self):
         return self.request.user
 
+    def delete(self, request):
+        """
+        Удаление своего аккаунта: он сразу отключается (токен перестаёт действовать),
+        данные в фоне удаляет команда process_account_deletions. Ответ — 202.
+        """
+        job, _created = deletion.schedule(request.user, requested_by=request.user)
+        return Response({'deletion_id': job.id, 'status': job.status}, status=status.HTTP_202_ACCEPTED)
+
 class EmailAuthToken(ObtainAuthToken):
     serializer_class = EmailAuthTokenSerializer
 
@@ -132,9 +161,12 @@ class EmailAuthToken(ObtainAuthToken):
             'is_client': user.is_client
         })
 
-class LoginView(APIView):
+class LoginView(BucketThrottleMixin, APIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = EmailAuthTokenSerializer
+    # Проверяется до authenticate(), чтобы перебор паролей не тратил CPU на хэширование
+    throttle_classes = [IPThrottle, EmailThrottle]
+    throttle_scope = 'login'
 
     def post(self, request, *args, **kwargs):
         serializer = EmailAuthTokenSerializer(data=request.data)
@@ -153,6 +185,27 @@ class LoginView(APIView):
         else:
             return Response({"error": "Invalid Credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
+class TherapistModerationView(APIView):
+    """
+    Массовая модерация терапевтов для администраторов:
+    {"action": "verify|unverify|subscribe|unsubscribe", "ids": [...]}.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = TherapistModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = moderate_therapists(
+            TherapistProfile.objects.filter(id__in=serializer.validated_data['ids']),
+            serializer.validated_data['action'],
+            request.user,
+        )
+        return Response({
+            'action': serializer.validated_data['action'],
+            'updated': len(updated),
+            'ids': updated,
+        }, status=status.HTTP_200_OK)
+
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def post(self, request, *args, **kwargs):
@@ -171,10 +224,42 @@ class LanguageListView(generics.ListAPIView):
     serializer_class = LanguageSerializer
     permission_classes = [permissions.AllowAny]
 
+class AutocompleteView(APIView):
+    """
+    Подсказки при вводе: ?q= — начало названия навыка, языка или имени
+    терапевта (регистр, ё и раскладка кириллица/латиница не важны), ?limit=.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', settings.AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число'})
+        if not 1 <= limit <= settings.AUTOCOMPLETE_MAX_LIMIT:
+            raise ValidationError({'limit': f'От 1 до {settings.AUTOCOMPLETE_MAX_LIMIT}'})
+        return Response(autocomplete.complete(request.query_params.get('q', '')[:100], limit))
+
+class TopicSuggestView(APIView):
+    """Навыки, упомянутые в ?text= (для подсказки тем по описанию запроса)."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        text = request.query_params.get('text', '')
+        if len(text) > settings.TEXT_MATCH_MAX_LENGTH:
+            raise ValidationError({'text': f'Текст не длиннее {settings.TEXT_MATCH_MAX_LENGTH} символов'})
+        skill_ids = topics.suggest(text)
+        skills = Skill.objects.in_bulk(skill_ids)
+        return Response(SkillSerializer([skills[skill_id] for skill_id in skill_ids if skill_id in skills], many=True).data)
+
 class TherapistListView(generics.ListAPIView):
     """
     Возвращает список верифицированных терапевтов.
     Доступно всем пользователям.
+
+    Фильтры: ?city=, ?online=true, ?available_from=&available_to=
+    (есть свободный слот в интервале), ?near=широта,долгота&radius=км —
+    в последнем случае список отсортирован по расстоянию (distance_km).
     """
     serializer_class = TherapistCardSerializer
     permission_classes = [permissions.AllowAny]
@@ -188,11 +273,105 @@ class TherapistListView(generics.ListAPIView):
             'therapist_profile__skills',
             'therapist_profile__languages'
         ).filter(
-            profile__role=Role.THERAPIST,
-            therapist_profile__is_verified=True,
-            therapist_profile__is_subscribed=True
+            # is_listed уже учитывает роль: фильтр по одной таблице и частичному индексу
+            catalog_filter('therapist_profile__')
         ).order_by('-therapist_profile__created_at')
 
+    def filter_queryset(self, queryset):
+        # ?city= и ?online=true: частичные индексы therapist_city_idx / therapist_online_idx
+        params = self.request.query_params
+        return queryset.filter(
+            geo.location_filter(params, 'therapist_profile__'),
+            availability.availability_filter(params, 'therapist_profile__'),
+        )
+
+    def list(self, request, *args, **kwargs):
+        near = geo.parse_near(request.query_params, settings.NEAR_DEFAULT_RADIUS_KM, settings.NEAR_MAX_RADIUS_KM)
+        if near is None:
+            return super().list(request, *args, **kwargs)
+
+        # Кандидаты — диапазоны geocell по частичному индексу, точное расстояние — в памяти
+        candidates = TherapistProfile.objects.filter(
+            catalog_filter(), geo.location_filter(request.query_params),
+            availability.availability_filter(request.query_params), geo.cover_filter(*near),
+        ).values_list('user_id', 'latitude', 'longitude')
+        ranked = geo.rank_by_distance(candidates, *near)
+        page = self.paginate_queryset(ranked)
+        distances = dict(page)
+        users = self.get_queryset().filter(id__in=distances).order_by()
+        users = sorted(users, key=lambda user: (distances[user.id], user.id))
+        data = self.get_serializer(users, many=True).data
+        for item, user in zip(data, users):
+            item['distance_km'] = round(distances[user.id], 2)
+        return self.get_paginated_response(data)
+
+class CatalogExportView(APIView):
+    """
+    Выгрузка каталога для партнёров потоком: export/therapists.csv или
+    export/therapists.ndjson. ?since= (ISO 8601) — только изменённые после
+    этого момента, включая убранные из каталога (listed=false). Сжимается
+    gzip, если клиент его принимает. Заголовок X-Export-Started-At — значение
+    since для следующей инкрементальной выгрузки.
+    """
+    permission_classes = [permissions.IsAdminUser | HasExportToken]
+
+    def get(self, request, kind):
+        if kind not in export.FORMATS:
+            raise Http404
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                raise ValidationError({'since': 'Ожидается дата и время в формате ISO 8601'})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        started_at = timezone.now()
+        # Выгрузка умеет только gzip; q=0 и '*' учитываются
+        compress = negotiate_encoding(request.headers.get('Accept-Encoding', ''), ('gzip',)) == 'gzip'
+        response = StreamingHttpResponse(
+            export.export(kind, since or None, compress, settings.CATALOG_EXPORT_CHUNK_SIZE),
+            content_type=export.FORMATS[kind],
+        )
+        response['Content-Disposition'] = f'attachment; filename="therapists.{kind}"'
+        response['X-Export-Started-At'] = started_at.isoformat()
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+class TextMatchView(TherapistListView):
+    """
+    Терапевты каталога, подходящие под текст запроса клиента (BM25 по «О себе»),
+    от лучших к худшим, с полем score. Текст — ?q= или описание запроса
+    из профиля клиента. Принимает те же фильтры, что и каталог, кроме ?near=.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_text(self):
+        text = self.request.query_params.get('q')
+        if not text and hasattr(self.request.user, 'client_profile'):
+            text = self.request.user.client_profile.request_details
+        if not text or not text.strip():
+            raise ValidationError({'q': 'Укажите текст запроса или заполните описание запроса в профиле'})
+        if len(text) > settings.TEXT_MATCH_MAX_LENGTH:
+            raise ValidationError({'q': f'Текст запроса не длиннее {settings.TEXT_MATCH_MAX_LENGTH} символов'})
+        return text
+
+    def list(self, request, *args, **kwargs):
+        text = self.get_text()
+        params = request.query_params
+        eligible = set(TherapistProfile.objects.filter(
+            catalog_filter(), geo.location_filter(params), availability.availability_filter(params),
+        ).values_list('user_id', flat=True))
+        ranked = textsearch.index.search(text, eligible)
+        page = self.paginate_queryset(ranked)
+        scores = dict(page)
+        users = sorted(self.get_queryset().filter(id__in=scores).order_by(), key=lambda user: (-scores[user.id], user.id))
+        data = self.get_serializer(users, many=True).data
+        for item, user in zip(data, users):
+            item['score'] = round(scores[user.id], 4)
+        return self.get_paginated_response(data)
+
 class TherapistDetailView(generics.RetrieveAPIView):
     """
     Представление для детальной информации о терапевте.
@@ -204,13 +383,18 @@ class TherapistDetailView(generics.RetrieveAPIView):
     
     def get_queryset(self):
         return TherapistProfile.objects.filter(
-            is_verified=True,
-            is_subscribed=True
+            catalog_filter()
         ).prefetch_related(
             'skills',
             'languages',
-            'photos'
-        ).select_related('user')
+            'gallery_photos',
+            similarity.similar_prefetch(),
+        ).select_related('user', 'user__profile')
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        counters.buffer.profile_view(response.data['id'])
+        return response
 
 class MyProfileBaseUpdateView(generics.UpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -307,6 +491,36 @@ class MyTherapistPhotoViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
 
+    @action(detail=False, methods=['post'], parser_classes=[parsers.MultiPartParser])
+    def batch(self, request):
+        """
+        Загрузка нескольких фото одним запросом: multipart-поля images (файлы)
+        и необязательные captions (подписи в том же порядке). Фото добавляются
+        в конец галереи; если хоть один файл не изображение — не сохраняется ни один.
+        """
+        uploads = request.FILES.getlist('images')
+        if not uploads:
+            raise ValidationError({'images': 'Приложите хотя бы один файл'})
+        if len(uploads) > settings.GALLERY_MAX_UPLOAD_FILES:
+            raise ValidationError({'images': f'Не больше {settings.GALLERY_MAX_UPLOAD_FILES} файлов за раз'})
+        captions = [caption[:200] or None for caption in request.data.getlist('captions')]
+        photos, errors = gallery.add_photos(request.user.therapist_profile, uploads, captions)
+        if errors:
+            raise ValidationError({'images': {uploads[index].name: messages for index, messages in errors.items()}})
+        return Response(self.get_serializer(photos, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def reorder(self, request):
+        """Новый порядок галереи: {"ids": [...]} — все id фото профиля в нужном порядке."""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(photo_id, int) for photo_id in ids):
+            raise ValidationError({'ids': 'Ожидается список id фото'})
+        try:
+            gallery.reorder(request.user.therapist_profile, ids)
+        except ValueError as exc:
+            raise ValidationError({'ids': str(exc)})
+        return Response(self.get_serializer(self.get_queryset(), many=True).data)
+
 class MyPublicationViewSet(viewsets.ModelViewSet):
     """
     ViewSet для управления публикациями терапевта.
@@ -357,8 +571,10 @@ class MyPublicationViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """
         При создании публикации установить автора - текущего пользователя.
+        Уведомления подписчикам пишутся в outbox в той же транзакции.
         """
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            serializer.save(author=self.request.user)
     
     def get_object(self):
         """
@@ -384,10 +600,8 @@ class TherapistPublicationsListView(generics.ListAPIView):
         
         # Находим профиль терапевта
         therapist = get_object_or_404(
-            TherapistProfile, 
-            id=therapist_id,
-            is_verified=True,
-            is_subscribed=True
+            TherapistProfile.objects.filter(catalog_filter()),
+            id=therapist_id
         )
         
         # Возвращаем только опубликованные статьи
@@ -416,10 +630,8 @@ class TherapistPhotosListView(generics.ListAPIView):
         
         # Находим профиль терапевта
         therapist = get_object_or_404(
-            TherapistProfile, 
-            id=therapist_id,
-            is_verified=True,
-            is_subscribed=True
+            TherapistProfile.objects.filter(catalog_filter()),
+            id=therapist_id
         )
         
         # Возвращаем все фотографии терапевта, отсортированные по порядку
@@ -437,7 +649,8 @@ class PublicationListCreateView(generics.ListCreateAPIView):
         return Publication.objects.select_related('author').all()
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            serializer.save(author=self.request.user)
 
 class PublicationDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Publication.objects.all()
@@ -449,6 +662,11 @@ class PublicationDetailView(generics.RetrieveUpdateDestroyAPIView):
             return [permissions.IsAuthenticated()]
         return [permissions.IsAuthenticatedOrReadOnly()]
 
+    def retrieve(self, request, *args, **kwargs):
+        publication = self.get_object()
+        counters.buffer.publication_read(publication.pk, publication.author_id)
+        return Response(self.get_serializer(publication).data)
+
 class PublicUserProfileView(generics.RetrieveAPIView):
     """
     Возвращает публичный профиль пользователя (предназначен для терапевтов).
@@ -462,7 +680,8 @@ class PublicUserProfileView(generics.RetrieveAPIView):
     ).prefetch_related(
         'publications',
         'therapist_profile__skills',
-        'therapist_profile__languages'
+        'therapist_profile__languages',
+        'therapist_profile__gallery_photos'
     ).filter(
         profile__role=Role.THERAPIST
     )
@@ -487,3 +706,248 @@ class PublicUserProfileView(generics.RetrieveAPIView):
             raise Http404("Профиль терапевта не найден.")
 
         return user
+
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        counters.buffer.profile_view(user.therapist_profile.id)
+        return Response(self.get_serializer(user).data)
+
+
+# --- Статистика терапевта ---
+
+class MyStatsView(APIView):
+    """
+    Статистика текущего терапевта: итоги просмотров профиля и прочтений публикаций,
+    ряд за ?days=N (по умолчанию 7) с шагом ?by=hour|day и самые читаемые публикации.
+    Данные отстают от реальных на интервал сброса буфера счётчиков.
+    """
+    permission_classes = [IsTherapistOwner]
+
+    def get(self, request):
+        therapist = request.user.therapist_profile
+        try:
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            raise ValidationError({'days': 'Ожидается целое число дней'})
+        if not 1 <= days <= settings.STATS_MAX_DAYS:
+            raise ValidationError({'days': f'Период от 1 до {settings.STATS_MAX_DAYS} дней'})
+        by = request.query_params.get('by', 'day')
+        if by not in ('hour', 'day'):
+            raise ValidationError({'by': 'Допустимые значения: hour, day'})
+
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+        publications = Publication.objects.filter(author=request.user)
+        top = publications.order_by('-read_count', '-created_at')[:10]
+        return Response({
+            'profile_views': therapist.view_count,
+            'publication_reads': publications.aggregate(total=Sum('read_count'))['total'] or 0,
+            'series': StatPointSerializer(counters.therapist_series(therapist, start, by), many=True).data,
+            'publications': PublicationStatSerializer(top, many=True).data,
+        })
+
+
+class MyDataExportView(APIView):
+    """
+    Выгрузка всех данных текущего пользователя в ZIP.
+    POST ставит сборку в очередь (повторный — возвращает незавершённую),
+    GET — состояние последней выгрузки и ссылка на скачивание, когда готова.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        job = DataExport.objects.filter(user=request.user).order_by('-created_at').first()
+        if job is None:
+            raise Http404
+        return Response(DataExportSerializer(job, context={'request': request}).data)
+
+    def post(self, request):
+        job, created = dataexport.request_export(request.user)
+        return Response(
+            DataExportSerializer(job, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK,
+        )
+
+
+class DataExportDownloadView(APIView):
+    """
+    Скачивание готового архива по подписанной ссылке из MyDataExportView;
+    заголовок Range — докачка с нужного байта.
+    """
+    permission_classes = [permissions.AllowAny]
+    # Доступ даёт подпись ссылки; заголовок Authorization менеджера загрузок не нужен
+    authentication_classes = []
+
+    def get(self, request, token):
+        job = dataexport.job_from_token(token)
+        if job is None:
+            raise Http404
+        return dataexport.file_response(request, job)
+
+
+# --- Расписание и записи ---
+
+class MyAvailabilityRuleViewSet(viewsets.ModelViewSet):
+    """
+    Еженедельные правила расписания терапевта (время — в его часовом поясе).
+    """
+    serializer_class = AvailabilityRuleSerializer
+    permission_classes = [permissions.IsAuthenticated, IsTherapistOwner]
+    pagination_class = None
+
+    def get_queryset(self):
+        if not hasattr(self.request.user, 'therapist_profile'):
+            return AvailabilityRule.objects.none()
+        return AvailabilityRule.objects.filter(therapist=self.request.user.therapist_profile)
+
+    def perform_create(self, serializer):
+        serializer.save(therapist=self.request.user.therapist_profile)
+
+
+class MyAvailabilityExceptionViewSet(MyAvailabilityRuleViewSet):
+    """
+    Исключения из расписания: недоступность или дополнительные окна приёма.
+    """
+    serializer_class = AvailabilityExceptionSerializer
+
+    def get_queryset(self):
+        if not hasattr(self.request.user, 'therapist_profile'):
+            return AvailabilityException.objects.none()
+        return AvailabilityException.objects.filter(therapist=self.request.user.therapist_profile)
+
+
+class MyBookingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Записи текущего пользователя: его записи как клиента и записи к нему как к терапевту.
+    """
+    serializer_class = BookingSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        return Booking.objects.filter(Q(client=user) | Q(therapist__user=user)).order_by('-starts_at')
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        booking = self.get_object()
+        # Условный UPDATE: повторная или параллельная отмена ничего не меняет
+        Booking.objects.filter(pk=booking.pk, status=BookingStatus.BOOKED).update(status=BookingStatus.CANCELLED)
+        booking.refresh_from_db()
+        return Response(BookingSerializer(booking).data)
+
+
+class TherapistSlotsView(APIView):
+    """
+    Свободные слоты терапевта: ?from=&to= (ISO 8601), по умолчанию — ближайшая неделя.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, therapist_id):
+        therapist = get_object_or_404(TherapistProfile.objects.filter(catalog_filter()), id=therapist_id)
+        window = availability.parse_window(
+            request.query_params, 'from', 'to', max_days=settings.AVAILABILITY_MAX_WINDOW_DAYS
+        )
+        if window is None:
+            now = timezone.now()
+            window = now, now + timedelta(days=7)
+        slots = availability.free_slots(therapist, *window)
+        return Response(SlotSerializer(
+            [{'starts_at': start, 'ends_at': end} for start, end in slots], many=True
+        ).data)
+
+
+class TherapistBookingView(APIView):
+    """
+    Запись на слот терапевта: {"starts_at": "..."}; 409, если слот уже занят.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, therapist_id):
+        serializer = BookingCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            booking = availability.book_slot(therapist_id, request.user, serializer.validated_data['starts_at'])
+        except availability.SlotUnavailable as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(BookingSerializer(booking).data, status=status.HTTP_201_CREATED)
+
+
+# --- Переписка ---
+
+class MessageHistoryPagination(CursorPagination):
+    # Курсор по id: новые сообщения не сдвигают уже загруженные страницы истории
+    ordering = '-id'
+    page_size = 50
+
+
+class ConversationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Диалоги текущего пользователя. POST {"therapist": id, "body": "..."} начинает
+    (или продолжает) диалог с терапевтом из каталога.
+    История — GET messages/ (курсорная пагинация от новых к старым),
+    отправка — POST messages/, доставка новых — /api/messages/stream/ и /api/messages/poll/.
+    """
+    serializer_class = ConversationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Conversation.objects.filter(
+            messaging.participant_filter(self.request.user)
+        ).select_related('client', 'therapist__user').order_by(F('last_message_at').desc(nulls_last=True), '-id')
+
+    def create(self, request, *args, **kwargs):
+        # Диалог всегда «клиент — терапевт»: терапевт не может открыть диалог с коллегой
+        if not request.user.is_client:
+            raise PermissionDenied('Начать диалог с терапевтом может только клиент.')
+        serializer = ConversationCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        therapist = get_object_or_404(
+            TherapistProfile.objects.filter(catalog_filter()).select_related('user'),
+            id=serializer.validated_data['therapist'],
+        )
+        if therapist.user_id == request.user.id:
+            raise ValidationError({'therapist': 'Нельзя начать диалог с самим собой.'})
+        conversation, created = Conversation.objects.get_or_create(client=request.user, therapist=therapist)
+        if serializer.validated_data.get('body'):
+            messaging.send_message(conversation, request.user, serializer.validated_data['body'])
+            conversation.refresh_from_db(fields=['last_message_at'])
+        return Response(
+            ConversationSerializer(conversation).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=['get', 'post'], pagination_class=MessageHistoryPagination)
+    def messages(self, request, pk=None):
+        conversation = self.get_object()
+        if request.method == 'POST':
+            serializer = MessageSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            message = messaging.send_message(conversation, request.user, serializer.validated_data['body'])
+            return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+        page = self.paginate_queryset(conversation.messages.all())
+        return self.get_paginated_response(MessageSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Отмечает прочитанными входящие сообщения до {"up_to": id} включительно."""
+        conversation = self.get_object()
+        up_to = request.data.get('up_to')
+        if not isinstance(up_to, int):
+            raise ValidationError({'up_to': 'Ожидается id сообщения.'})
+        updated = conversation.messages.filter(
+            id__lte=up_to, read_at__isnull=True
+        ).exclude(sender=request.user).update(read_at=timezone.now())
+        return Response({'updated': updated})
+
+
+def metrics_view(request):
+    """
+    Отдаёт метрики эндпоинтов в текстовом формате Prometheus. Доступ — сотрудникам
+    (сессия админки) или сборщику с заголовком Authorization: Bearer <METRICS_TOKEN>.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    token_ok = bool(settings.METRICS_TOKEN) and len(auth) == 2 and auth[0].lower() == 'bearer' \
+        and secrets.compare_digest(auth[1].encode(), settings.METRICS_TOKEN.encode())
+    if not token_ok and not request.user.is_staff:
+        return HttpResponse(status=401 if not request.user.is_authenticated else 403,
+                            headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(metrics.render_exposition(), content_type=metrics.CONTENT_TYPE)
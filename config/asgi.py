@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Под ASGI публичные эндпоинты чтения работают без переключений в sync_to_async
+os.environ.setdefault('ASYNC_PUBLIC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -50,6 +51,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.MetricsMiddleware',
+    # После метрик: размер ответа в метриках — уже сжатый, как в сети
+    'api.middleware.CompressionMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,11 +97,50 @@ DATABASES = {
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
         'OPTIONS': {
-            'sslmode': 'disable',
+            'sslmode': os.getenv('DB_SSLMODE', 'disable'),
         },
+        # Соединения не держим между запросами сами: их переиспользует пул бэкенда
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
+        # Пул соединений db.backends.postgresql (см. db/backends/postgresql/pool.py)
+        'POOL': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+            'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+            'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '600')),
+        } if os.getenv('DB_POOL_ENABLED', 'True') == 'True' else None,
     }
 }
 
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1,host2 (остальные параметры как у default).
+# Для локальной проверки можно указать тот же хост, что и у основной базы.
+REPLICA_DATABASES = []
+for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+# manage.py test: второй алиас той же тестовой базы — локальная «реплика» для тестов
+# маршрутизации (api.tests.ReplicaRoutingTests); в REPLICA_DATABASES не входит
+if sys.argv[1:2] == ['test']:
+    DATABASES['replica_test'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['api.db_router.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает только с основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+# Алиас общего кэша из CACHES (Redis, база) для отметки клиентов с токеном без cookie;
+# пустое значение — отметка только в подписанной cookie. Кэш процесса (LocMem) не подходит
+REPLICA_STICKY_CACHE = os.getenv('REPLICA_STICKY_CACHE', '')
+# Реплики с большим отставанием временно не используются
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '5'))
+
 # Специальная настройка для PostgreSQL
 POSTGRES_DISABLE_TIMEZONE_SET = True
 
@@ -139,6 +183,8 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Закрытые файлы (выгрузки персональных данных): не раздаются по MEDIA_URL
+PRIVATE_MEDIA_ROOT = os.getenv('PRIVATE_MEDIA_ROOT', os.path.join(BASE_DIR, 'private'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -186,12 +232,149 @@ CORS_ALLOW_HEADERS = [
 ]
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Число доверенных прокси перед приложением: адрес клиента для лимитов берётся
+    # из X-Forwarded-For только на эту глубину; 0 — REMOTE_ADDR (заголовок клиента не учитывается)
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+    # Лимиты token bucket для api/throttling.py: '<throttle_scope>_<ip|email|invite>'
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': os.getenv('THROTTLE_LOGIN_IP', '30/min'),
+        'login_email': os.getenv('THROTTLE_LOGIN_EMAIL', '10/min'),
+        'register_ip': os.getenv('THROTTLE_REGISTER_IP', '20/hour'),
+        'register_email': os.getenv('THROTTLE_REGISTER_EMAIL', '5/hour'),
+        'register_invite': os.getenv('THROTTLE_REGISTER_INVITE', '5/hour'),
+    },
 }
 
+# Сериализация JSON в api/renderers.py: 'orjson' (если установлен) или 'stdlib'
+JSON_RENDERER_BACKEND = os.getenv('JSON_RENDERER_BACKEND', 'orjson')
+
+# Сжатие ответов (api.middleware.CompressionMiddleware): brotli — если установлен модуль brotli (Brotli в requirements.txt)
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True') == 'True'
+# Тела короче порога отдаются как есть: выигрыш в байтах не окупает CPU
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+# Сжимаются только ответы этих типов — JSON API. HTML (админка, browsable API) несёт CSRF-токен
+# рядом с отражённым вводом, и по длине сжатого ответа его можно подобрать (атака BREACH)
+COMPRESSION_TYPES = set(os.getenv('COMPRESSION_TYPES', 'application/json').split(','))
+
+# Ограничение частоты логина и регистрации
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True') == 'True'
+# Файл ведер в общей памяти для всех воркеров; пустое значение — ведра в памяти процесса
+THROTTLE_SHM_PATH = os.getenv('THROTTLE_SHM_PATH', '/dev/shm/psy_throttle' if os.path.isdir('/dev/shm') else '')
+THROTTLE_SHM_SLOTS = int(os.getenv('THROTTLE_SHM_SLOTS', '65536'))
+
 AUTH_USER_MODEL = 'api.User'
+
+# Начиная с этого числа строк в таблице списки админки показывают оценку из статистики вместо COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '10000'))
+
+# Поиск терапевтов рядом с точкой (?near=широта,долгота&radius=км), км
+NEAR_DEFAULT_RADIUS_KM = float(os.getenv('NEAR_DEFAULT_RADIUS_KM', '25'))
+NEAR_MAX_RADIUS_KM = float(os.getenv('NEAR_MAX_RADIUS_KM', '500'))
+
+# Самый длинный интервал запроса слотов одного терапевта (?from=&to=), дней
+AVAILABILITY_MAX_WINDOW_DAYS = int(os.getenv('AVAILABILITY_MAX_WINDOW_DAYS', '14'))
+# Самый длинный интервал фильтра каталога ?available_from=&available_to=, дней. Не больше 6:
+# окна правил за неделю и больше покрывают все правила, и индекс week_minutes ничего не отсекает
+AVAILABILITY_MAX_FILTER_DAYS = min(int(os.getenv('AVAILABILITY_MAX_FILTER_DAYS', '6')), 6)
+
+# Буфер счётчиков просмотров (api/counters.py): сброс в базу раз в N секунд или по накоплении событий
+COUNTERS_FLUSH_INTERVAL = float(os.getenv('COUNTERS_FLUSH_INTERVAL', '10'))
+COUNTERS_FLUSH_THRESHOLD = int(os.getenv('COUNTERS_FLUSH_THRESHOLD', '1000'))
+# Глубина статистики в кабинете терапевта, дней
+STATS_MAX_DAYS = int(os.getenv('STATS_MAX_DAYS', '90'))
+
+# Похожие терапевты (api/similarity.py): хранится с запасом на выбывших из каталога, показывается
+SIMILAR_THERAPISTS_STORED = int(os.getenv('SIMILAR_THERAPISTS_STORED', '12'))
+SIMILAR_THERAPISTS_SHOWN = int(os.getenv('SIMILAR_THERAPISTS_SHOWN', '6'))
+
+# Подбор по тексту запроса (api/textsearch.py): как часто фоновый поток подтягивает изменённые
+# профили и перестраивает индекс целиком, секунд; предельная длина текста запроса
+TEXT_INDEX_REFRESH_SECONDS = float(os.getenv('TEXT_INDEX_REFRESH_SECONDS', '30'))
+TEXT_INDEX_REBUILD_SECONDS = float(os.getenv('TEXT_INDEX_REBUILD_SECONDS', '3600'))
+TEXT_MATCH_MAX_LENGTH = int(os.getenv('TEXT_MATCH_MAX_LENGTH', '5000'))
+
+# Темы запроса клиента по тексту (api/topics.py): автоназначение при пустом списке тем,
+# сколько тем назначать и как долго процесс использует собранный автомат, секунд
+TOPIC_AUTO_ASSIGN = os.getenv('TOPIC_AUTO_ASSIGN', 'True') == 'True'
+TOPIC_AUTO_ASSIGN_LIMIT = int(os.getenv('TOPIC_AUTO_ASSIGN_LIMIT', '5'))
+TOPIC_AUTOMATON_TTL = float(os.getenv('TOPIC_AUTOMATON_TTL', '300'))
+
+# Подсказки при вводе (api/autocomplete.py): срок жизни индекса процесса, секунд; результатов каждого вида
+AUTOCOMPLETE_TTL = float(os.getenv('AUTOCOMPLETE_TTL', '300'))
+AUTOCOMPLETE_LIMIT = int(os.getenv('AUTOCOMPLETE_LIMIT', '8'))
+# Алиас общего кэша из CACHES (Redis, база), через который сброс индекса подсказок видят
+# все воркеры; пустое значение — другие процессы подхватят изменения через AUTOCOMPLETE_TTL
+AUTOCOMPLETE_CACHE = os.getenv('AUTOCOMPLETE_CACHE', '')
+AUTOCOMPLETE_MAX_LIMIT = 20
+
+# Выгрузка каталога для партнёров (api/export.py): ключи через запятую для заголовка X-Export-Token,
+# строк в пачке серверного курсора
+CATALOG_EXPORT_TOKENS = [token for token in os.getenv('CATALOG_EXPORT_TOKENS', '').split(',') if token]
+CATALOG_EXPORT_CHUNK_SIZE = int(os.getenv('CATALOG_EXPORT_CHUNK_SIZE', '2000'))
+
+# Выгрузка персональных данных (api/dataexport.py): сколько часов хранится архив, срок ссылки на скачивание
+# в секундах и через сколько секунд зависшая сборка (упавший воркер) берётся заново
+DATA_EXPORT_KEEP_HOURS = int(os.getenv('DATA_EXPORT_KEEP_HOURS', '72'))
+DATA_EXPORT_LINK_SECONDS = int(os.getenv('DATA_EXPORT_LINK_SECONDS', '86400'))
+DATA_EXPORT_STALE_SECONDS = int(os.getenv('DATA_EXPORT_STALE_SECONDS', '3600'))
+
+# Фоновое удаление аккаунтов (api/deletion.py): строк в одной транзакции и через сколько секунд
+# зависшее удаление (упавший воркер) берётся заново
+ACCOUNT_DELETION_BATCH_SIZE = int(os.getenv('ACCOUNT_DELETION_BATCH_SIZE', '500'))
+ACCOUNT_DELETION_STALE_SECONDS = int(os.getenv('ACCOUNT_DELETION_STALE_SECONDS', '1800'))
+# Повтор упавшего удаления: попыток всего и задержка перед второй (дальше удваивается), секунд
+ACCOUNT_DELETION_MAX_ATTEMPTS = int(os.getenv('ACCOUNT_DELETION_MAX_ATTEMPTS', '5'))
+ACCOUNT_DELETION_RETRY_SECONDS = int(os.getenv('ACCOUNT_DELETION_RETRY_SECONDS', '300'))
+
+# Галерея терапевта (api/gallery.py): файлов в одной пакетной загрузке и потоков их обработки
+GALLERY_MAX_UPLOAD_FILES = int(os.getenv('GALLERY_MAX_UPLOAD_FILES', '50'))
+GALLERY_UPLOAD_WORKERS = int(os.getenv('GALLERY_UPLOAD_WORKERS', '4'))
+
+# Доставка сообщений: LISTEN/NOTIFY между процессами (False — только внутри процесса,
+# годится лишь для одного воркера), интервал пустых событий SSE и предел ожидания long-poll, секунд
+MESSAGING_PG_NOTIFY = os.getenv('MESSAGING_PG_NOTIFY', 'True') == 'True'
+MESSAGING_HEARTBEAT_SECONDS = int(os.getenv('MESSAGING_HEARTBEAT_SECONDS', '15'))
+MESSAGING_POLL_TIMEOUT = int(os.getenv('MESSAGING_POLL_TIMEOUT', '30'))
+# Сколько секунд пропуск в id сообщений считается ещё не зафиксированной транзакцией:
+# сообщения за ним не отдаются, пока она не закоммитится (или пропуск не устареет)
+MESSAGING_REORDER_SECONDS = int(os.getenv('MESSAGING_REORDER_SECONDS', '10'))
+
+# Почта: письма уходят только через очередь уведомлений (api/outbox.py, команда process_outbox).
+# Для локальной проверки: pip install aiosmtpd; python -m aiosmtpd -n -l localhost:1025 и EMAIL_PORT=1025
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False') == 'True'
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '10'))
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@localhost')
+# Попыток доставки письма и экспоненциальная задержка между ними, секунд
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE_SECONDS = int(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '60'))
+OUTBOX_RETRY_MAX_SECONDS = int(os.getenv('OUTBOX_RETRY_MAX_SECONDS', '21600'))
+# На сколько взятая воркером пачка скрыта от других; если воркер упал, письма вернутся в очередь
+OUTBOX_CLAIM_SECONDS = int(os.getenv('OUTBOX_CLAIM_SECONDS', '300'))
+
+# Нативные async-представления публичных эндпоинтов чтения (включается в config/asgi.py)
+ASYNC_PUBLIC_VIEWS = os.getenv('ASYNC_PUBLIC_VIEWS', 'False') == 'True'
+
+# Метрики производительности по эндпоинтам (см. api/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# Каталог для объединения метрик воркеров Gunicorn (очищать при каждом деплое)
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+# Ключ сборщика (Prometheus bearer_token) для /metrics; без него доступ только сотрудникам
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
@@ -1,8 +1,116 @@
+import os
+import threading
+from functools import partial
+
+import psycopg2
+import psycopg2.extras
 from django.db.backends.postgresql import base as postgresql
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
 
+from .pool import ConnectionPool, abandon
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _connect(conn_params, isolation_level):
+    """
+    Открывает соединение для пула так же, как postgresql.DatabaseWrapper.get_new_connection,
+    но без обёртки: пул общий для потоков, а обёртки у каждого потока свои.
+    """
+    connection = psycopg2.connect(**conn_params)
+    if isolation_level is not None:
+        connection.isolation_level = IsolationLevel(isolation_level)
+    # Как в Django: JSONField декодирует сам, без лишнего json.loads в psycopg2
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
 class DatabaseWrapper(postgresql.DatabaseWrapper):
+    """
+    Бэкенд PostgreSQL с отключаемой установкой часового пояса и пулом
+    соединений psycopg2. Пул включается ключом POOL в настройках базы:
+
+        'POOL': {'min_size': 2, 'max_size': 20, 'timeout': 10,
+                 'max_lifetime': 3600, 'max_idle': 600}
+
+    Проверка живости соединений при выдаче включается CONN_HEALTH_CHECKS.
+    """
+
     def _configure_timezone(self, connection):
         if getattr(settings, 'POSTGRES_DISABLE_TIMEZONE_SET', False):
             return False  # Не устанавливаем часовой пояс
-        return super()._configure_timezone(connection) 
\ No newline at end of file
+        return super()._configure_timezone(connection)
+
+    @property
+    def connection_pool(self):
+        pool_options = self.settings_dict.get('POOL')
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+        if self.settings_dict.get('CONN_MAX_AGE', 0) != 0:
+            raise ImproperlyConfigured('Пул соединений несовместим с CONN_MAX_AGE != 0')
+
+        # NAME в ключе: тестовая база получает собственный пул
+        key = (self.alias, self.settings_dict['NAME'])
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None or pool.pid != os.getpid():
+                    # После fork соединения родителя не закрываем: сокеты общие
+                    options = {} if pool_options is True else pool_options
+                    pool = _pools[key] = ConnectionPool(
+                        connect=partial(
+                            _connect, self.get_connection_params(),
+                            self.settings_dict['OPTIONS'].get('isolation_level'),
+                        ),
+                        check=self.settings_dict['CONN_HEALTH_CHECKS'],
+                        **options,
+                    )
+        return pool
+
+    def get_new_connection(self, conn_params):
+        pool = self.connection_pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.getconn()
+        self._connection_pid = os.getpid()
+        # Уровень изоляции выставлен при создании соединения; восстанавливаем атрибут обёртки
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = IsolationLevel(isolation_level) if isolation_level is not None else IsolationLevel.READ_COMMITTED
+        return connection
+
+    def _close(self):
+        pool = self.connection_pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if getattr(self, '_connection_pid', None) != os.getpid():
+                # Соединение открыто до fork и живо в родителе: Terminate его бы закрыл
+                abandon(self.connection)
+            else:
+                pool.putconn(self.connection)
+            # Соединение уже может быть выдано другому потоку
+            self.connection = None
+
+    def close_pool(self):
+        # Вызывается тестовым раннером перед созданием и удалением тестовой базы:
+        # простаивающие соединения пула не дадут выполнить DROP DATABASE.
+        # Закрываем пулы всех алиасов этой базы (реплики в тестах её зеркалируют)
+        with _pools_lock:
+            for key in [key for key in _pools if key[1] == self.settings_dict['NAME']]:
+                _pools.pop(key).close()
+
+    def close_if_health_check_failed(self):
+        if self.connection_pool is not None:
+            # Пул сам проверяет соединения при выдаче
+            return
+        return super().close_if_health_check_failed()
+
+
+def pool_stats():
+    """Статистика пулов текущего процесса: {(alias, база): {...}}."""
+    return {key: pool.stats() for key, pool in list(_pools.items()) if pool.pid == os.getpid()}
@@ -0,0 +1,276 @@
+"""
+Пул соединений psycopg2 для кастомного бэкенда PostgreSQL.
+
+Встроенный в Django пул (OPTIONS['pool']) требует psycopg 3, поэтому для
+psycopg2 держим свой: потокобезопасный, с ограничением размера, проверкой
+живости соединений, максимальным временем жизни и таймаутом простоя.
+Один пул на процесс и базу; после fork (gunicorn --preload) пул создаётся заново.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class _Entry:
+    __slots__ = ('connection', 'created_at', 'last_used')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=0, max_size=10, timeout=10.0,
+                 max_lifetime=3600.0, max_idle=600.0, check=False):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError('Некорректные размеры пула: нужно 0 <= min_size <= max_size, max_size >= 1')
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check = check
+
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()
+        self._in_use = {}
+        self._opening = 0
+        self._filled = False
+        self._closed = False
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds_total': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+        }
+
+    # --- Выдача и возврат соединений ---
+
+    def getconn(self):
+        self._ensure_filled()
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_started = time.monotonic()
+        with self._available:
+            while True:
+                entry = self._pop_idle()
+                if entry is not None:
+                    self._in_use[id(entry.connection)] = entry
+                    break
+                if self._size() < self.max_size:
+                    # Резервируем слот и открываем соединение вне блокировки
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'Не удалось получить соединение из пула за {self.timeout} с '
+                        f'(max_size={self.max_size})'
+                    )
+                waited = True
+                self._available.wait(remaining)
+
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_seconds_total'] += time.monotonic() - wait_started
+
+        if entry is None:
+            entry = self._open_reserved()
+            with self._lock:
+                # Слот переходит из «открывается» в «выдано» атомарно
+                self._opening -= 1
+                self._in_use[id(entry.connection)] = entry
+            return entry.connection
+
+        if self.check and not self._is_healthy(entry.connection):
+            with self._lock:
+                self._in_use.pop(id(entry.connection), None)
+                self._stats['health_check_failures'] += 1
+            self._discard(entry)
+            return self.getconn()
+        return entry.connection
+
+    def putconn(self, connection):
+        with self._lock:
+            entry = self._in_use.pop(id(connection), None)
+        if entry is not None and self._closed:
+            self._discard(entry)
+            return
+        if entry is None:
+            # Соединение не из этого пула (пул пересоздан): не закрываем — оно может
+            # быть общим с другим процессом; соединения до fork бэкенд отпускает
+            # через abandon(), свои закроются сборщиком мусора
+            return
+
+        if not self._reset(connection) or self._expired(entry, time.monotonic()):
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._available:
+            self._idle.append(entry)
+            self._prune_idle()
+            self._available.notify()
+
+    def close(self):
+        """Закрывает простаивающие соединения; выданные закроются при возврате."""
+        with self._lock:
+            self._closed = True
+            entries = list(self._idle)
+            self._idle.clear()
+        for entry in entries:
+            self._close_connection(entry.connection)
+        with self._lock:
+            self._stats['connections_closed'] += len(entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'size': self._size(),
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            }
+
+    # --- Внутреннее ---
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _pop_idle(self):
+        """Берёт последнее возвращённое соединение, попутно закрывая устаревшие."""
+        now = time.monotonic()
+        while self._idle:
+            entry = self._idle.pop()
+            if not self._expired(entry, now) and not entry.connection.closed:
+                return entry
+            self._close_connection(entry.connection)
+            self._stats['connections_closed'] += 1
+        return None
+
+    def _prune_idle(self):
+        # Самые давно простаивающие соединения лежат в начале очереди
+        now = time.monotonic()
+        while self._idle and self._size() > self.min_size and now - self._idle[0].last_used > self.max_idle:
+            self._close_connection(self._idle.popleft().connection)
+            self._stats['connections_closed'] += 1
+
+    def _expired(self, entry, now):
+        return self.max_lifetime is not None and now - entry.created_at > self.max_lifetime
+
+    def _open_reserved(self):
+        """Открывает соединение под зарезервированный слот; слот освобождает вызывающий."""
+        try:
+            connection = self._connect()
+        except BaseException:
+            with self._available:
+                self._opening -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._stats['connections_created'] += 1
+        return _Entry(connection)
+
+    def _ensure_filled(self):
+        """При первом обращении в фоне дозаполняет пул до min_size."""
+        if self._filled or self.min_size < 1:
+            return
+        with self._lock:
+            if self._filled:
+                return
+            self._filled = True
+        threading.Thread(target=self._fill, name='db-pool-fill', daemon=True).start()
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                if self._closed or self._size() >= self.min_size:
+                    return
+                self._opening += 1
+            try:
+                entry = self._open_reserved()
+            except psycopg2.Error:
+                return
+            with self._available:
+                self._opening -= 1
+                self._idle.appendleft(entry)
+                self._available.notify()
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _reset(self, connection):
+        """Откатывает незавершённую транзакцию; False — соединение надо закрыть."""
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+            return True
+        # ACTIVE или UNKNOWN: запрос ещё выполняется или связь потеряна
+        return False
+
+    def _discard(self, entry):
+        self._close_connection(entry.connection)
+        with self._available:
+            self._stats['connections_closed'] += 1
+            self._available.notify()
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+def abandon(connection):
+    """
+    Отпускает соединение, унаследованное от родительского процесса, не отправляя
+    серверу Terminate: сокет подменяется на /dev/null только в этом процессе,
+    и close() libpq пишет прощальное сообщение в никуда. Сокет родителя не затронут.
+    """
+    try:
+        fd = connection.fileno()
+    except psycopg2.Error:
+        return
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(devnull, fd)
+    finally:
+        os.close(devnull)
+    try:
+        connection.close()
+    except psycopg2.Error:
+        pass